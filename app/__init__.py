@@ -16,11 +16,16 @@ bc = Bcrypt()
 jwt = JWTManager()
 sched = BackgroundScheduler(daemon=True)
 
-def init_app():
+# run_ingest_workers is set by the serving entry point (wsgi.py). Scripts and CLI commands that build the app
+# leave it off so they never claim submissions from the ingest queue
+def init_app(run_ingest_workers=False):
     # Construct core application
     app = Flask(__name__)
     app.config.from_pyfile('config.py')
     app.config['rio_env'] = os.getenv('RIO_ENV')
+    # Pool that records checkout waits for /metrics/db_pool/
+    from .db_pool import MeteredQueuePool
+    app.config['SQLALCHEMY_ENGINE_OPTIONS']['poolclass'] = MeteredQueuePool
     CORS(app)
 
     # Initialize Plugins
@@ -38,6 +43,7 @@ def init_app():
     with app.app_context():
         #import routes
         from .views import populate_db
+        from .views import ingest_queue
         from .views import user
         from .views import db_setup
         from .views import recreate_stat_files
@@ -52,6 +58,8 @@ def init_app():
         from .views import sql_exec
         from .views import reverify_emails
         from .views import db_manage
+        from .views import metrics
+        from . import bulk_load
         # from .views import log
 
         daily_trigger = CronTrigger(year="*", month="*", day="*", hour="6", minute="0", second="0")
@@ -61,4 +69,13 @@ def init_app():
         #create sql tables for data models
         db.create_all()
 
+        # Keep the static Character/ChemistryTable rows in memory for hot paths
+        from .character_cache import load_character_cache
+        load_character_cache()
+
+        # Background writers for stat files staged by /populate_db/, started with the first request so
+        # `flask <command>` (FLASK_APP=wsgi.py) loads the serving app without running them
+        if run_ingest_workers and app.config['INGEST_ASYNC']:
+            app.before_first_request(lambda: ingest_queue.start_ingest_workers(app))
+
         return app
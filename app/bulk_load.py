@@ -0,0 +1,416 @@
+from flask import current_app as app
+from werkzeug.exceptions import HTTPException
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from .models import *
+from .consts import *
+from .character_cache import is_captain_eligible
+from .game_index import index_games, backfill_game_index
+from .stat_rollups import rollup_games, backfill_rollups, check_rollups
+from .stat_file_rows import ROW_REFERENCES, parse_game_id, transform_stat_file
+from .views.populate_db import reserve_row_ids, resolve_row_references, validate_stat_file, record_game_result
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from decimal import Decimal, ROUND_HALF_UP
+import click
+import glob
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import psycopg2
+import queue
+import threading
+import time
+
+# Backfill loader for directories of stat files (ex. re-importing a season after /wipe_db/).
+# Files are mapped with the same functions as /populate_db/, then each batch of games is written with
+# one COPY FROM STDIN per table. Ids are reserved per table for the whole batch before the COPY data
+# is built, so the rows go in with their final ids and never collide with /populate_db/ or other writers.
+# Preparing a batch (read, validate, transform, reserve ids, format) can run in a pool of worker processes
+# that feed one or more writer connections.
+
+# Tables in insert order (parents first) with the key used by transform_stat_file
+COPY_TABLES = [
+    ('games', Game),
+    ('character_position_summaries', CharacterPositionSummary),
+    ('character_game_summaries', CharacterGameSummary),
+    ('runners', Runner),
+    ('fielding_summaries', FieldingSummary),
+    ('contact_summaries', ContactSummary),
+    ('pitch_summaries', PitchSummary),
+    ('events', Event),
+]
+
+# Stages reported by run_backfill
+BACKFILL_STAGES = ['read', 'validate', 'transform', 'reserve_ids', 'format', 'copy', 'history']
+
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'})
+
+# Postgres COPY text format
+def copy_value(value):
+    value_type = type(value)
+    if value_type is int or value_type is float:
+        return str(value)
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, str):
+        return value.translate(COPY_ESCAPES)
+    return str(value)
+
+# COPY does not cast like an INSERT does, so floats sent to integer columns (ex. pitch_summary.ball_position_strikezone)
+# are rounded the way Postgres rounds a numeric literal (half away from zero)
+def copy_integer_value(value):
+    if type(value) is float:
+        value = int(Decimal(repr(value)).to_integral_value(ROUND_HALF_UP))
+    return copy_value(value)
+
+# Returns (column names, COPY text) for rows whose references have been swapped for ids
+def format_copy_rows(model, rows):
+    columns = [column for column in model.__table__.columns if column.name in rows[0]]
+    formatters = [(column.name, copy_integer_value if isinstance(column.type, db.Integer) else copy_value) for column in columns]
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join([formatter(row[name]) for name, formatter in formatters]))
+        buffer.write('\n')
+    return [column.name for column in columns], buffer.getvalue()
+
+def new_game_rows():
+    return {rows_key: list() for rows_key, model in COPY_TABLES}
+
+def new_stage_timings():
+    return dict.fromkeys(BACKFILL_STAGES, 0.0)
+
+def read_stat_file(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+# Read, validate and transform a batch of stat files, reserve ids for every row and format the COPY data.
+# Runs in the backfill worker processes (or in process when there are none), writers only run the COPY
+# Returns {'games': [game info], 'copy_data': [(table, columns, text)], 'failures': [(path, error)], 'timings': {stage: seconds}}
+def prepare_stat_file_batch(paths):
+    timings = new_stage_timings()
+    failures = list()
+    games = list()
+    rows = new_game_rows()
+
+    stage_start = time.time()
+    stat_files = list()
+    for path in paths:
+        try:
+            stat_file = read_stat_file(path)
+            stat_files.append((path, stat_file, parse_game_id(stat_file)))
+        except (OSError, ValueError) as e:
+            failures.append((path, f'Could not read stat file: {e}'))
+        except (KeyError, AttributeError, TypeError):
+            failures.append((path, 'Missing or invalid GameID'))
+    timings['read'] += time.time() - stage_start
+
+    # Stat files that were already written are skipped so a partial backfill can be run again
+    existing_query = text('SELECT game_id FROM game WHERE game_id = ANY(:game_ids)')
+    existing_game_ids = set(db.session.execute(existing_query, {'game_ids': [game_id for path, stat_file, game_id in stat_files]}).scalars().all())
+
+    for path, stat_file, game_id in stat_files:
+        if game_id in existing_game_ids:
+            failures.append((path, f'Game {game_id} already exists'))
+            continue
+
+        stage_start = time.time()
+        try:
+            home_player, away_player, tag_set = validate_stat_file(stat_file)
+        except HTTPException as e:
+            failures.append((path, f'{e.code} {e.description}'))
+            continue
+        finally:
+            timings['validate'] += time.time() - stage_start
+
+        stage_start = time.time()
+        try:
+            game_rows = transform_stat_file(stat_file, game_id, home_player.id, away_player.id, is_captain_eligible)
+        except (KeyError, IndexError, TypeError, ValueError, AttributeError) as e:
+            failures.append((path, f'Could not map stat file: {e!r}'))
+            continue
+        finally:
+            timings['transform'] += time.time() - stage_start
+
+        for rows_key, model in COPY_TABLES:
+            rows[rows_key].extend(game_rows[rows_key])
+        existing_game_ids.add(game_id)
+        games.append({
+            'path': path,
+            'game_id': game_id,
+            'date_time_start': game_rows['games'][0]['date_time_start'],
+            'home_score': stat_file['Home Score'],
+            'away_score': stat_file['Away Score'],
+            'home_player_id': home_player.id,
+            'away_player_id': away_player.id,
+            'tag_set_id': tag_set.id,
+        })
+
+    # Ids come from each table's sequence, so batches prepared by different workers never overlap
+    stage_start = time.time()
+    for rows_key, model in COPY_TABLES:
+        if rows_key != 'games':
+            reserve_row_ids(model, rows[rows_key])
+    db.session.commit()
+    for rows_key, columns in ROW_REFERENCES.items():
+        resolve_row_references(rows[rows_key], columns)
+    timings['reserve_ids'] += time.time() - stage_start
+
+    stage_start = time.time()
+    copy_data = list()
+    for rows_key, model in COPY_TABLES:
+        if len(rows[rows_key]) > 0:
+            columns, copy_text = format_copy_rows(model, rows[rows_key])
+            copy_data.append((model.__tablename__, columns, copy_text))
+    timings['format'] += time.time() - stage_start
+
+    return {'games': games, 'copy_data': copy_data, 'failures': failures, 'timings': timings}
+
+# COPY a prepared batch in one transaction. One bad row fails the whole batch
+# Returns (written games, failures, timings)
+def write_prepared_batch(prepared):
+    timings = new_stage_timings()
+    games = prepared['games']
+    if len(games) == 0:
+        return games, list(), timings
+
+    stage_start = time.time()
+    try:
+        cursor = db.session.connection().connection.cursor()
+        for table, columns, copy_text in prepared['copy_data']:
+            cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', io.StringIO(copy_text))
+        db.session.execute(text('DELETE FROM ongoing_game WHERE game_id = ANY(:game_ids)'), {'game_ids': [game['game_id'] for game in games]})
+        # Tags are filled in when each game's GameHistory is recorded
+        index_games([game['game_id'] for game in games])
+        rollup_games([game['game_id'] for game in games])
+        db.session.commit()
+    except (SQLAlchemyError, psycopg2.Error) as e:
+        db.session.rollback()
+        return list(), [(game['path'], f'Batch not written: {e}') for game in games], timings
+    finally:
+        timings['copy'] += time.time() - stage_start
+
+    return games, list(), timings
+
+# GameHistory and elo for every written game in the order the games were played, one game per commit like /populate_db/
+def record_game_results(games):
+    failures = list()
+    players = dict()
+    for game in sorted(games, key=lambda game: (game['date_time_start'], game['game_id'])):
+        for player_id in [game['home_player_id'], game['away_player_id']]:
+            if player_id not in players:
+                players[player_id] = RioUser.query.filter_by(id=player_id).first()
+        try:
+            record_game_result(game['game_id'], game['home_score'], game['away_score'], players[game['home_player_id']], players[game['away_player_id']], game['tag_set_id'])
+        except HTTPException as e:
+            db.session.rollback()
+            failures.append((game['path'], f'GameHistory not written: {e.code} {e.description}'))
+    return failures
+
+# Backfill workers are forked from the process running the backfill and push a context for its app
+_backfill_app = None
+
+def init_backfill_worker():
+    _backfill_app.app_context().push()
+
+# Yields prepared batches as they finish. At most two batches per worker are in flight so
+# prepared COPY data can't pile up faster than the writers drain it
+def prepared_batches(app, batches, workers):
+    if workers == 0:
+        for batch in batches:
+            yield prepare_stat_file_batch(batch)
+        return
+
+    global _backfill_app
+    _backfill_app = app
+    # Forked workers must open their own connections instead of inheriting the pool's
+    db.session.remove()
+    db.engine.dispose()
+
+    context = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=init_backfill_worker) as pool:
+        remaining = iter(batches)
+        pending = dict()
+        for batch in itertools.islice(remaining, workers * 2):
+            pending[pool.submit(prepare_stat_file_batch, batch)] = batch
+        while len(pending) > 0:
+            done, not_done = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch = pending.pop(future)
+                try:
+                    prepared = future.result()
+                except Exception as e:
+                    prepared = {'games': list(), 'copy_data': list(), 'failures': [(path, f'Backfill worker failed: {e!r}') for path in batch], 'timings': new_stage_timings()}
+                for next_batch in itertools.islice(remaining, 1):
+                    pending[pool.submit(prepare_stat_file_batch, next_batch)] = next_batch
+                yield prepared
+
+def backfill_writer(app, batch_queue, add_result):
+    with app.app_context():
+        try:
+            while True:
+                prepared = batch_queue.get()
+                if prepared == None:
+                    return
+                add_result(prepared, write_prepared_batch(prepared))
+        finally:
+            db.session.remove()
+
+# Load stat files with `workers` processes preparing batches and `writers` connections running the COPYs
+# (workers=0 prepares in this process, writers=1 writes on this process's connection). Call inside an app context
+# Returns {'files', 'games', 'failures', 'elapsed', 'timings'}. Stage timings are summed over every worker and writer
+def run_backfill(app, paths, workers=0, writers=1, batch_size=cBULK_LOAD_BATCH, skip_history=False, progress=None):
+    start = time.time()
+    report = {'files': len(paths), 'games': list(), 'failures': list(), 'timings': new_stage_timings()}
+    batches = [paths[batch_start:batch_start + batch_size] for batch_start in range(0, len(paths), batch_size)]
+    report_lock = threading.Lock()
+
+    def add_result(prepared, result):
+        games, failures, timings = result
+        with report_lock:
+            report['games'].extend(games)
+            report['failures'].extend(prepared['failures'] + failures)
+            for stage in BACKFILL_STAGES:
+                report['timings'][stage] += prepared['timings'][stage] + timings[stage]
+            if progress != None:
+                progress(report)
+
+    if writers <= 1:
+        for prepared in prepared_batches(app, batches, workers):
+            add_result(prepared, write_prepared_batch(prepared))
+    else:
+        batch_queue = queue.Queue(maxsize=writers * 2)
+        writer_threads = [threading.Thread(target=backfill_writer, args=[app, batch_queue, add_result], name=f'backfill-writer-{index}') for index in range(writers)]
+        for thread in writer_threads:
+            thread.start()
+        for prepared in prepared_batches(app, batches, workers):
+            batch_queue.put(prepared)
+        for thread in writer_threads:
+            batch_queue.put(None)
+        for thread in writer_threads:
+            thread.join()
+
+    if not skip_history:
+        stage_start = time.time()
+        report['failures'].extend(record_game_results(report['games']))
+        report['timings']['history'] += time.time() - stage_start
+
+    report['elapsed'] = time.time() - start
+    return report
+
+def format_backfill_report(report):
+    elapsed = report['elapsed']
+    games = len(report['games'])
+    games_per_minute = games / elapsed * 60 if elapsed > 0 else 0
+    lines = [f'FAILED {path}: {error}' for path, error in report['failures']]
+    lines.append(f'Loaded {games}/{report["files"]} games in {elapsed:.2f}s ({games_per_minute:.0f} games/min), {len(report["failures"])} failures')
+    lines.append('Stage timings (seconds, summed over workers and writers):')
+    for stage in BACKFILL_STAGES:
+        lines.append(f'    {stage:<12}{report["timings"][stage]:.2f}')
+    return '\n'.join(lines)
+
+'''
+@ Description: Bulk load a directory of stat files with COPY FROM STDIN
+@ Params:
+    - directory - Directory of stat file .json files, loaded in file name order
+    - batch-size - Stat files written per transaction
+    - workers - Processes reading, validating and transforming stat files (0 = in process)
+    - writers - Connections running the COPYs
+    - skip-history - Only write stat rows (no GameHistory rows or elo updates)
+@ Output:
+    - Games loaded, failed files with the reason, games per minute and per stage timings
+'''
+@app.cli.command('bulk-load')
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--batch-size', default=cBULK_LOAD_BATCH, show_default=True, help='Stat files written per transaction')
+@click.option('--workers', default=0, show_default=True, help='Processes preparing stat files, 0 prepares them in this process')
+@click.option('--writers', default=1, show_default=True, help='Connections writing prepared batches')
+@click.option('--skip-history', is_flag=True, help='Only write stat rows, no GameHistory or elo updates')
+def bulk_load_command(directory, batch_size, workers, writers, skip_history):
+    paths = sorted(glob.glob(os.path.join(directory, '*.json')))
+    click.echo(f'Loading {len(paths)} stat files from {directory}')
+
+    def progress(report):
+        click.echo(f'{len(report["games"])} games loaded, {len(report["failures"])} failures')
+
+    report = run_backfill(app._get_current_object(), paths, workers, writers, batch_size, skip_history, progress)
+    click.echo(format_backfill_report(report))
+
+
+'''
+@ Description: Write game_index rows for games already in the database
+@ Params:
+    - batch-size - Games indexed per transaction
+    - missing - Only index games without a game_index row
+@ Output:
+    - Number of games indexed
+'''
+@app.cli.command('index-games')
+@click.option('--batch-size', default=cGAME_INDEX_BATCH, show_default=True, help='Games indexed per transaction')
+@click.option('--missing', is_flag=True, help='Only index games without a game_index row')
+def index_games_command(batch_size, missing):
+    start = time.time()
+
+    def progress(indexed):
+        click.echo(f'{indexed} games indexed')
+
+    indexed = backfill_game_index(batch_size, missing, progress)
+    click.echo(f'Indexed {indexed} games in {time.time() - start:.2f}s')
+
+
+'''
+@ Description: Write the rollup and event_fact rows (see stat_rollups) of games already in the database
+@ Params:
+    - batch-size - Games rolled up per transaction
+    - missing - Only roll up games without rollup rows
+@ Output:
+    - Number of games rolled up
+'''
+@app.cli.command('rollup-games')
+@click.option('--batch-size', default=cSTAT_ROLLUP_BATCH, show_default=True, help='Games rolled up per transaction')
+@click.option('--missing', is_flag=True, help='Only roll up games without rollup rows')
+def rollup_games_command(batch_size, missing):
+    start = time.time()
+
+    def progress(rolled_up):
+        click.echo(f'{rolled_up} games rolled up')
+
+    rolled_up = backfill_rollups(batch_size, missing, progress)
+    click.echo(f'Rolled up {rolled_up} games in {time.time() - start:.2f}s')
+
+
+'''
+@ Description: Recompute the rollup and event_fact rows from the raw stat tables and report rows that drifted
+@ Params:
+    - game - Game ids to check, every game if not provided
+    - batch-size - Games checked per query
+    - fix - Rewrite the rollups of games that drifted
+@ Output:
+    - One line per drifted row with the stored and recomputed values, exits with 1 if any drifted and weren't fixed
+'''
+@app.cli.command('check-rollups')
+@click.option('--game', 'game_ids', type=int, multiple=True, help='Game id to check, repeatable')
+@click.option('--batch-size', default=cSTAT_ROLLUP_BATCH, show_default=True, help='Games checked per query')
+@click.option('--fix', is_flag=True, help='Rewrite the rollups of games that drifted')
+def check_rollups_command(game_ids, batch_size, fix):
+    def progress(checked, drifted):
+        click.echo(f'{checked} games checked, {drifted} rows drifted')
+
+    drift = check_rollups(list(game_ids) if len(game_ids) > 0 else None, batch_size, progress)
+    for row in drift:
+        changed = {column: (row['stored'][column], row['fresh'][column]) for column in row['fresh'] if row['stored'][column] != row['fresh'][column]}
+        click.echo(f'{row["table"]} {row["key"]}: {changed}')
+
+    if fix and len(drift) > 0:
+        drifted_game_ids = sorted({row['stored']['game_id'] if row['stored']['game_id'] != None else row['fresh']['game_id'] for row in drift})
+        rollup_games(drifted_game_ids)
+        db.session.commit()
+        click.echo(f'Rewrote rollups of {len(drifted_game_ids)} games')
+
+    if len(drift) > 0 and not fix:
+        raise SystemExit(1)
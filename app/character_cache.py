@@ -0,0 +1,60 @@
+from types import MappingProxyType
+from .models import Character, ChemistryTable
+
+# Character and ChemistryTable rows only change when create_character_tables runs, so each process
+# keeps one read-only copy of them instead of querying the tables on hot paths.
+# Loaded by init_app, dropped by create_character_tables (/wipe_db/, /init_db/) and reloaded on next use.
+# Rows are built from ./json/characters.json so every process loads the same values.
+_cache = None
+
+def row_to_mapping(row):
+    return MappingProxyType({column.name: getattr(row, column.name) for column in row.__table__.columns})
+
+def load_character_cache():
+    global _cache
+    characters = Character.query.order_by(Character.char_id).all()
+    chemistry_tables = ChemistryTable.query.all()
+
+    # Build everything first and swap it in with one assignment so readers never see a partial cache
+    _cache = MappingProxyType({
+        'characters': MappingProxyType({character.char_id: row_to_mapping(character) for character in characters}),
+        'char_ids_by_name': MappingProxyType({character.name_lowercase: character.char_id for character in characters}),
+        'character_dicts': tuple(MappingProxyType(character.to_dict()) for character in characters),
+        'chemistry_tables': MappingProxyType({table.id: row_to_mapping(table) for table in chemistry_tables}),
+    })
+    return _cache
+
+def invalidate_character_cache():
+    global _cache
+    _cache = None
+
+def get_character_cache():
+    cache = _cache
+    if cache == None:
+        cache = load_character_cache()
+    return cache
+
+# Returns the Character row for char_id as a read-only mapping, or None
+def get_character(char_id):
+    return get_character_cache()['characters'].get(char_id)
+
+def get_chemistry_table(chemistry_table_id):
+    return get_character_cache()['chemistry_tables'].get(chemistry_table_id)
+
+# Characters that can be captain pay an extra star for non-captain star swings/pitches
+def is_captain_eligible(char_id):
+    character = get_character(char_id)
+    return character != None and character['captain'] == 1
+
+# Converts a list of character names (any case) to char_ids, skipping unknown names
+def get_char_ids(names):
+    char_ids_by_name = get_character_cache()['char_ids_by_name']
+    return [char_ids_by_name[name.lower()] for name in names if name.lower() in char_ids_by_name]
+
+# Character.to_dict() output for /characters/. Returns every character when names is empty
+def get_character_dicts(names=None):
+    character_dicts = get_character_cache()['character_dicts']
+    if names:
+        names_lowercase = [name.lower() for name in names]
+        return [dict(character) for character in character_dicts if character['name'].lower() in names_lowercase]
+    return [dict(character) for character in character_dicts]
@@ -26,4 +26,59 @@ JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_TOKEN_LOCATION = ['cookies']
 JWT_COOKIE_SECURE = True
 JWT_COOKIE_CSRF_PROTECT = True
-JWT_ACCESS_TOKEN_EXPIRES = timedelta(weeks=2)
\ No newline at end of file
+JWT_ACCESS_TOKEN_EXPIRES = timedelta(weeks=2)
+# INGEST QUEUE CONFIG
+# When enabled /populate_db/ stages stat files and returns 202, background workers in the serving process (wsgi.py) write them
+INGEST_ASYNC = os.getenv("INGEST_ASYNC", "False").lower() == "true"
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", 2))
+INGEST_POLL_INTERVAL = float(os.getenv("INGEST_POLL_INTERVAL", 1))
+# Seconds before a submission stuck in Processing (worker died) is picked up again
+INGEST_CLAIM_TIMEOUT = int(os.getenv("INGEST_CLAIM_TIMEOUT", 600))
+# Claims a submission gets. One still Processing after its last claim timed out is marked Failed (status_code 504)
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", 3))
+
+# DB POOL CONFIG
+# Each gunicorn worker process has its own pool, so the db sees up to workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+# Seconds to wait for a connection before giving up
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 30))
+# Seconds before a connection is replaced, -1 keeps connections forever
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "True").lower() == "true"
+# Milliseconds before postgres cancels a statement, 0 disables the timeout
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 0))
+
+# Connections one /detailed_stats/ request may use at once for its independent queries (on top of its own session).
+# 1 runs them one after another on the request's session. The extra connections come out of the same pool
+DETAILED_STATS_FANOUT = int(os.getenv("DETAILED_STATS_FANOUT", 1))
+
+# Answer /star_chances/ requests without event level filters from star_chance_rollup instead of the event table.
+# Run `flask rollup-games` once before turning it on so games stored before the table existed have rows
+STAR_CHANCE_ROLLUPS = os.getenv("STAR_CHANCE_ROLLUPS", "False").lower() == "true"
+
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': DB_POOL_SIZE,
+    'max_overflow': DB_MAX_OVERFLOW,
+    'pool_timeout': DB_POOL_TIMEOUT,
+    'pool_recycle': DB_POOL_RECYCLE,
+    'pool_pre_ping': DB_POOL_PRE_PING,
+    'connect_args': {'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT}'} if DB_STATEMENT_TIMEOUT > 0 else {},
+}
+
+# NAME CACHE CONFIG
+# Username and tag name -> id lookups for stat retrieval filters, per process
+NAME_CACHE_SIZE = int(os.getenv("NAME_CACHE_SIZE", 10000))
+# Seconds a resolved name is trusted. Bounds how long other processes can see a renamed user or tag
+NAME_CACHE_TTL = int(os.getenv("NAME_CACHE_TTL", 300))
+
+# RESPONSE CACHE CONFIG
+# Cached JSON responses of the stat retrieval endpoints. local (per process), redis (shared) or none
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "local")
+RESPONSE_CACHE_URL = os.getenv("RESPONSE_CACHE_URL", "redis://localhost:6379/0")
+# Entries kept by the local backend
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", 1000))
+# Seconds an entry is served. Bounds staleness from writes that don't bump a generation (renames, elo updates).
+# The local backend only sees the bumps of its own process, so it defaults to a short TTL: with several app
+# processes a write can take this long to show up on the others. Use redis to invalidate across processes
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 30 if RESPONSE_CACHE_BACKEND == 'local' else 300))
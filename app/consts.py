@@ -62,6 +62,36 @@ cPATREON_TIERS = ['Patron: Fan', 'Patron: Rookie', 'Patron: MVP', 'Patron: Hall
 
 cACTIVE_TAGSET_LIMIT = 5
 
+# Stat file ingest. Bytes read from the request per chunk, events written per batch
+cSTAT_FILE_CHUNK_SIZE = 64 * 1024
+cSTAT_FILE_EVENT_BATCH = 250
+# Top level stat file fields that have to be read before events can be written
+cSTAT_FILE_HEADER_FIELDS = ['GameID', 'Date - Start', 'Date - End', 'Netplay', 'StadiumID', 'Away Player', 'Home Player',
+                            'Away Score', 'Home Score', 'Innings Selected', 'Innings Played', 'Quitter Team',
+                            'Average Ping', 'Lag Spikes', 'Version', 'TagSetID', 'Character Game Stats']
+# Response to a written stat file, repeated for retried submissions of the same stat file
+cSTAT_FILE_WRITTEN = 'Completed...'
+# Status code of async submissions given up on after every claim timed out (INGEST_MAX_ATTEMPTS)
+cINGEST_ABANDONED_STATUS_CODE = 504
+# Upper bounds (ms) of the db pool checkout latency histogram served by /metrics/db_pool/
+cDB_POOL_LATENCY_BUCKETS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+# Stat files written per COPY transaction by the bulk-load command
+cBULK_LOAD_BATCH = 200
+# Games written per transaction by the index-games command
+cGAME_INDEX_BATCH = 1000
+# Games rolled up (or checked) per transaction by the rollup-games and check-rollups commands
+cSTAT_ROLLUP_BATCH = 500
+# Rows fetched per round trip when streaming ndjson responses from a server side cursor
+cSTREAM_YIELD_PER = 1000
+# Default grids of /position_histograms/ (game units). Landing and fielder positions cover the field,
+# contact positions the area around the plate
+cPOSITION_HISTOGRAM_GRIDS = {
+    'landing': {'x_min': -100.0, 'x_max': 100.0, 'x_bins': 40, 'z_min': -10.0, 'z_max': 140.0, 'z_bins': 30},
+    'contact': {'x_min': -1.5, 'x_max': 1.5, 'x_bins': 30, 'z_min': -0.5, 'z_max': 2.5, 'z_bins': 30},
+    'fielder': {'x_min': -100.0, 'x_max': 100.0, 'x_bins': 40, 'z_min': -10.0, 'z_max': 140.0, 'z_bins': 30},
+}
+cPOSITION_HISTOGRAM_MAX_BINS = 500
+
 cCHAR_ALIASES = {
     "Mario": 0,
     "Luigi": 1,
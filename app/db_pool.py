@@ -0,0 +1,63 @@
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from .consts import cDB_POOL_LATENCY_BUCKETS
+import os
+import threading
+import time
+
+# QueuePool that records how long each checkout waited, served by /metrics/db_pool/.
+# Installed by init_app through SQLALCHEMY_ENGINE_OPTIONS['poolclass']. Counts are per process and
+# start over when the pool is recreated (engine.dispose())
+class MeteredQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics_lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_timeouts = 0
+        self.checkout_latency_sum = 0.0
+        # One count per bucket in cDB_POOL_LATENCY_BUCKETS plus one for slower checkouts
+        self.checkout_latency_counts = [0] * (len(cDB_POOL_LATENCY_BUCKETS) + 1)
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            with self.metrics_lock:
+                self.checkout_timeouts += 1
+            raise
+        self.record_checkout((time.perf_counter() - start) * 1000)
+        return connection
+
+    def record_checkout(self, latency_ms):
+        bucket = len(cDB_POOL_LATENCY_BUCKETS)
+        for index, upper_bound in enumerate(cDB_POOL_LATENCY_BUCKETS):
+            if latency_ms <= upper_bound:
+                bucket = index
+                break
+        with self.metrics_lock:
+            self.checkouts += 1
+            self.checkout_latency_sum += latency_ms
+            self.checkout_latency_counts[bucket] += 1
+
+    def metrics(self):
+        with self.metrics_lock:
+            # Cumulative counts per upper bound, like a prometheus histogram
+            histogram = dict()
+            cumulative = 0
+            for upper_bound, count in zip(cDB_POOL_LATENCY_BUCKETS + ['+Inf'], self.checkout_latency_counts):
+                cumulative += count
+                histogram[str(upper_bound)] = cumulative
+
+            return {
+                'pid': os.getpid(),
+                'pool_size': self.size(),
+                'max_overflow': self._max_overflow,
+                'checked_out': self.checkedout(),
+                'checked_in': self.checkedin(),
+                'overflow': max(self.overflow(), 0),
+                'checkouts': self.checkouts,
+                'checkout_timeouts': self.checkout_timeouts,
+                'checkout_latency_ms_sum': round(self.checkout_latency_sum, 3),
+                'checkout_latency_ms_buckets': histogram,
+            }
@@ -17,8 +17,7 @@ def api_key_check(acceptable_user_groups):
                 admin_key = request.json.get('ADMIN_KEY')
                 if (admin_key != os.getenv('ADMIN_KEY')):
                     return abort(460, description="No API Key, Rio Key or JWT Provided")
-                func(*args, **kwargs)
-                return
+                return func(*args, **kwargs)
 
             # Declare user var
             rio_user = None
@@ -65,8 +64,7 @@ def api_key_check(acceptable_user_groups):
                         db.session.add(api_key)
                         db.session.commit()
 
-                        func(*args, **kwargs)
-                        return
+                        return func(*args, **kwargs)
             return abort(464, 'You do not have valid permissions to use this endpoint.')
         return decorated_function
     return decorator
\ No newline at end of file
@@ -0,0 +1,35 @@
+from operator import itemgetter
+from .consts import cTYPE_OF_SWING
+
+# Builds the nested /detailed_stats/ response from the rows of its queries.
+# A row lands at [username][char_name][type_of_result][swing name], with each level only present when
+# the response is grouped by it, and its remaining columns are merged into the dict at that path.
+# The columns that make up the path and the stat columns are picked out once per query, so each row
+# costs one walk down the path and one update instead of a dict conversion and a chain of branches
+
+# Columns that place a row in the response. They are not returned as stats
+GROUP_COLUMNS = ('username', 'user_id', 'char_name', 'char_id', 'type_of_swing')
+
+# Merge the rows of one query into stat_dict. keys are the query's column names, rows tuples (or Rows) in that order
+def add_detailed_stats_rows(stat_dict, type_of_result, keys, rows, group_by_user=False, group_by_char=False, group_by_swing=False):
+    keys = list(keys)
+    stat_keys = [key for key in keys if key not in GROUP_COLUMNS]
+    stat_indices = [keys.index(key) for key in stat_keys]
+    path_indices = []
+    if group_by_user:
+        path_indices.append(keys.index('username'))
+    if group_by_char:
+        path_indices.append(keys.index('char_name'))
+    # itemgetter returns a bare value rather than a tuple for a single index
+    stat_values = itemgetter(*stat_indices) if len(stat_indices) > 1 else lambda row: tuple(row[index] for index in stat_indices)
+    swing_index = keys.index('type_of_swing') if group_by_swing else None
+
+    for row in rows:
+        target = stat_dict
+        for index in path_indices:
+            target = target.setdefault(row[index], {})
+        target = target.setdefault(type_of_result, {})
+        if swing_index != None:
+            target = target.setdefault(cTYPE_OF_SWING[row[swing_index]], {})
+        target.update(zip(stat_keys, stat_values(row)))
+    return stat_dict
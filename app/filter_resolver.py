@@ -0,0 +1,137 @@
+from flask import current_app
+from sqlalchemy import event, inspect, text
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from .models import db, RioUser, Tag
+from .util import lower_and_remove_nonalphanumeric
+from .character_cache import get_char_ids
+import threading
+import time
+
+# Resolves the name filters of the stat retrieval endpoints (username, tag, captain, ...) to ids.
+# Every name that isn't cached is looked up in one query, so a request pays at most one round trip
+# however many name filters it uses. Captains resolve through the character cache without a query.
+# Resolved user and tag names are kept in a per process LRU for NAME_CACHE_TTL seconds. Names that
+# don't exist aren't cached, so new users and tags are found right away. Entries are dropped when a
+# RioUser or Tag is renamed or deleted in this process, and the whole cache when the tables are recreated
+
+# Request args that hold names and the kind of name they hold
+NAME_FILTERS = {
+    'username': 'user',
+    'vs_username': 'user',
+    'exclude_username': 'user',
+    'tag': 'tag',
+    'exclude_tag': 'tag',
+    'captain': 'character',
+    'vs_captain': 'character',
+    'exclude_captain': 'character',
+}
+
+# Name column watched for renames per model
+NAME_COLUMNS = {
+    RioUser: ('user', 'username_lowercase'),
+    Tag: ('tag', 'name_lowercase'),
+}
+
+RESOLVE_NAMES_QUERY = text(
+    'SELECT \'user\' AS kind, username_lowercase AS name, id FROM rio_user WHERE username_lowercase = ANY(:user_names) \n'
+    'UNION ALL \n'
+    'SELECT \'tag\' AS kind, name_lowercase AS name, id FROM tag WHERE name_lowercase = ANY(:tag_names)'
+)
+
+class NameCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # (kind, name) -> (name_id, expires)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, kind, name):
+        with self.lock:
+            entry = self.entries.get((kind, name))
+            if entry == None or entry[1] < time.monotonic():
+                self.misses += 1
+                return None
+            self.entries.move_to_end((kind, name))
+            self.hits += 1
+            return entry[0]
+
+    def set(self, kind, name, name_id):
+        with self.lock:
+            self.entries[(kind, name)] = (name_id, time.monotonic() + self.ttl)
+            self.entries.move_to_end((kind, name))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, kind=None, name=None):
+        with self.lock:
+            if kind == None:
+                self.entries.clear()
+            elif name == None:
+                for key in [key for key in self.entries if key[0] == kind]:
+                    del self.entries[key]
+            else:
+                self.entries.pop((kind, name), None)
+
+_cache = None
+
+def get_name_cache():
+    global _cache
+    if _cache == None:
+        _cache = NameCache(current_app.config['NAME_CACHE_SIZE'], current_app.config['NAME_CACHE_TTL'])
+    return _cache
+
+def invalidate_name_cache(kind=None, name=None):
+    if _cache != None:
+        _cache.invalidate(kind, name)
+
+# Returns {kind: {name: id}} for the given lowercase user and tag names. Names that don't exist are left out
+def resolve_names(user_names, tag_names):
+    cache = get_name_cache()
+    resolved = {'user': dict(), 'tag': dict()}
+    uncached = {'user': list(), 'tag': list()}
+    for kind, names in [('user', user_names), ('tag', tag_names)]:
+        for name in set(names):
+            name_id = cache.get(kind, name)
+            if name_id == None:
+                uncached[kind].append(name)
+            else:
+                resolved[kind][name] = name_id
+
+    if len(uncached['user']) > 0 or len(uncached['tag']) > 0:
+        rows = db.session.execute(RESOLVE_NAMES_QUERY, {'user_names': uncached['user'], 'tag_names': uncached['tag']}).all()
+        for row in rows:
+            resolved[row.kind][row.name] = row.id
+            cache.set(row.kind, row.name, row.id)
+    return resolved
+
+# Returns {arg: [ids]} for every arg in NAME_FILTERS, in the order the names were given.
+# Unknown names are skipped, callers that require every name compare against len(args.getlist(arg))
+def resolve_filter_args(args):
+    names = {arg: args.getlist(arg) for arg in NAME_FILTERS}
+    user_names = [lower_and_remove_nonalphanumeric(name) for arg, kind in NAME_FILTERS.items() if kind == 'user' for name in names[arg]]
+    tag_names = [lower_and_remove_nonalphanumeric(name) for arg, kind in NAME_FILTERS.items() if kind == 'tag' for name in names[arg]]
+    resolved = resolve_names(user_names, tag_names)
+
+    filter_ids = dict()
+    for arg, kind in NAME_FILTERS.items():
+        if kind == 'character':
+            filter_ids[arg] = get_char_ids(names[arg])
+        else:
+            lowercase_names = [lower_and_remove_nonalphanumeric(name) for name in names[arg]]
+            filter_ids[arg] = [resolved[kind][name] for name in lowercase_names if name in resolved[kind]]
+    return filter_ids
+
+# Drop cached names of users and tags that are renamed or deleted
+@event.listens_for(Session, 'after_flush')
+def invalidate_changed_names(session, flush_context):
+    for instance in list(session.dirty) + list(session.deleted):
+        if type(instance) not in NAME_COLUMNS:
+            continue
+        kind, column = NAME_COLUMNS[type(instance)]
+        history = inspect(instance).attrs[column].history
+        if instance in session.deleted or history.has_changes():
+            for name in list(history.deleted) + list(history.unchanged):
+                invalidate_name_cache(kind, name)
@@ -0,0 +1,84 @@
+from sqlalchemy import text
+from .models import db
+
+# game_index keeps one row per game with the players, their usernames and captains, the game's tag ids
+# and its start/end times, so /games/ filters a single table instead of joining rio_user and
+# character_game_summary twice and grouping tags for every request.
+# Rows are (re)written when a game's GameHistory is recorded and when bulk-load writes a batch.
+# `flask index-games` rebuilds them for games written before the table existed.
+
+INDEX_GAMES_QUERY = text(
+    'INSERT INTO game_index (game_id, away_player_id, home_player_id, away_username, home_username, \n'
+    '   away_captain_id, home_captain_id, tag_ids, date_time_start, date_time_end) \n'
+    'SELECT DISTINCT ON (game.game_id) \n'
+    '   game.game_id, \n'
+    '   game.away_player_id, \n'
+    '   game.home_player_id, \n'
+    '   away_player.username, \n'
+    '   home_player.username, \n'
+    '   away_captain_cgs.char_id, \n'
+    '   home_captain_cgs.char_id, \n'
+    '   COALESCE(( \n'
+    '       SELECT array_agg(DISTINCT tag_set_tag.tag_id) \n'
+    '       FROM game_history \n'
+    '       JOIN tag_set_tag ON tag_set_tag.tagset_id = game_history.tag_set_id \n'
+    '       WHERE game_history.game_id = game.game_id \n'
+    '   ), \'{}\'), \n'
+    '   game.date_time_start, \n'
+    '   game.date_time_end \n'
+    'FROM game \n'
+    'LEFT JOIN rio_user AS away_player ON game.away_player_id = away_player.id \n'
+    'LEFT JOIN rio_user AS home_player ON game.home_player_id = home_player.id \n'
+    'LEFT JOIN character_game_summary AS away_captain_cgs \n'
+    '   ON game.game_id = away_captain_cgs.game_id \n'
+    '   AND away_captain_cgs.user_id = away_player.id \n'
+    '   AND away_captain_cgs.captain = True \n'
+    'LEFT JOIN character_game_summary AS home_captain_cgs \n'
+    '   ON game.game_id = home_captain_cgs.game_id \n'
+    '   AND home_captain_cgs.user_id = home_player.id \n'
+    '   AND home_captain_cgs.captain = True \n'
+    'WHERE game.game_id = ANY(:game_ids) \n'
+    'ORDER BY game.game_id \n'
+    'ON CONFLICT (game_id) DO UPDATE SET \n'
+    '   away_player_id = EXCLUDED.away_player_id, \n'
+    '   home_player_id = EXCLUDED.home_player_id, \n'
+    '   away_username = EXCLUDED.away_username, \n'
+    '   home_username = EXCLUDED.home_username, \n'
+    '   away_captain_id = EXCLUDED.away_captain_id, \n'
+    '   home_captain_id = EXCLUDED.home_captain_id, \n'
+    '   tag_ids = EXCLUDED.tag_ids, \n'
+    '   date_time_start = EXCLUDED.date_time_start, \n'
+    '   date_time_end = EXCLUDED.date_time_end'
+)
+
+# Write (or rewrite) the game_index rows of the given games. Joins the games' GameHistory rows,
+# so call after they are flushed. Does not commit
+def index_games(game_ids):
+    if len(game_ids) == 0:
+        return
+    db.session.execute(INDEX_GAMES_QUERY, {'game_ids': list(game_ids)})
+
+# Index every game in game_id order, committing every batch_size games. missing_only skips games that already have a row
+# Returns the number of games indexed
+def backfill_game_index(batch_size, missing_only=False, progress=None):
+    query = text(
+        'SELECT game.game_id FROM game \n'
+        f'{"LEFT JOIN game_index ON game.game_id = game_index.game_id " if missing_only else ""}'
+        'WHERE game.game_id > :last_game_id \n'
+        f'{"AND game_index.game_id IS NULL " if missing_only else ""}'
+        'ORDER BY game.game_id \n'
+        'LIMIT :batch_size'
+    )
+
+    indexed = 0
+    last_game_id = -1
+    while True:
+        game_ids = db.session.execute(query, {'last_game_id': last_game_id, 'batch_size': batch_size}).scalars().all()
+        if len(game_ids) == 0:
+            return indexed
+        index_games(game_ids)
+        db.session.commit()
+        indexed += len(game_ids)
+        last_game_id = game_ids[-1]
+        if progress != None:
+            progress(indexed)
@@ -1,5 +1,6 @@
 from . import db, bc
 from flask_login import UserMixin
+from sqlalchemy.dialects.postgresql import ARRAY
 from .util import *
 import time
 import secrets
@@ -330,6 +331,69 @@ class OngoingGame(db.Model):
         }
 
 
+# Raw stat files waiting to be written by the ingest workers (INGEST_ASYNC)
+class GameSubmission(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.BigInteger)
+    status = db.Column(db.String(16), index=True)
+    payload = db.Column(db.JSON)
+    status_code = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer)
+    date_created = db.Column(db.Integer)
+    date_started = db.Column(db.Integer, nullable=True)
+    date_completed = db.Column(db.Integer, nullable=True)
+
+    def __init__(self, in_game_id, in_payload):
+        self.game_id = in_game_id
+        self.status = 'Queued'
+        self.payload = in_payload
+        self.attempts = 0
+        self.date_created = int( time.time() )
+
+    def to_dict(self):
+        return {
+            "ticket_id": self.id,
+            "game_id": self.game_id,
+            "status": self.status,
+            "status_code": self.status_code,
+            "error": self.error,
+            "attempts": self.attempts,
+            "date_created": self.date_created,
+            "date_started": self.date_started,
+            "date_completed": self.date_completed
+        }
+
+# One row per step of a scheduled job, e.g. each materialized view refreshed by sql_exec.refresh_woba_views
+class JobRun(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job = db.Column(db.String(64), index=True)
+    target = db.Column(db.String(64))
+    status = db.Column(db.String(16))
+    row_count = db.Column(db.BigInteger, nullable=True)
+    duration_ms = db.Column(db.Integer, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    date_started = db.Column(db.Integer)
+    date_completed = db.Column(db.Integer, nullable=True)
+
+    def __init__(self, in_job, in_target):
+        self.job = in_job
+        self.target = in_target
+        self.status = 'Running'
+        self.date_started = int( time.time() )
+
+    def to_dict(self):
+        return {
+            "job": self.job,
+            "target": self.target,
+            "status": self.status,
+            "row_count": self.row_count,
+            "duration_ms": self.duration_ms,
+            "error": self.error,
+            "date_started": self.date_started,
+            "date_completed": self.date_completed
+        }
+
 class Game(db.Model):
     game_id = db.Column(db.BigInteger, primary_key = True)
     away_player_id = db.Column(db.ForeignKey('rio_user.id'), nullable=False) #One-to-One
@@ -348,6 +412,7 @@ class Game(db.Model):
     average_ping = db.Column(db.Integer)
     lag_spikes = db.Column(db.Integer)
     version = db.Column(db.String(50))
+    payload_hash = db.Column(db.String(64), index=True) # stat_file_hash of the submitted stat file
 
     character_game_summary = db.relationship('CharacterGameSummary', backref='game')
     event = db.relationship('Event', backref='game')
@@ -363,6 +428,119 @@ class Game(db.Model):
             'innings_played': self.innings_played            
         }
 
+# One row per game with the columns /games/ filters on, written by game_index.index_games
+class GameIndex(db.Model):
+    __table_args__ = (
+        db.Index('ix_game_index_tag_ids', 'tag_ids', postgresql_using='gin'),
+        db.Index('ix_game_index_date_time_start_game_id', 'date_time_start', 'game_id'), # /games/ order and keyset pages
+    )
+
+    game_id = db.Column(db.BigInteger, db.ForeignKey('game.game_id', ondelete='CASCADE'), primary_key=True)
+    away_player_id = db.Column(db.Integer, index=True)
+    home_player_id = db.Column(db.Integer, index=True)
+    away_username = db.Column(db.String(64))
+    home_username = db.Column(db.String(64))
+    away_captain_id = db.Column(db.Integer, index=True)
+    home_captain_id = db.Column(db.Integer, index=True)
+    tag_ids = db.Column(ARRAY(db.Integer), nullable=False) # Tags of the game's TagSet
+    date_time_start = db.Column(db.Integer)
+    date_time_end = db.Column(db.Integer)
+
+# Event derived stats of one character in one game (one row per character_game_summary), written by stat_rollups.rollup_games
+class CharacterGameRollup(db.Model):
+    character_game_summary_id = db.Column(db.Integer, db.ForeignKey('character_game_summary.id', ondelete='CASCADE'), primary_key=True)
+    game_id = db.Column(db.BigInteger, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    char_id = db.Column(db.Integer, nullable=False)
+    #Pitching, pitches the batter made contact with
+    balls = db.Column(db.Integer, nullable=False)
+    strikes = db.Column(db.Integer, nullable=False)
+    #Fielding
+    jump_catches = db.Column(db.Integer, nullable=False)
+    diving_catches = db.Column(db.Integer, nullable=False)
+    wall_jumps = db.Column(db.Integer, nullable=False)
+    swap_successes = db.Column(db.Integer, nullable=False)
+    bobbles = db.Column(db.Integer, nullable=False)
+
+# Batting stats of one character in one game per swing type, with foul contact counted apart so
+# exclude_nonfair can leave it out. Written by stat_rollups.rollup_games
+class BattingRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    character_game_summary_id = db.Column(db.Integer, db.ForeignKey('character_game_summary.id', ondelete='CASCADE'), nullable=False, index=True)
+    game_id = db.Column(db.BigInteger, nullable=False, index=True)
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    char_id = db.Column(db.Integer, nullable=False)
+    type_of_swing = db.Column(db.Integer)
+    foul = db.Column(db.Boolean, nullable=False) # Contact with primary_result 1
+    outs = db.Column(db.Integer, nullable=False)
+    foul_hits = db.Column(db.Integer, nullable=False)
+    fair_hits = db.Column(db.Integer, nullable=False)
+    sour_hits = db.Column(db.Integer, nullable=False)
+    nice_hits = db.Column(db.Integer, nullable=False)
+    perfect_hits = db.Column(db.Integer, nullable=False)
+    singles = db.Column(db.Integer, nullable=False)
+    doubles = db.Column(db.Integer, nullable=False)
+    triples = db.Column(db.Integer, nullable=False)
+    homeruns = db.Column(db.Integer, nullable=False)
+    sacflys = db.Column(db.Integer, nullable=False)
+    strikeouts = db.Column(db.Integer, nullable=False)
+    plate_appearances = db.Column(db.Integer, nullable=False)
+    rbi = db.Column(db.Integer)
+
+# /star_chances/ counts of one half inning of one game, over events with an at bat result.
+# Written by stat_rollups.rollup_games
+class StarChanceRollup(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    game_id = db.Column(db.BigInteger, db.ForeignKey('game.game_id', ondelete='CASCADE'), nullable=False, index=True)
+    inning = db.Column(db.Integer)
+    half_inning = db.Column(db.Integer)
+    eligible_event = db.Column(db.Integer, nullable=False) # Bases empty with stars left to win
+    star_chances = db.Column(db.Integer, nullable=False)
+    total_events = db.Column(db.Integer, nullable=False)
+    pitcher_win = db.Column(db.Integer, nullable=False)
+    batter_win = db.Column(db.Integer, nullable=False)
+
+# One row per event with its pitch, contact and fielding ids and the batter, pitcher and fielder
+# characters and users inlined, so event filters don't join the summary tables.
+# Written by stat_rollups.rollup_games
+class EventFact(db.Model):
+    event_id = db.Column(db.Integer, db.ForeignKey('event.id', ondelete='CASCADE'), primary_key=True)
+    game_id = db.Column(db.BigInteger, nullable=False, index=True)
+    event_num = db.Column(db.Integer)
+    inning = db.Column(db.Integer)
+    half_inning = db.Column(db.Integer)
+    balls = db.Column(db.Integer)
+    strikes = db.Column(db.Integer)
+    outs = db.Column(db.Integer)
+    chem_links_ob = db.Column(db.Integer)
+    star_chance = db.Column(db.Integer)
+    away_stars = db.Column(db.Integer)
+    home_stars = db.Column(db.Integer)
+    bases_empty = db.Column(db.Boolean, nullable=False)
+    result_of_ab = db.Column(db.Integer)
+    result_rbi = db.Column(db.Integer)
+    #Summary rows, NULL when the event has none
+    pitch_summary_id = db.Column(db.Integer)
+    contact_summary_id = db.Column(db.Integer)
+    fielding_summary_id = db.Column(db.Integer)
+    type_of_swing = db.Column(db.Integer)
+    type_of_contact = db.Column(db.Integer)
+    #Batter
+    batter_id = db.Column(db.Integer, nullable=False)
+    batter_char_id = db.Column(db.Integer, nullable=False, index=True)
+    batter_user_id = db.Column(db.Integer, nullable=False, index=True)
+    batter_hand = db.Column(db.Boolean)
+    #Pitcher
+    pitcher_id = db.Column(db.Integer, nullable=False)
+    pitcher_char_id = db.Column(db.Integer, nullable=False, index=True)
+    pitcher_user_id = db.Column(db.Integer, nullable=False, index=True)
+    pitcher_hand = db.Column(db.Boolean)
+    #Fielder of the ball, NULL without fielding
+    fielder_id = db.Column(db.Integer)
+    fielder_char_id = db.Column(db.Integer)
+    fielder_user_id = db.Column(db.Integer)
+    fielder_position = db.Column(db.Integer)
+
 class CharacterGameSummary(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     game_id = db.Column(db.BigInteger, db.ForeignKey('game.game_id'), nullable=False)
@@ -0,0 +1,91 @@
+from array import array
+from sqlalchemy import types
+import io
+import struct
+import sys
+import zipfile
+
+# Writes query results as a NumPy .npz archive (np.load reads it) without needing numpy on the server.
+# Every column is one 1-d .npy array, filled column by column as rows come off the cursor:
+#   - Boolean           -> |b1
+#   - BigInteger        -> <i8
+#   - other Integer     -> <i4
+#   - Float and Numeric -> <f8
+#   - String            -> <U (fixed width, the longest value in the column)
+# A column that has NULLs gets a companion "<column>_null" |b1 array marking them. The NULL slots
+# themselves hold NaN in float columns and 0 or '' in the others.
+
+NPY_MAGIC = b'\x93NUMPY\x01\x00'
+NPY_HEADER_ALIGNMENT = 64
+
+# SQLAlchemy type -> (array typecode, npy descr, fill value for NULLs). Strings are kept in a list
+def npy_column_type(sql_type):
+    if isinstance(sql_type, types.Boolean):
+        return 'b', '|b1', 0
+    if isinstance(sql_type, types.BigInteger):
+        return 'q', '<i8', 0
+    if isinstance(sql_type, types.Integer):
+        return 'i', '<i4', 0
+    if isinstance(sql_type, (types.Float, types.Numeric)):
+        return 'd', '<f8', float('nan')
+    if isinstance(sql_type, types.String):
+        return None, '<U', ''
+    raise TypeError(f'No npz type for {sql_type!r}')
+
+class NpyColumn:
+    def __init__(self, name, sql_type):
+        self.name = name
+        self.typecode, self.descr, self.fill = npy_column_type(sql_type)
+        self.values = array(self.typecode) if self.typecode != None else list()
+        self.nulls = None # array('b') once the column has a NULL
+
+    def extend(self, values):
+        if None in values:
+            if self.nulls == None:
+                self.nulls = array('b', bytes(len(self.values)))
+            self.nulls.extend([value is None for value in values])
+            values = [self.fill if value is None else value for value in values]
+        elif self.nulls != None:
+            self.nulls.frombytes(bytes(len(values)))
+        self.values.extend(values)
+
+    def npy_files(self):
+        files = [(self.name, npy_bytes(self.descr, self.values))]
+        if self.nulls != None:
+            files.append((self.name + '_null', npy_bytes('|b1', self.nulls)))
+        return files
+
+# .npy (format 1.0) of a 1-d array of values
+def npy_bytes(descr, values):
+    if descr == '<U':
+        width = max([len(value) for value in values] + [1])
+        descr = f'<U{width}'
+        data = b''.join(value.encode('utf-32-le').ljust(width * 4, b'\0') for value in values)
+    else:
+        if sys.byteorder == 'big' and values.itemsize > 1:
+            values = array(values.typecode, values)
+            values.byteswap()
+        data = values.tobytes()
+
+    header = f"{{'descr': '{descr}', 'fortran_order': False, 'shape': ({len(values)},), }}"
+    # Magic, version and header length take 10 bytes. The header is space padded so the data starts aligned
+    padding = -(len(NPY_MAGIC) + 2 + len(header) + 1) % NPY_HEADER_ALIGNMENT
+    header = (header + ' ' * padding + '\n').encode('latin1')
+    return NPY_MAGIC + struct.pack('<H', len(header)) + header + data
+
+class NpzColumns:
+    # columns is a list of (name, SQLAlchemy type) in row order
+    def __init__(self, columns):
+        self.columns = [NpyColumn(name, sql_type) for name, sql_type in columns]
+
+    def append(self, rows):
+        for index, column in enumerate(self.columns):
+            column.extend([row[index] for row in rows])
+
+    def to_bytes(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+            for column in self.columns:
+                for name, data in column.npy_files():
+                    archive.writestr(name + '.npy', data)
+        return buffer.getvalue()
@@ -0,0 +1,256 @@
+from flask import current_app, request, Response
+from collections import OrderedDict
+from functools import wraps
+from urllib.parse import urlencode
+from .filter_resolver import resolve_names
+from .util import lower_and_remove_nonalphanumeric
+import hashlib
+import json
+import threading
+import time
+
+# Caches the JSON responses of the read heavy stat endpoints, keyed on the path and normalized query args.
+# Every entry records the generation counters its response depends on:
+#   - the users it is filtered to (username, vs_username)
+#   - otherwise the tags it is filtered to (tag)
+#   - otherwise 'all', for every other request
+# Writes bump 'all' plus the counters of the users and tags of the changed game (bump_generations),
+# and an entry whose counters moved is a miss. Entries also expire after RESPONSE_CACHE_TTL seconds,
+# which bounds how stale anything else that feeds a response (renames, elo updates) can get.
+#
+# RESPONSE_CACHE_BACKEND picks where entries and counters live:
+#   - local: per process LRU (default). A bump only invalidates the process that made the write, other
+#            app processes (gunicorn workers) and writes from scripts and CLI commands (flask bulk-load)
+#            don't reach it, so their entries stay stale until RESPONSE_CACHE_TTL (30s by default for local)
+#   - redis: shared between processes at RESPONSE_CACHE_URL. Needs the redis package
+#   - none:  disabled
+
+# Per process LRU. Counters are kept apart from the entries so eviction can't reset them
+class LocalCacheBackend:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict() # key -> (value, expires)
+        self.counters = dict()
+
+    def get_many(self, keys):
+        values = list()
+        now = time.monotonic()
+        with self.lock:
+            for key in keys:
+                if key in self.counters:
+                    values.append(self.counters[key])
+                    continue
+                entry = self.entries.get(key)
+                if entry == None or entry[1] < now:
+                    values.append(None)
+                    continue
+                self.entries.move_to_end(key)
+                values.append(entry[0])
+        return values
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def incr(self, key):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+            return self.counters[key]
+
+# Cache shared by every process, through a redis client (or anything with the same get/mget/set/incr).
+# Counters are stored without an expiry so an LRU eviction policy on volatile keys can't reset them
+class RedisCacheBackend:
+    def __init__(self, client):
+        self.client = client
+
+    def get_many(self, keys):
+        return self.client.mget(keys)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=ttl)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+# In memory stand-in for the redis client used by RedisCacheBackend. Stores bytes like redis does,
+# so tests of the shared backend go through the same encoding as production
+class LocalRedisClient:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = dict() # key -> (bytes, expires or None)
+
+    def get(self, key):
+        with self.lock:
+            value = self.values.get(key)
+            if value == None or (value[1] != None and value[1] < time.monotonic()):
+                return None
+            return value[0]
+
+    def mget(self, keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, ex=None):
+        if not isinstance(value, bytes):
+            value = str(value).encode()
+        with self.lock:
+            self.values[key] = (value, time.monotonic() + ex if ex != None else None)
+
+    def incr(self, key):
+        with self.lock:
+            value = self.values.get(key)
+            count = int(value[0]) + 1 if value != None else 1
+            self.values[key] = (str(count).encode(), None)
+            return count
+
+class ResponseCache:
+    def __init__(self, backend, ttl, prefix='rio:response_cache:'):
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.endpoints = dict() # endpoint -> {'hits': n, 'misses': n}
+
+    def generation_key(self, scope):
+        return self.prefix + 'gen:' + ':'.join(str(part) for part in scope)
+
+    def entry_key(self, path, args):
+        return self.prefix + 'entry:' + hashlib.sha1(normalize_request(path, args).encode()).hexdigest()
+
+    # Returns (body or None, generations). The body is only returned if none of the scopes changed since it was stored
+    def get(self, key, scopes):
+        values = self.backend.get_many([key] + [self.generation_key(scope) for scope in scopes])
+        generations = [int(value) if value != None else 0 for value in values[1:]]
+        if values[0] == None:
+            return None, generations
+        stored_generations, body = values[0].split(b'\n', 1)
+        if json.loads(stored_generations) != generations:
+            return None, generations
+        return body, generations
+
+    # Generations must be the ones read before the response was built, so a bump while it was built is a miss later
+    def set(self, key, generations, body):
+        self.backend.set(key, json.dumps(generations).encode() + b'\n' + body, self.ttl)
+
+    def bump(self, scopes):
+        for scope in scopes:
+            self.backend.incr(self.generation_key(scope))
+
+    def record(self, endpoint, hit=None, error=False):
+        with self.lock:
+            if error:
+                self.errors += 1
+                return
+            counts = self.endpoints.setdefault(endpoint, {'hits': 0, 'misses': 0})
+            if hit:
+                self.hits += 1
+                counts['hits'] += 1
+            else:
+                self.misses += 1
+                counts['misses'] += 1
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'backend': type(self.backend).__name__,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'errors': self.errors,
+                'endpoints': {endpoint: dict(counts) for endpoint, counts in self.endpoints.items()},
+            }
+
+# Path plus the query args sorted by name. Values keep their order since some endpoints only read the first one
+def normalize_request(path, args):
+    return path + '?' + urlencode(sorted(args.items(multi=True), key=lambda item: item[0]))
+
+# Generation counters a response for these args depends on
+def request_scopes(args):
+    user_names = [lower_and_remove_nonalphanumeric(name) for name in args.getlist('username') + args.getlist('vs_username')]
+    tag_names = [lower_and_remove_nonalphanumeric(name) for name in args.getlist('tag')]
+    if len(user_names) == 0 and len(tag_names) == 0:
+        return [('all',)]
+
+    resolved = resolve_names(user_names, tag_names)
+    # Names that don't exist yet can't be tracked, fall back to 'all'
+    if len(user_names) > 0:
+        if all(name in resolved['user'] for name in user_names):
+            return sorted({('user', resolved['user'][name]) for name in user_names})
+    elif all(name in resolved['tag'] for name in tag_names):
+        return sorted({('tag', resolved['tag'][name]) for name in tag_names})
+    return [('all',)]
+
+_cache = None
+
+def create_response_cache(config):
+    backend_name = config['RESPONSE_CACHE_BACKEND']
+    if backend_name == 'none':
+        return None
+    if backend_name == 'redis':
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('RESPONSE_CACHE_BACKEND=redis needs the redis package')
+        backend = RedisCacheBackend(redis.Redis.from_url(config['RESPONSE_CACHE_URL']))
+    elif backend_name == 'local':
+        backend = LocalCacheBackend(config['RESPONSE_CACHE_SIZE'])
+    else:
+        raise RuntimeError(f'Unknown RESPONSE_CACHE_BACKEND {backend_name}')
+    return ResponseCache(backend, config['RESPONSE_CACHE_TTL'])
+
+def get_response_cache():
+    global _cache
+    if _cache == None:
+        _cache = create_response_cache(current_app.config)
+    return _cache
+
+# Invalidate cached responses that depend on these users or tags, and every response not filtered to a user or tag.
+# Call after the write is committed
+def bump_generations(user_ids=(), tag_ids=()):
+    cache = get_response_cache()
+    if cache == None:
+        return
+    try:
+        cache.bump([('all',)] + [('user', user_id) for user_id in set(user_ids)] + [('tag', tag_id) for tag_id in set(tag_ids)])
+    except Exception as e:
+        # The write is already committed, stale entries still expire after RESPONSE_CACHE_TTL
+        cache.record(None, error=True)
+        current_app.logger.warning(f'Response cache invalidation failed: {e}')
+
+# Serve a GET endpoint's JSON response from the response cache.
+# Internal calls (any arguments) and ndjson streams skip the cache. Only 200 JSON responses are stored
+def cached_response(func):
+    @wraps(func)
+    def decorated_function(*args, **kwargs):
+        cache = get_response_cache()
+        if cache == None or len(args) > 0 or len(kwargs) > 0 or request.method != 'GET' or request.args.get('format') == 'ndjson':
+            return func(*args, **kwargs)
+
+        try:
+            key = cache.entry_key(request.path, request.args)
+            body, generations = cache.get(key, request_scopes(request.args))
+        except Exception as e:
+            cache.record(func.__name__, error=True)
+            current_app.logger.warning(f'Response cache lookup failed: {e}')
+            return func(*args, **kwargs)
+
+        if body != None:
+            cache.record(func.__name__, hit=True)
+            return Response(body, mimetype='application/json')
+
+        cache.record(func.__name__, hit=False)
+        response = current_app.make_response(func(*args, **kwargs))
+        if response.status_code == 200 and response.mimetype == 'application/json' and not response.is_streamed:
+            try:
+                cache.set(key, generations, response.get_data())
+            except Exception as e:
+                cache.record(func.__name__, error=True)
+                current_app.logger.warning(f'Response cache store failed: {e}')
+        return response
+    return decorated_function
@@ -0,0 +1,69 @@
+# Stat files repeat a runner's JSON on every event until that runner's state changes.
+# Each blob is fingerprinted once, and a Runner row is only created when the fingerprint for a base
+# differs from the previous event. Events point at the shared rows through runner_on_0-3.
+
+RUNNER_COLUMNS = {
+    'Runner Batter': 'runner_on_0',
+    'Runner 1B': 'runner_on_1',
+    'Runner 2B': 'runner_on_2',
+    'Runner 3B': 'runner_on_3'
+}
+
+# Hashable fingerprint of a runner JSON blob
+def runner_state(runner_data):
+    return tuple(sorted(runner_data.items()))
+
+class RunnerStateBuilder:
+    # teams - {'Home': [9 character_game_summary rows], 'Away': [...]}
+    # Runner rows reference the runner's summary row, swapped for its id when the batch is written
+    def __init__(self, teams):
+        self.teams = teams
+        self.previous_states = dict.fromkeys(RUNNER_COLUMNS)
+        self.previous_runners = dict.fromkeys(RUNNER_COLUMNS)
+
+    # Returns ({runner_on_N: Runner row or None}, [Runner rows created by this event])
+    # A new batter runner is a new plate appearance for the batter's summary
+    def add_event(self, event_data):
+        event_runners = dict.fromkeys(RUNNER_COLUMNS.values())
+        new_runners = list()
+        batting_team = self.teams['Away'] if event_data['Half Inning'] == 0 else self.teams['Home']
+
+        for key, column in RUNNER_COLUMNS.items():
+            if key not in event_data:
+                self.previous_states[key] = None
+                self.previous_runners[key] = None
+                continue
+
+            runner_data = event_data[key]
+            state = runner_state(runner_data)
+            if state != self.previous_states[key]:
+                runner = dict(
+                    runner_character_game_summary_id = batting_team[runner_data['Runner Roster Loc']],
+                    initial_base = runner_data['Runner Initial Base'],
+                    result_base = runner_data['Runner Result Base'],
+                    out_type = runner_data['Out Type'],
+                    out_location = runner_data['Out Location'],
+                    steal = runner_data['Steal'],
+                )
+                new_runners.append(runner)
+
+                if key == 'Runner Batter':
+                    batting_team[runner_data['Runner Roster Loc']]['plate_appearances'] += 1
+
+                self.previous_states[key] = state
+                self.previous_runners[key] = runner
+
+            event_runners[column] = self.previous_runners[key]
+
+        return event_runners, new_runners
+
+# Build the Runner rows and the event -> runner mapping for a whole game in one pass
+def build_runner_rows(events, teams):
+    builder = RunnerStateBuilder(teams)
+    runners = list()
+    event_runners = list()
+    for event_data in events:
+        runner_columns, new_runners = builder.add_event(event_data)
+        runners.extend(new_runners)
+        event_runners.append(runner_columns)
+    return runners, event_runners
@@ -0,0 +1,218 @@
+from . import db
+from sqlalchemy import text
+
+# Star counters stored on CharacterGameSummary. Not part of the stat file, calculated from the events
+STAR_COUNTERS = (
+    'offensive_star_swings',
+    'offensive_stars_used',
+    'offensive_stars_put_in_play',
+    'offensive_star_successes',
+    'offensive_star_chances',
+    'offensive_star_chances_won',
+    'defensive_star_pitches',
+    'defensive_stars_used',
+    'defensive_star_successes',
+    'defensive_star_chances',
+    'defensive_star_chances_won',
+)
+
+# One list per column, one entry per event
+STAR_COLUMNS = (
+    'batter_slot',
+    'pitcher_slot',
+    'type_of_swing',
+    'star_pitch',
+    'pitch_result',
+    'made_contact',
+    'primary_result',
+    'star_chance',
+    'outs',
+    'result_of_ab',
+    'batter_out_type',
+    'outs_during_play',
+)
+
+# Roster slots are 0-8 for the away team and 9-17 for the home team
+ROSTER_SLOTS = 18
+
+def roster_slot(is_home, roster_loc):
+    return roster_loc + 9 if is_home else roster_loc
+
+def new_star_columns():
+    return {column: list() for column in STAR_COLUMNS}
+
+# Add one stat file event to the star columns. pitch is the last 'Pitch' seen; events without a
+# 'Pitch' reuse it, matching how populate_db has always counted them. Returns the pitch for the next event
+def append_star_columns(columns, event, pitch):
+    # Away bats in the top half (0), home in the bottom half (1)
+    half_inning = event['Half Inning']
+    if 'Pitch' in event:
+        pitch = event['Pitch']
+    contact = pitch['Contact'] if pitch != None and 'Contact' in pitch else None
+
+    outs_during_play = 0
+    for key in ['Runner Batter', 'Runner 1B', 'Runner 2B', 'Runner 3B']:
+        if key in event and event[key]['Out Type'] > 0:
+            outs_during_play += 1
+
+    columns['batter_slot'].append(roster_slot(half_inning == 1, event['Batter Roster Loc']))
+    columns['pitcher_slot'].append(roster_slot(half_inning == 0, event['Pitcher Roster Loc']))
+    columns['type_of_swing'].append(pitch['Type of Swing'] if pitch != None else None)
+    columns['star_pitch'].append(pitch['Star Pitch'] if pitch != None else None)
+    columns['pitch_result'].append(pitch.get('Pitch Result') if pitch != None else None)
+    columns['made_contact'].append(contact != None)
+    columns['primary_result'].append(contact['Contact Result - Primary'] if contact != None else None)
+    columns['star_chance'].append(event['Star Chance'])
+    columns['outs'].append(event['Outs'])
+    columns['result_of_ab'].append(event['Result of AB'])
+    columns['batter_out_type'].append(event['Runner Batter']['Out Type'] if 'Runner Batter' in event else None)
+    columns['outs_during_play'].append(outs_during_play)
+    return pitch
+
+# Build star columns from the 'Events' array of a stat file
+def star_columns_from_events(events):
+    columns = new_star_columns()
+    pitch = None
+    for event in events:
+        pitch = append_star_columns(columns, event, pitch)
+    return columns
+
+# Calculate every star counter for all 18 roster slots in a single pass over the event columns
+# captains[slot] - slot is the team captain
+# captain_eligible[slot] - slot's character is able to be a captain (Character.captain)
+# Returns {counter: [value per roster slot]}
+def calc_star_counters(columns, captains, captain_eligible):
+    counters = {counter: [0] * ROSTER_SLOTS for counter in STAR_COUNTERS}
+    offensive_star_swings = counters['offensive_star_swings']
+    offensive_stars_used = counters['offensive_stars_used']
+    offensive_stars_put_in_play = counters['offensive_stars_put_in_play']
+    offensive_star_successes = counters['offensive_star_successes']
+    offensive_star_chances = counters['offensive_star_chances']
+    offensive_star_chances_won = counters['offensive_star_chances_won']
+    defensive_star_pitches = counters['defensive_star_pitches']
+    defensive_stars_used = counters['defensive_stars_used']
+    defensive_star_successes = counters['defensive_star_successes']
+    defensive_star_chances = counters['defensive_star_chances']
+    defensive_star_chances_won = counters['defensive_star_chances_won']
+
+    rows = zip(*[columns[column] for column in STAR_COLUMNS])
+    for (batter, pitcher, type_of_swing, star_pitch, pitch_result, made_contact, primary_result,
+         star_chance, outs, result_of_ab, batter_out_type, outs_during_play) in rows:
+        # == Star Calcs Offense ==
+        if type_of_swing == 3: # ToDo replace with decode const. 3==star swing
+            offensive_star_swings[batter] += 1
+            # Misses, non-captain contact, and captain star cost each cost 1 star.
+            # Contact with a non-captain character costs 2 stars
+            if made_contact and captain_eligible[batter] and captains[batter] == False:
+                offensive_stars_used[batter] += 2
+            else:
+                offensive_stars_used[batter] += 1
+
+            # Contact was made and was caught (1) or landed fair (2)
+            if made_contact and primary_result in (1, 2):
+                offensive_stars_put_in_play[batter] += 1
+            if made_contact and primary_result == 2:
+                offensive_star_successes[batter] += 1
+
+        # == Star Calcs Defense ==
+        if star_pitch:
+            defensive_star_pitches[pitcher] += 1
+            if pitch_result != None and pitch_result >= 3 and pitch_result >= 5:
+                defensive_star_successes[pitcher] += 1
+
+            if captain_eligible[pitcher] and captains[pitcher] == False:
+                defensive_stars_used[pitcher] += 2
+            else:
+                defensive_stars_used[pitcher] += 1
+
+        # Only count star chances when the ab is over
+        if result_of_ab > 0 and star_chance:
+            offensive_star_chances[batter] += 1
+            defensive_star_chances[pitcher] += 1
+            # Batter wins star chance if the batter is safe and the inning doesn't end
+            if batter_out_type == 0 and (outs + outs_during_play) < 3:
+                offensive_star_chances_won[batter] += 1
+            else:
+                defensive_star_chances_won[pitcher] += 1
+
+    return counters
+
+# Recalculate star counters for stored games from their Event rows, e.g. after changing the rules above
+# Pitch Result is not stored, so defensive_star_successes is only counted at ingest
+def backfill_star_counters(game_ids):
+    from .character_cache import is_captain_eligible
+
+    for game_id in game_ids:
+        summaries = db.session.execute(text(
+            'SELECT id, team_id, roster_loc, captain, char_id '
+            'FROM character_game_summary '
+            'WHERE game_id = :game_id'
+        ), {'game_id': game_id}
+        ).all()
+        if len(summaries) != ROSTER_SLOTS:
+            continue
+
+        # CharacterGameSummary.team_id is 0 for the home team
+        slots = [None] * ROSTER_SLOTS
+        for summary in summaries:
+            slots[roster_slot(summary.team_id == 0, summary.roster_loc)] = summary
+
+        events = db.session.execute(text(
+            'SELECT event.pitch_summary_id IS NOT NULL AS has_pitch, \n'
+            '   batter.team_id AS batter_team_id, batter.roster_loc AS batter_roster_loc, \n'
+            '   pitcher.team_id AS pitcher_team_id, pitcher.roster_loc AS pitcher_roster_loc, \n'
+            '   pitch_summary.type_of_swing, pitch_summary.star_pitch, \n'
+            '   pitch_summary.contact_summary_id IS NOT NULL AS made_contact, contact_summary.primary_result, \n'
+            '   event.star_chance, event.outs, event.result_of_ab, \n'
+            '   runner_0.out_type AS batter_out_type, \n'
+            '   (COALESCE(runner_0.out_type, 0) > 0)::int + (COALESCE(runner_1.out_type, 0) > 0)::int \n'
+            '   + (COALESCE(runner_2.out_type, 0) > 0)::int + (COALESCE(runner_3.out_type, 0) > 0)::int AS outs_during_play \n'
+            'FROM event \n'
+            'JOIN character_game_summary AS batter ON event.batter_id = batter.id \n'
+            'JOIN character_game_summary AS pitcher ON event.pitcher_id = pitcher.id \n'
+            'LEFT JOIN pitch_summary ON event.pitch_summary_id = pitch_summary.id \n'
+            'LEFT JOIN contact_summary ON pitch_summary.contact_summary_id = contact_summary.id \n'
+            'LEFT JOIN runner AS runner_0 ON event.runner_on_0 = runner_0.id \n'
+            'LEFT JOIN runner AS runner_1 ON event.runner_on_1 = runner_1.id \n'
+            'LEFT JOIN runner AS runner_2 ON event.runner_on_2 = runner_2.id \n'
+            'LEFT JOIN runner AS runner_3 ON event.runner_on_3 = runner_3.id \n'
+            'WHERE event.game_id = :game_id \n'
+            'ORDER BY event.event_num'
+        ), {'game_id': game_id}
+        ).all()
+
+        columns = new_star_columns()
+        pitch = None
+        for event in events:
+            if event.has_pitch:
+                pitch = event
+            columns['batter_slot'].append(roster_slot(event.batter_team_id == 0, event.batter_roster_loc))
+            columns['pitcher_slot'].append(roster_slot(event.pitcher_team_id == 0, event.pitcher_roster_loc))
+            columns['type_of_swing'].append(pitch.type_of_swing if pitch != None else None)
+            columns['star_pitch'].append(pitch.star_pitch if pitch != None else None)
+            columns['pitch_result'].append(None)
+            columns['made_contact'].append(pitch.made_contact if pitch != None else False)
+            columns['primary_result'].append(pitch.primary_result if pitch != None else None)
+            columns['star_chance'].append(event.star_chance)
+            columns['outs'].append(event.outs)
+            columns['result_of_ab'].append(event.result_of_ab)
+            columns['batter_out_type'].append(event.batter_out_type)
+            columns['outs_during_play'].append(event.outs_during_play)
+
+        counters = calc_star_counters(
+            columns,
+            [summary.captain for summary in slots],
+            [is_captain_eligible(summary.char_id) for summary in slots]
+        )
+
+        updates = list()
+        for slot, summary in enumerate(slots):
+            update = {counter: counters[counter][slot] for counter in STAR_COUNTERS if counter != 'defensive_star_successes'}
+            update['summary_id'] = summary.id
+            updates.append(update)
+        db.session.execute(text(
+            'UPDATE character_game_summary SET '
+            + ', '.join([f'{counter} = :{counter}' for counter in STAR_COUNTERS if counter != 'defensive_star_successes'])
+            + ' WHERE id = :summary_id'
+        ), updates)
+        db.session.commit()
@@ -0,0 +1,97 @@
+import codecs
+import json
+from .consts import cSTAT_FILE_CHUNK_SIZE
+
+# Incremental reader for stat files posted to /populate_db/.
+# The body is decoded a chunk at a time so only the current top level value (or a single event when
+# streaming 'Events') is held in memory, no matter how long the game was.
+
+JSON_WHITESPACE = ' \t\n\r'
+
+class StatFileError(ValueError):
+    pass
+
+class StatFileReader:
+    def __init__(self, stream, chunk_size=cSTAT_FILE_CHUNK_SIZE):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self.utf8_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.exhausted = False
+
+    # Read the next chunk from the stream and drop everything that has already been decoded
+    def _fill(self):
+        chunk = self.stream.read(self.chunk_size)
+        if chunk:
+            text = self.utf8_decoder.decode(chunk)
+        else:
+            text = self.utf8_decoder.decode(b'', final=True)
+            self.exhausted = True
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+
+    # Returns the next non-whitespace character without consuming it
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in JSON_WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.exhausted:
+                raise StatFileError('Stat file ended unexpectedly')
+            self._fill()
+
+    def _expect(self, characters):
+        character = self._peek()
+        if character not in characters:
+            raise StatFileError(f'Malformed stat file: expected one of {characters!r}, found {character!r}')
+        self.pos += 1
+        return character
+
+    def _decode_value(self):
+        self._peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                # A value that ends exactly at the end of the buffer may be a number cut off by the chunk
+                if end < len(self.buffer) or self.exhausted:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.exhausted:
+                    raise StatFileError(f'Malformed stat file: {e}')
+            self._fill()
+
+    def _iter_array(self):
+        self._expect('[')
+        if self._peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self._decode_value()
+            if self._expect(',]') == ']':
+                return
+
+    # Yields (key, value) for each top level field of the stat file.
+    # Arrays under stream_keys are yielded as a generator over their elements, which has to be
+    # consumed before the next field is read
+    def items(self, stream_keys=()):
+        self._expect('{')
+        if self._peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self._decode_value()
+            self._expect(':')
+            if key in stream_keys and self._peek() == '[':
+                elements = self._iter_array()
+                yield key, elements
+                # Skip whatever the caller did not read
+                for _ in elements:
+                    pass
+            else:
+                yield key, self._decode_value()
+            if self._expect(',}') == '}':
+                return
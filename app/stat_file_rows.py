@@ -0,0 +1,292 @@
+from .runner_state import RunnerStateBuilder
+from .star_calcs import STAR_COUNTERS, new_star_columns, append_star_columns, calc_star_counters
+import hashlib
+import json
+
+# Maps a stat file onto row dicts for game, character_position_summary, character_game_summary, runner,
+# fielding_summary, contact_summary, pitch_summary and event. Used by /populate_db/ and the bulk loader.
+# Rows reference each other by holding the referenced row dict (ex. event['pitcher_id'] is the pitcher's
+# character_game_summary row) until ids are reserved and the references are swapped for ids.
+# Nothing here touches the db, so stat files can be transformed in any process.
+
+ROSTER_KEYS = [f'Away Roster {roster_loc}' for roster_loc in range(9)] + [f'Home Roster {roster_loc}' for roster_loc in range(9)]
+
+POSITION_COLUMNS = {'P': 'p', 'C': 'c', '1B': '1b', '2B': '2b', '3B': '3b', 'SS': 'ss', 'LF': 'lf', 'CF': 'cf', 'RF': 'rf'}
+
+# Reference columns for each table, swapped for the referenced row's id before insert
+ROW_REFERENCES = {
+    'character_game_summaries': ['character_position_summary_id'],
+    'runners': ['runner_character_game_summary_id'],
+    'fielding_summaries': ['fielder_character_game_summary_id'],
+    'contact_summaries': ['fielding_summary_id'],
+    'pitch_summaries': ['contact_summary_id'],
+    'events': ['pitcher_id', 'batter_id', 'catcher_id', 'runner_on_0', 'runner_on_1', 'runner_on_2', 'runner_on_3', 'pitch_summary_id'],
+}
+
+def parse_game_id(stat_file):
+    return int(stat_file['GameID'].replace(',', ''), 16)
+
+# Identifies a stat file so a retried submission can be matched to the game it already wrote.
+# Events are left out because /populate_db/ streams them after the game row is written. The other
+# fields already pin the game (GameID, players, dates, scores and every character's stats)
+def stat_file_hash(stat_file):
+    header = {key: value for key, value in stat_file.items() if key != 'Events'}
+    return hashlib.sha256(json.dumps(header, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+# Rows for one batch of events
+def new_event_batch():
+    return {
+        'runners': list(),
+        'fielding_summaries': list(),
+        'contact_summaries': list(),
+        'pitch_summaries': list(),
+        'events': list(),
+    }
+
+def game_row(stat_file, game_id, home_player_id, away_player_id):
+    return dict(
+        game_id = game_id,
+        away_player_id = away_player_id,
+        home_player_id = home_player_id,
+        date_time_start = int(stat_file['Date - Start']),
+        date_time_end = int(stat_file['Date - End']),
+        netplay = stat_file['Netplay'],
+        stadium_id = stat_file['StadiumID'],
+        away_score = stat_file['Away Score'],
+        home_score = stat_file['Home Score'],
+        innings_selected = stat_file['Innings Selected'],
+        innings_played = stat_file['Innings Played'],
+        quitter = 0 if stat_file['Quitter Team'] == "" else stat_file['Quitter Team'], #STRING OR INT
+        valid = True, # Invalid games are rejected by validate_stat_file
+        average_ping = stat_file['Average Ping'],
+        lag_spikes = stat_file['Lag Spikes'],
+        version = stat_file['Version'],
+        payload_hash = stat_file_hash(stat_file),
+    )
+
+# Returns (character_position_summaries, character_game_summaries, teams)
+# teams indexes the character_game_summary rows by roster location: {'Home': [9 rows], 'Away': [9 rows]}
+def character_rows(stat_file, game_id, home_player_id, away_player_id):
+    teams = {
+        'Home': [None] * 9,
+        'Away': [None] * 9,
+    }
+    character_position_summaries = list()
+    character_game_summaries = list()
+    character_game_stats = stat_file['Character Game Stats']
+    for roster_key in ROSTER_KEYS:
+        character = character_game_stats[roster_key]
+        defensive_stats = character['Defensive Stats']
+        offensive_stats = character['Offensive Stats']
+
+        pitches_per_position = defensive_stats['Batters Per Position'] if len(defensive_stats['Batters Per Position']) == 1 else [{}]
+        batter_outs_per_position = defensive_stats['Batter Outs Per Position'] if len(defensive_stats['Batter Outs Per Position']) == 1 else [{}]
+        outs_per_position = defensive_stats['Outs Per Position'] if len(defensive_stats['Outs Per Position']) == 1 else [{}]
+
+        character_position_summary = dict()
+        for prefix, per_position in [('pitches_at', pitches_per_position), ('batter_outs_at', batter_outs_per_position), ('outs_at', outs_per_position)]:
+            for position, column in POSITION_COLUMNS.items():
+                character_position_summary[f'{prefix}_{column}'] = per_position[0].get(position, 0)
+
+        character_game_summary = dict(
+            game_id = game_id,
+            team_id = int(character['Team']),
+            char_id = character['CharID'],
+            user_id = home_player_id if character['Team'] == '0' else away_player_id,
+            character_position_summary_id = character_position_summary,
+            roster_loc = character['RosterID'],
+            captain = character['Captain'],
+            superstar = character['Superstar'],
+            fielding_hand = character['Fielding Hand'],
+            batting_hand = character['Batting Hand'],
+            # Defensive Stats
+            batters_faced = defensive_stats['Batters Faced'],
+            runs_allowed = defensive_stats['Runs Allowed'],
+            earned_runs = defensive_stats['Earned Runs'],
+            batters_walked = defensive_stats['Batters Walked'],
+            batters_hit = defensive_stats['Batters Hit'],
+            hits_allowed = defensive_stats['Hits Allowed'],
+            homeruns_allowed = defensive_stats['HRs Allowed'],
+            pitches_thrown = defensive_stats['Pitches Thrown'],
+            stamina = defensive_stats['Stamina'],
+            was_pitcher = defensive_stats['Was Pitcher'],
+            strikeouts_pitched = defensive_stats['Strikeouts'],
+            star_pitches_thrown = defensive_stats['Star Pitches Thrown'],
+            big_plays = defensive_stats['Big Plays'],
+            outs_pitched = defensive_stats['Outs Pitched'],
+            # Offensive Stats
+            at_bats = offensive_stats['At Bats'],
+            plate_appearances = 0,
+            hits = offensive_stats['Hits'],
+            singles = offensive_stats['Singles'],
+            doubles = offensive_stats['Doubles'],
+            triples = offensive_stats['Triples'],
+            homeruns = offensive_stats['Homeruns'],
+            successful_bunts = offensive_stats['Successful Bunts'],
+            sac_flys = offensive_stats['Sac Flys'],
+            strikeouts = offensive_stats['Strikeouts'],
+            walks_bb = offensive_stats['Walks (4 Balls)'],
+            walks_hit = offensive_stats['Walks (Hit)'],
+            rbi = offensive_stats['RBI'],
+            bases_stolen = offensive_stats['Bases Stolen'],
+            star_hits = offensive_stats['Star Hits'],
+        )
+        #Star tracking (Not in JSON. Calculated from the events)
+        for counter in STAR_COUNTERS:
+            character_game_summary[counter] = 0
+
+        character_position_summaries.append(character_position_summary)
+        character_game_summaries.append(character_game_summary)
+
+        # index character_game_summarys for later use
+        if character['Team'] == '0':
+            teams['Home'][character['RosterID']] = character_game_summary
+        else:
+            teams['Away'][character['RosterID']] = character_game_summary
+
+    return character_position_summaries, character_game_summaries, teams
+
+# Add the event, runner, pitch, contact and fielding rows for one stat file event to event_batch
+def add_event_rows(event_batch, event_data, event_num, game_id, teams, runner_state_builder):
+    # Away bats in the top half (0), home in the bottom half (1)
+    batting_team = teams['Away'] if event_data['Half Inning'] == 0 else teams['Home']
+    fielding_team = teams['Home'] if event_data['Half Inning'] == 0 else teams['Away']
+
+    event = dict(
+        game_id = game_id,
+        pitcher_id = fielding_team[event_data['Pitcher Roster Loc']],
+        batter_id = batting_team[event_data['Batter Roster Loc']],
+        catcher_id = fielding_team[event_data['Catcher Roster Loc']],
+        runner_on_0 = None,
+        runner_on_1 = None,
+        runner_on_2 = None,
+        runner_on_3 = None,
+        pitch_summary_id = None,
+        event_num = event_num,
+        away_score = event_data['Away Score'],
+        home_score = event_data['Home Score'],
+        inning = event_data['Inning'],
+        half_inning = event_data['Half Inning'],
+        chem_links_ob = event_data['Chemistry Links on Base'],
+        star_chance = event_data['Star Chance'],
+        away_stars = event_data['Away Stars'],
+        home_stars = event_data['Home Stars'],
+        pitcher_stamina = event_data['Pitcher Stamina'],
+        outs = event_data['Outs'],
+        balls = event_data['Balls'],
+        strikes = event_data['Strikes'],
+        result_num_of_outs = event_data['Num Outs During Play'],
+        result_rbi = event_data['RBI'],
+        result_of_ab = event_data['Result of AB'],
+    )
+
+    # Runner rows are shared by consecutive events until the runner's state changes
+    event_runners, new_runners = runner_state_builder.add_event(event_data)
+    event.update(event_runners)
+    event_batch['runners'].extend(new_runners)
+
+    # ==== Pitch Summary ====
+    if 'Pitch' in event_data:
+        pitch_data = event_data['Pitch']
+        pitch_summary = dict(
+            contact_summary_id = None,
+            pitch_type = pitch_data['Pitch Type'],
+            charge_pitch_type = pitch_data['Charge Type'],
+            star_pitch = pitch_data['Star Pitch'],
+            pitch_speed = pitch_data['Pitch Speed'],
+            ball_position_strikezone = pitch_data['Ball Position - Strikezone'],
+            bat_x_contact_pos = pitch_data['Bat Contact Pos - X'],
+            bat_z_contact_pos = pitch_data['Bat Contact Pos - Z'],
+            in_strikezone = pitch_data['In Strikezone'],
+            type_of_swing = pitch_data['Type of Swing'],
+            d_ball = pitch_data['DB'],
+        )
+
+        # if the batter made contact with the pitch
+        if 'Contact' in pitch_data:
+            contact_data = pitch_data['Contact']
+            #  ==== Contact Summary ====
+            contact_summary = dict(
+                fielding_summary_id = None,
+                type_of_contact = contact_data['Type of Contact'],
+                charge_power_up = contact_data['Charge Power Up'],
+                charge_power_down = contact_data['Charge Power Down'],
+                star_swing_five_star = contact_data['Star Swing Five-Star'],
+                input_direction = contact_data['Input Direction - Push/Pull'],
+                input_direction_stick = contact_data['Input Direction - Stick'],
+                frame_of_swing_upon_contact = contact_data['Frame of Swing Upon Contact'],
+                ball_power = int(contact_data['Ball Power'].replace(',', '')),
+                ball_horiz_angle = int(contact_data['Vert Angle'].replace(',', '')),
+                ball_vert_angle = int(contact_data['Horiz Angle'].replace(',', '')),
+                contact_absolute = contact_data['Contact Absolute'],
+                contact_quality = contact_data['Contact Quality'],
+                rng1 = int(contact_data['RNG1'].replace(',', '')),
+                rng2 = int(contact_data['RNG2'].replace(',', '')),
+                rng3 = int(contact_data['RNG3'].replace(',', '')),
+                ball_x_velocity = contact_data['Ball Velocity - X'],
+                ball_y_velocity = contact_data['Ball Velocity - Y'],
+                ball_z_velocity = contact_data['Ball Velocity - Z'],
+                ball_x_contact_pos = contact_data['Ball Contact Pos - X'],
+                ball_z_contact_pos = contact_data['Ball Contact Pos - Z'],
+                ball_x_landing_pos = contact_data['Ball Landing Position - X'],
+                ball_y_landing_pos = contact_data['Ball Landing Position - Y'],
+                ball_z_landing_pos = contact_data['Ball Landing Position - Z'],
+                ball_max_height = contact_data['Ball Max Height'],
+                ball_hang_time = int(contact_data['Ball Hang Time'].replace(',', '')),
+                primary_result = contact_data['Contact Result - Primary'],
+                secondary_result = contact_data['Contact Result - Secondary']
+            )
+            event_batch['contact_summaries'].append(contact_summary)
+            pitch_summary['contact_summary_id'] = contact_summary
+
+            # ==== Fielding Summary ====
+            if 'First Fielder' in contact_data:
+                fielder_data = contact_data['First Fielder']
+                fielding_summary = dict(
+                    fielder_character_game_summary_id = fielding_team[fielder_data['Fielder Roster Location']],
+                    position = fielder_data['Fielder Position'],
+                    action = fielder_data['Fielder Action'],
+                    jump = fielder_data['Fielder Jump'],
+                    bobble = fielder_data['Fielder Bobble'],
+                    swap = False if fielder_data['Fielder Swap'] == 0 else True,
+                    manual_select = fielder_data['Fielder Manual Selected'],
+                    fielder_x_pos = fielder_data['Fielder Position - X'],
+                    fielder_y_pos = fielder_data['Fielder Position - Y'],
+                    fielder_z_pos = fielder_data['Fielder Position - Z']
+                )
+                event_batch['fielding_summaries'].append(fielding_summary)
+                contact_summary['fielding_summary_id'] = fielding_summary
+
+        event_batch['pitch_summaries'].append(pitch_summary)
+        event['pitch_summary_id'] = pitch_summary
+    event_batch['events'].append(event)
+
+# Write the star counters (lists of 18, one per roster slot) onto the character_game_summary rows
+def apply_star_counters(roster_slots, star_counters):
+    for counter, values in star_counters.items():
+        for summary, value in zip(roster_slots, values):
+            summary[counter] = value
+
+# Every row for a complete stat file, keyed like new_event_batch plus 'games',
+# 'character_position_summaries' and 'character_game_summaries'.
+# captain_eligible(char_id) - True if the character can be captain
+def transform_stat_file(stat_file, game_id, home_player_id, away_player_id, captain_eligible):
+    rows = new_event_batch()
+    rows['games'] = [game_row(stat_file, game_id, home_player_id, away_player_id)]
+    rows['character_position_summaries'], rows['character_game_summaries'], teams = character_rows(stat_file, game_id, home_player_id, away_player_id)
+
+    runner_state_builder = RunnerStateBuilder(teams)
+    star_columns = new_star_columns()
+    star_pitch = None
+    for event_num, event_data in enumerate(stat_file['Events']):
+        add_event_rows(rows, event_data, event_num, game_id, teams, runner_state_builder)
+        star_pitch = append_star_columns(star_columns, event_data, star_pitch)
+
+    roster_slots = teams['Away'] + teams['Home']
+    star_counters = calc_star_counters(
+        star_columns,
+        [summary['captain'] for summary in roster_slots],
+        [captain_eligible(summary['char_id']) for summary in roster_slots]
+    )
+    apply_star_counters(roster_slots, star_counters)
+    return rows
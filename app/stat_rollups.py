@@ -0,0 +1,247 @@
+from sqlalchemy import text
+from .models import db
+
+# character_game_rollup and batting_rollup hold the stats /detailed_stats/ used to count from event,
+# pitch_summary, contact_summary and fielding_summary on every request, summed per character per game
+# (batting also per swing type and foul/not foul). /detailed_stats/ sums the rollup rows of the selected games.
+# star_chance_rollup holds the /star_chances/ counts per half inning of each game.
+# event_fact flattens each event with its pitch, contact, fielding and batter/pitcher/fielder ids for the event filters.
+# Rows are (re)written in the same transaction as the game's stat rows by /populate_db/ and bulk-load.
+# `flask rollup-games` writes them for games stored before the tables existed and
+# `flask check-rollups` recomputes them from the raw tables and reports rows that drifted.
+
+CHARACTER_GAME_ROLLUP_COLUMNS = ['balls', 'strikes', 'jump_catches', 'diving_catches', 'wall_jumps', 'swap_successes', 'bobbles']
+
+BATTING_ROLLUP_COLUMNS = ['outs', 'foul_hits', 'fair_hits', 'sour_hits', 'nice_hits', 'perfect_hits', 'singles', 'doubles',
+                          'triples', 'homeruns', 'sacflys', 'strikeouts', 'plate_appearances', 'rbi']
+
+# Columns counted from the batter's contact. Foul contact is left out of these when stats exclude nonfair hits
+BATTING_CONTACT_COLUMNS = BATTING_ROLLUP_COLUMNS[:11]
+
+STAR_CHANCE_ROLLUP_COLUMNS = ['eligible_event', 'star_chances', 'total_events', 'pitcher_win', 'batter_win']
+
+EVENT_FACT_COLUMNS = ['game_id', 'event_num', 'inning', 'half_inning', 'balls', 'strikes', 'outs', 'chem_links_ob', 'star_chance',
+                      'away_stars', 'home_stars', 'bases_empty', 'result_of_ab', 'result_rbi', 'pitch_summary_id', 'contact_summary_id',
+                      'fielding_summary_id', 'type_of_swing', 'type_of_contact', 'batter_id', 'batter_char_id', 'batter_user_id',
+                      'batter_hand', 'pitcher_id', 'pitcher_char_id', 'pitcher_user_id', 'pitcher_hand', 'fielder_id',
+                      'fielder_char_id', 'fielder_user_id', 'fielder_position']
+
+# Rollup rows computed from the raw tables, for the games in :game_ids
+CHARACTER_GAME_ROLLUP_SELECT = (
+    'SELECT \n'
+    '   character_game_summary.id AS character_game_summary_id, \n'
+    '   character_game_summary.game_id, \n'
+    '   character_game_summary.user_id, \n'
+    '   character_game_summary.char_id, \n'
+    '   COALESCE(pitches.balls, 0) AS balls, \n'
+    '   COALESCE(pitches.strikes, 0) AS strikes, \n'
+    '   COALESCE(fielding.jump_catches, 0) AS jump_catches, \n'
+    '   COALESCE(fielding.diving_catches, 0) AS diving_catches, \n'
+    '   COALESCE(fielding.wall_jumps, 0) AS wall_jumps, \n'
+    '   COALESCE(fielding.swap_successes, 0) AS swap_successes, \n'
+    '   COALESCE(fielding.bobbles, 0) AS bobbles \n'
+    'FROM character_game_summary \n'
+    'LEFT JOIN ( \n'
+    '   SELECT \n'
+    '       event.pitcher_id, \n'
+    '       COUNT(CASE WHEN (pitch_summary.in_strikezone = false AND pitch_summary.type_of_swing = 0) THEN 1 ELSE NULL END) AS balls, \n'
+    '       COUNT(CASE WHEN (pitch_summary.in_strikezone = false AND pitch_summary.type_of_swing > 0) THEN 1 ELSE NULL END) AS strikes \n'
+    '   FROM event \n'
+    '   JOIN pitch_summary ON pitch_summary.id = event.pitch_summary_id \n'
+    '   JOIN contact_summary ON contact_summary.id = pitch_summary.contact_summary_id \n'
+    '   WHERE event.game_id = ANY(:game_ids) \n'
+    '   GROUP BY event.pitcher_id \n'
+    ') AS pitches ON pitches.pitcher_id = character_game_summary.id \n'
+    'LEFT JOIN ( \n'
+    '   SELECT \n'
+    '       fielding_summary.fielder_character_game_summary_id, \n'
+    '       COUNT(CASE WHEN fielding_summary.action = 1 THEN 1 ELSE NULL END) AS jump_catches, \n'
+    '       COUNT(CASE WHEN fielding_summary.action = 2 THEN 1 ELSE NULL END) AS diving_catches, \n'
+    '       COUNT(CASE WHEN fielding_summary.action = 3 THEN 1 ELSE NULL END) AS wall_jumps, \n'
+    '       SUM(CASE WHEN fielding_summary.swap = True THEN 1 ELSE 0 END) AS swap_successes, \n'
+    '       COUNT(CASE WHEN fielding_summary.bobble != 0 THEN 1 ELSE NULL END) AS bobbles \n'
+    '   FROM fielding_summary \n'
+    '   JOIN character_game_summary AS fielder ON fielder.id = fielding_summary.fielder_character_game_summary_id \n'
+    '   WHERE fielder.game_id = ANY(:game_ids) \n'
+    '   GROUP BY fielding_summary.fielder_character_game_summary_id \n'
+    ') AS fielding ON fielding.fielder_character_game_summary_id = character_game_summary.id \n'
+    'WHERE character_game_summary.game_id = ANY(:game_ids)'
+)
+
+BATTING_ROLLUP_SELECT = (
+    'SELECT \n'
+    '   character_game_summary.id AS character_game_summary_id, \n'
+    '   character_game_summary.game_id, \n'
+    '   character_game_summary.user_id, \n'
+    '   character_game_summary.char_id, \n'
+    '   pitch_summary.type_of_swing, \n'
+    '   COALESCE(contact_summary.primary_result = 1, false) AS foul, \n'
+    '   COUNT(CASE WHEN (contact_summary.primary_result = 0) THEN 1 ELSE NULL END) AS outs, \n'
+    '   COUNT(CASE WHEN contact_summary.primary_result = 1 THEN 1 ELSE NULL END) AS foul_hits, \n'
+    '   COUNT(CASE WHEN (contact_summary.primary_result = 2 OR contact_summary.primary_result = 3) THEN 1 ELSE NULL END) AS fair_hits, \n'
+    '   COUNT(CASE WHEN (contact_summary.type_of_contact = 0 OR contact_summary.type_of_contact = 4) THEN 1 ELSE NULL END) AS sour_hits, \n'
+    '   COUNT(CASE WHEN (contact_summary.type_of_contact = 1 OR contact_summary.type_of_contact = 3) THEN 1 ELSE NULL END) AS nice_hits, \n'
+    '   COUNT(CASE WHEN contact_summary.type_of_contact = 2 THEN 1 ELSE NULL END) AS perfect_hits, \n'
+    '   COUNT(CASE WHEN contact_summary.secondary_result = 7 THEN 1 ELSE NULL END) AS singles, \n'
+    '   COUNT(CASE WHEN contact_summary.secondary_result = 8 THEN 1 ELSE NULL END) AS doubles, \n'
+    '   COUNT(CASE WHEN contact_summary.secondary_result = 9 THEN 1 ELSE NULL END) AS triples, \n'
+    '   COUNT(CASE WHEN contact_summary.secondary_result = 10 THEN 1 ELSE NULL END) AS homeruns, \n'
+    '   COUNT(CASE WHEN contact_summary.secondary_result = 14 THEN 1 ELSE NULL END) AS sacflys, \n'
+    '   COUNT(CASE WHEN event.result_of_ab = 1 THEN 1 ELSE NULL END) AS strikeouts, \n'
+    '   COUNT(CASE WHEN event.result_of_ab != 0 THEN 1 ELSE NULL END) AS plate_appearances, \n'
+    '   SUM(event.result_rbi) AS rbi \n'
+    'FROM character_game_summary \n'
+    'JOIN event ON character_game_summary.id = event.batter_id \n'
+    'JOIN pitch_summary ON pitch_summary.id = event.pitch_summary_id \n'
+    'LEFT JOIN contact_summary ON pitch_summary.contact_summary_id = contact_summary.id \n'
+    'WHERE character_game_summary.game_id = ANY(:game_ids) \n'
+    'GROUP BY character_game_summary.id, pitch_summary.type_of_swing, foul'
+)
+
+# Same counts as the /star_chances/ event query, which only sees events with a pitch
+STAR_CHANCE_ROLLUP_SELECT = (
+    'SELECT \n'
+    '   event.game_id, \n'
+    '   event.inning, \n'
+    '   event.half_inning, \n'
+    '   COUNT(CASE WHEN (event.runner_on_1 IS NULL AND event.runner_on_2 IS NULL AND event.runner_on_3 IS NULL AND event.event_num != 0 \n'
+    '       AND (event.away_stars < 5 OR event.home_stars < 5)) THEN 1 ELSE NULL END) AS eligible_event, \n'
+    '   COUNT(CASE WHEN (event.star_chance = 1 AND event.result_of_ab > 0) THEN 1 ELSE NULL END) AS star_chances, \n'
+    '   COUNT(CASE WHEN event.result_of_ab > 0 THEN 1 ELSE NULL END) AS total_events, \n'
+    '   COUNT(CASE WHEN (event.star_chance = 1 AND event.result_of_ab >= 1 AND event.result_of_ab <= 6) THEN 1 ELSE NULL END) AS pitcher_win, \n'
+    '   COUNT(CASE WHEN (event.star_chance = 1 AND event.result_of_ab >= 7) THEN 1 ELSE NULL END) AS batter_win \n'
+    'FROM event \n'
+    'JOIN pitch_summary ON pitch_summary.id = event.pitch_summary_id \n'
+    'WHERE event.game_id = ANY(:game_ids) AND event.result_of_ab != 0 \n'
+    'GROUP BY event.game_id, event.inning, event.half_inning'
+)
+
+EVENT_FACT_SELECT = (
+    'SELECT \n'
+    '   event.id AS event_id, \n'
+    '   event.game_id, event.event_num, event.inning, event.half_inning, event.balls, event.strikes, event.outs, \n'
+    '   event.chem_links_ob, event.star_chance, event.away_stars, event.home_stars, \n'
+    '   (event.runner_on_1 IS NULL AND event.runner_on_2 IS NULL AND event.runner_on_3 IS NULL) AS bases_empty, \n'
+    '   event.result_of_ab, event.result_rbi, \n'
+    '   event.pitch_summary_id, \n'
+    '   pitch_summary.contact_summary_id, \n'
+    '   contact_summary.fielding_summary_id, \n'
+    '   pitch_summary.type_of_swing, \n'
+    '   contact_summary.type_of_contact, \n'
+    '   event.batter_id, batter.char_id AS batter_char_id, batter.user_id AS batter_user_id, batter.batting_hand AS batter_hand, \n'
+    '   event.pitcher_id, pitcher.char_id AS pitcher_char_id, pitcher.user_id AS pitcher_user_id, pitcher.fielding_hand AS pitcher_hand, \n'
+    '   fielder.id AS fielder_id, fielder.char_id AS fielder_char_id, fielder.user_id AS fielder_user_id, \n'
+    '   fielding_summary.position AS fielder_position \n'
+    'FROM event \n'
+    'JOIN character_game_summary AS batter ON batter.id = event.batter_id \n'
+    'JOIN character_game_summary AS pitcher ON pitcher.id = event.pitcher_id \n'
+    'LEFT JOIN pitch_summary ON pitch_summary.id = event.pitch_summary_id \n'
+    'LEFT JOIN contact_summary ON contact_summary.id = pitch_summary.contact_summary_id \n'
+    'LEFT JOIN fielding_summary ON fielding_summary.id = contact_summary.fielding_summary_id \n'
+    'LEFT JOIN character_game_summary AS fielder ON fielder.id = fielding_summary.fielder_character_game_summary_id \n'
+    'WHERE event.game_id = ANY(:game_ids)'
+)
+
+CHARACTER_GAME_ROLLUP_KEY = ['character_game_summary_id']
+BATTING_ROLLUP_KEY = ['character_game_summary_id', 'type_of_swing', 'foul']
+STAR_CHANCE_ROLLUP_KEY = ['game_id', 'inning', 'half_inning']
+EVENT_FACT_KEY = ['event_id']
+
+# Columns stored with the rows of character rollups that aren't part of the key
+CHARACTER_COLUMNS = ['game_id', 'user_id', 'char_id']
+
+# (table, select, key, columns). The first key column is never NULL
+ROLLUP_TABLES = [
+    ('character_game_rollup', CHARACTER_GAME_ROLLUP_SELECT, CHARACTER_GAME_ROLLUP_KEY, CHARACTER_COLUMNS + CHARACTER_GAME_ROLLUP_COLUMNS),
+    ('batting_rollup', BATTING_ROLLUP_SELECT, BATTING_ROLLUP_KEY, CHARACTER_COLUMNS + BATTING_ROLLUP_COLUMNS),
+    ('star_chance_rollup', STAR_CHANCE_ROLLUP_SELECT, STAR_CHANCE_ROLLUP_KEY, STAR_CHANCE_ROLLUP_COLUMNS),
+    ('event_fact', EVENT_FACT_SELECT, EVENT_FACT_KEY, EVENT_FACT_COLUMNS),
+]
+
+# Tables every game has rows in once it is rolled up
+MISSING_CHECK_TABLES = ['character_game_rollup', 'star_chance_rollup', 'event_fact']
+
+def rollup_insert_query(table, select_statement, key, columns):
+    all_columns = ', '.join(key + columns)
+    return text(f'INSERT INTO {table} ({all_columns}) \nSELECT {all_columns} FROM ({select_statement}) AS rollup_rows')
+
+# Rows that differ between the stored rollup and the raw tables. Missing rows on either side count as drift
+def rollup_drift_query(table, select_statement, key, columns):
+    all_columns = key + columns
+    key_columns = ', '.join(f'COALESCE(stored.{column}, fresh.{column}) AS {column}' for column in key)
+    # FULL JOIN needs plain equality, type_of_swing can be NULL
+    join_condition = ' AND '.join(f"COALESCE(stored.{column}::text, '') = COALESCE(fresh.{column}::text, '')" for column in key)
+    stored_row = ', '.join(f'stored.{column}' for column in all_columns)
+    fresh_row = ', '.join(f'fresh.{column}' for column in all_columns)
+    stored_object = ', '.join(f"'{column}', stored.{column}" for column in all_columns)
+    fresh_object = ', '.join(f"'{column}', fresh.{column}" for column in all_columns)
+    return text(
+        f'SELECT {key_columns}, \n'
+        f'   json_build_object({stored_object}) AS stored, \n'
+        f'   json_build_object({fresh_object}) AS fresh \n'
+        f'FROM (SELECT * FROM {table} WHERE game_id = ANY(:game_ids)) AS stored \n'
+        f'FULL JOIN ({select_statement}) AS fresh ON {join_condition} \n'
+        f'WHERE stored.{key[0]} IS NULL OR fresh.{key[0]} IS NULL \n'
+        f'   OR ROW({stored_row}) IS DISTINCT FROM ROW({fresh_row})'
+    )
+
+ROLLUP_INSERT_QUERIES = [(table, rollup_insert_query(table, select_statement, key, columns)) for table, select_statement, key, columns in ROLLUP_TABLES]
+ROLLUP_DRIFT_QUERIES = [(table, rollup_drift_query(table, select_statement, key, columns)) for table, select_statement, key, columns in ROLLUP_TABLES]
+
+# Write (or rewrite) the rollup rows of the given games from their stat rows. Does not commit
+def rollup_games(game_ids):
+    if len(game_ids) == 0:
+        return
+    params = {'game_ids': list(game_ids)}
+    for table, insert_query in ROLLUP_INSERT_QUERIES:
+        db.session.execute(text(f'DELETE FROM {table} WHERE game_id = ANY(:game_ids)'), params)
+        db.session.execute(insert_query, params)
+
+# Game ids in game_id order, batch_size at a time. missing_only skips games that already have rows in every MISSING_CHECK_TABLES table
+def game_id_batches(batch_size, missing_only=False):
+    rolled_up = ' AND '.join(f'EXISTS (SELECT 1 FROM {table} WHERE {table}.game_id = game.game_id)' for table in MISSING_CHECK_TABLES)
+    query = text(
+        'SELECT game.game_id FROM game \n'
+        'WHERE game.game_id > :last_game_id \n'
+        f'{f"AND NOT ({rolled_up}) " if missing_only else ""}'
+        'ORDER BY game.game_id \n'
+        'LIMIT :batch_size'
+    )
+
+    last_game_id = -1
+    while True:
+        game_ids = db.session.execute(query, {'last_game_id': last_game_id, 'batch_size': batch_size}).scalars().all()
+        if len(game_ids) == 0:
+            return
+        yield game_ids
+        last_game_id = game_ids[-1]
+
+# Roll up every game in game_id order, committing every batch_size games
+# Returns the number of games rolled up
+def backfill_rollups(batch_size, missing_only=False, progress=None):
+    rolled_up = 0
+    for game_ids in game_id_batches(batch_size, missing_only):
+        rollup_games(game_ids)
+        db.session.commit()
+        rolled_up += len(game_ids)
+        if progress != None:
+            progress(rolled_up)
+    return rolled_up
+
+# Recompute the rollups of the given games (every game when None) and return the rows that drifted as
+# {'table', 'key', 'stored', 'fresh'} dicts. stored or fresh is all None when the row is missing on that side
+def check_rollups(game_ids=None, batch_size=1000, progress=None):
+    batches = [game_ids] if game_ids != None else game_id_batches(batch_size)
+    drift = list()
+    checked = 0
+    for batch in batches:
+        for table, drift_query in ROLLUP_DRIFT_QUERIES:
+            for row in db.session.execute(drift_query, {'game_ids': list(batch)}).all():
+                row = row._asdict()
+                stored = row.pop('stored')
+                fresh = row.pop('fresh')
+                drift.append({'table': table, 'key': row, 'stored': stored, 'fresh': fresh})
+        checked += len(batch)
+        if progress != None:
+            progress(checked, len(drift))
+    return drift
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The endpoint tests run from app/tests (`from connection import Connection`), the unit tests import the app
+# package. Put the repo root on the path so both work from app/tests and from the repo root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..')))
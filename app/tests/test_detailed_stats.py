@@ -0,0 +1,23 @@
+from app.detailed_stats import add_detailed_stats_rows
+
+def test_detailed_stats_paths():
+    keys = ['user_id', 'username', 'char_id', 'char_name', 'type_of_swing', 'outs', 'rbi']
+    rows = [
+        (1, 'Alpha', 0, 'Mario', 1, 2, 3),
+        (1, 'Alpha', 0, 'Mario', 2, 4, 5),
+        (2, 'Beta', 3, 'Peach', 1, 6, 7),
+    ]
+    stats = add_detailed_stats_rows({}, 'Batting', keys, rows, group_by_user=True, group_by_char=True, group_by_swing=True)
+    assert stats == {
+        'Alpha': {'Mario': {'Batting': {'Slap': {'outs': 2, 'rbi': 3}, 'Charge': {'outs': 4, 'rbi': 5}}}},
+        'Beta': {'Peach': {'Batting': {'Slap': {'outs': 6, 'rbi': 7}}}},
+    }
+
+    # Later queries merge into the same path, a single stat column still comes back as a dict
+    add_detailed_stats_rows(stats, 'Pitching', ['username', 'char_name', 'balls'], [('Alpha', 'Mario', 8)], group_by_user=True, group_by_char=True)
+    assert stats['Alpha']['Mario']['Pitching'] == {'balls': 8}
+
+    # Ungrouped rows merge straight under the result type
+    stats = add_detailed_stats_rows({}, 'Misc', ['game_appearances'], [(9,)])
+    add_detailed_stats_rows(stats, 'Misc', ['away_wins', 'home_wins'], [(1, 2)])
+    assert stats == {'Misc': {'game_appearances': 9, 'away_wins': 1, 'home_wins': 2}}
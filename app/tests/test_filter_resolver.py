@@ -0,0 +1,23 @@
+from app.filter_resolver import NameCache
+
+def test_name_cache_lru_and_ttl():
+    cache = NameCache(max_size=2, ttl=60)
+    cache.set('user', 'alpha', 1)
+    cache.set('user', 'bravo', 2)
+    assert cache.get('user', 'alpha') == 1
+
+    # bravo is the least recently used entry once alpha is read
+    cache.set('tag', 'ranked', 3)
+    assert cache.get('user', 'bravo') == None
+    assert cache.get('user', 'alpha') == 1
+    assert cache.get('tag', 'ranked') == 3
+
+    cache.invalidate('user', 'alpha')
+    assert cache.get('user', 'alpha') == None
+    assert cache.get('tag', 'ranked') == 3
+    cache.invalidate()
+    assert cache.get('tag', 'ranked') == None
+
+    expired = NameCache(max_size=2, ttl=-1)
+    expired.set('user', 'alpha', 1)
+    assert expired.get('user', 'alpha') == None
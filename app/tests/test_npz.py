@@ -0,0 +1,47 @@
+from array import array
+from sqlalchemy import types
+from app.npz import NpzColumns
+import ast
+import io
+import math
+import struct
+import zipfile
+
+# Read the arrays back the way np.load would, numpy isn't a dependency
+def read_npz(data):
+    arrays = dict()
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for name in archive.namelist():
+            raw = archive.read(name)
+            assert raw[:8] == b'\x93NUMPY\x01\x00'
+            header_length = struct.unpack('<H', raw[8:10])[0]
+            assert (10 + header_length) % 64 == 0
+            header = ast.literal_eval(raw[10:10 + header_length].decode('latin1'))
+            body = raw[10 + header_length:]
+            if header['descr'].startswith('<U'):
+                width = int(header['descr'][2:]) * 4
+                values = [body[i:i + width].decode('utf-32-le').rstrip('\0') for i in range(0, len(body), width)]
+            else:
+                values = array({'|b1': 'b', '<i4': 'i', '<i8': 'q', '<f8': 'd'}[header['descr']])
+                values.frombytes(body)
+                values = list(values)
+            assert header['shape'] == (len(values),)
+            arrays[name[:-len('.npy')]] = (header['descr'], values)
+    return arrays
+
+def test_npz_columns():
+    columns = NpzColumns([('game_id', types.BigInteger()), ('char_id', types.Integer()), ('hand', types.Boolean()),
+                          ('power', types.Float()), ('username', types.String())])
+    columns.append([(1, 3, True, 1.5, 'Alpha'), (2, None, False, None, 'Bëta')])
+    columns.append([(3, 4, True, 2.0, 'Gammaaa')])
+    arrays = read_npz(columns.to_bytes())
+
+    assert arrays['game_id'] == ('<i8', [1, 2, 3])
+    assert arrays['char_id'] == ('<i4', [3, 0, 4])
+    assert arrays['hand'] == ('|b1', [1, 0, 1])
+    assert arrays['username'] == ('<U7', ['Alpha', 'Bëta', 'Gammaaa'])
+    assert arrays['power'][1][0] == 1.5 and math.isnan(arrays['power'][1][1])
+    # Only columns with NULLs get a mask, rows appended after the NULL are marked too
+    assert arrays['char_id_null'] == ('|b1', [0, 1, 0])
+    assert arrays['power_null'] == ('|b1', [0, 1, 0])
+    assert 'game_id_null' not in arrays
@@ -0,0 +1,24 @@
+from werkzeug.datastructures import MultiDict
+from app.response_cache import ResponseCache, LocalCacheBackend, RedisCacheBackend, LocalRedisClient, normalize_request
+
+def test_response_cache_generations():
+    for backend in [LocalCacheBackend(max_size=10), RedisCacheBackend(LocalRedisClient())]:
+        cache = ResponseCache(backend, ttl=60)
+        key = cache.entry_key('/games/', MultiDict([('username', 'Alpha')]))
+        scopes = [('user', 1)]
+
+        body, generations = cache.get(key, scopes)
+        assert body == None
+        cache.set(key, generations, b'{"games": []}')
+        assert cache.get(key, scopes)[0] == b'{"games": []}'
+
+        # Other users' games leave the entry alone, a game of user 1 invalidates it
+        cache.bump([('all',), ('user', 2)])
+        assert cache.get(key, scopes)[0] == b'{"games": []}'
+        cache.bump([('all',), ('user', 1)])
+        assert cache.get(key, scopes)[0] == None
+
+def test_normalize_request():
+    # Arg order doesn't matter, the order of an arg's values does
+    assert normalize_request('/games/', MultiDict([('tag', 'a'), ('username', 'x'), ('tag', 'b')])) == normalize_request('/games/', MultiDict([('username', 'x'), ('tag', 'a'), ('tag', 'b')]))
+    assert normalize_request('/games/', MultiDict([('tag', 'a'), ('tag', 'b')])) != normalize_request('/games/', MultiDict([('tag', 'b'), ('tag', 'a')]))
@@ -0,0 +1,34 @@
+import json
+import os
+from app.runner_state import build_runner_rows
+
+TESTS_DIR = os.path.dirname(__file__)
+GAMES_DIR = os.path.join(TESTS_DIR, '..', '..', 'json', 'games')
+
+# Runner rows and plate appearances written by the previous per-event comparison
+def test_runner_rows_sample_games():
+    expected = {
+        os.path.join(GAMES_DIR, '1.json'): (173, 98),
+        os.path.join(GAMES_DIR, '2.json'): (151, 87),
+        os.path.join(GAMES_DIR, '3.json'): (104, 82),
+        os.path.join(TESTS_DIR, 'data', 'game_785756763.json'): (136, 78),
+    }
+    for path, (runner_count, plate_appearances) in expected.items():
+        with open(path) as file:
+            events = json.load(file)['Events']
+
+        teams = {
+            'Away': [{'id': roster_loc, 'plate_appearances': 0} for roster_loc in range(9)],
+            'Home': [{'id': 9 + roster_loc, 'plate_appearances': 0} for roster_loc in range(9)],
+        }
+        runners, event_runners = build_runner_rows(events, teams)
+
+        assert len(runners) == runner_count
+        assert len(event_runners) == len(events)
+        assert sum(summary['plate_appearances'] for summary in teams['Away'] + teams['Home']) == plate_appearances
+
+        # Every event with a batter points at a runner row, reused rows are the same object
+        for event_data, runner_columns in zip(events, event_runners):
+            assert (runner_columns['runner_on_0'] != None) == ('Runner Batter' in event_data)
+            for runner in runner_columns.values():
+                assert runner == None or any(runner is row for row in runners)
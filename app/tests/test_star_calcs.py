@@ -0,0 +1,43 @@
+import json
+import os
+from app.star_calcs import star_columns_from_events, calc_star_counters, roster_slot, ROSTER_SLOTS
+
+TESTS_DIR = os.path.dirname(__file__)
+
+# Star counters are calculated without the database, so the sample game can be checked offline
+def test_star_counters_sample_game():
+    with open(os.path.join(TESTS_DIR, 'data', 'game_785756763.json')) as file:
+        data = json.load(file)
+    with open(os.path.join(TESTS_DIR, '..', '..', 'json', 'characters.json')) as file:
+        captain_eligible_chars = [int(character['Char Id'], 16) for character in json.load(file)['Characters'] if character['Captain (true:1,false:0) (0x33)'] == 1]
+
+    captains = [None] * ROSTER_SLOTS
+    captain_eligible = [None] * ROSTER_SLOTS
+    for character in data['Character Game Stats'].values():
+        # Team '0' is the home team
+        slot = roster_slot(character['Team'] == '0', character['RosterID'])
+        captains[slot] = character['Captain']
+        captain_eligible[slot] = character['CharID'] in captain_eligible_chars
+
+    columns = star_columns_from_events(data['Events'])
+    assert len(columns['batter_slot']) == len(data['Events'])
+
+    counters = calc_star_counters(columns, captains, captain_eligible)
+    totals = {counter: sum(values) for counter, values in counters.items()}
+    assert totals == {
+        'offensive_star_swings': 15,
+        'offensive_stars_used': 17,
+        'offensive_stars_put_in_play': 9,
+        'offensive_star_successes': 9,
+        'offensive_star_chances': 5,
+        'offensive_star_chances_won': 3,
+        'defensive_star_pitches': 0,
+        'defensive_stars_used': 0,
+        'defensive_star_successes': 0,
+        'defensive_star_chances': 5,
+        'defensive_star_chances_won': 2,
+    }
+
+    # Away roster 7 took three star swings, away roster 2 pitched four star chances
+    assert counters['offensive_star_swings'][roster_slot(False, 7)] == 3
+    assert counters['defensive_star_chances'][roster_slot(False, 2)] == 4
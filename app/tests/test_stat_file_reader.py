@@ -0,0 +1,31 @@
+import io
+import json
+import os
+import pytest
+from app.stat_file_reader import StatFileReader, StatFileError
+
+TESTS_DIR = os.path.dirname(__file__)
+
+def test_stat_file_reader_matches_json():
+    with open(os.path.join(TESTS_DIR, 'data', 'game_785756763.json'), 'rb') as file:
+        body = file.read()
+    data = json.loads(body)
+
+    # Tiny chunks split keys, strings and numbers across reads
+    for chunk_size in [13, 4096]:
+        fields = dict()
+        events = list()
+        for key, value in StatFileReader(io.BytesIO(body), chunk_size).items(stream_keys=['Events']):
+            if key == 'Events':
+                events = list(value)
+            else:
+                fields[key] = value
+
+        assert events == data['Events']
+        assert fields == {key: value for key, value in data.items() if key != 'Events'}
+
+def test_stat_file_reader_malformed():
+    with pytest.raises(StatFileError):
+        dict(StatFileReader(io.BytesIO(b'{"GameID": "1", "Events": [{"Inning": 1},')).items())
+    with pytest.raises(StatFileError):
+        dict(StatFileReader(io.BytesIO(b'["GameID"]')).items())
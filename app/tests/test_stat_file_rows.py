@@ -0,0 +1,42 @@
+import json
+import os
+from app.stat_file_rows import ROW_REFERENCES, transform_stat_file, stat_file_hash
+
+TESTS_DIR = os.path.dirname(__file__)
+
+def test_transform_stat_file():
+    with open(os.path.join(TESTS_DIR, 'data', 'game_785756763.json')) as file:
+        stat_file = json.load(file)
+    # Sample file predates the Away/Home roster keys
+    stat_file['Character Game Stats'] = {key.replace('Team 0 Roster', 'Away Roster').replace('Team 1 Roster', 'Home Roster'): value for key, value in stat_file['Character Game Stats'].items()}
+
+    rows = transform_stat_file(stat_file, 785756763, 2, 1, lambda char_id: False)
+
+    assert len(rows['games']) == 1
+    assert rows['games'][0]['home_player_id'] == 2
+    assert len(rows['character_position_summaries']) == 18
+    assert len(rows['character_game_summaries']) == 18
+    assert len(rows['events']) == len(stat_file['Events'])
+    assert len(rows['runners']) == 136
+    assert len(rows['pitch_summaries']) == len([event for event in stat_file['Events'] if 'Pitch' in event])
+    assert sum(summary['plate_appearances'] for summary in rows['character_game_summaries']) == 78
+    assert [event['event_num'] for event in rows['events']] == list(range(len(stat_file['Events'])))
+
+    # References point at rows of the same transform so ids can be swapped in before insert
+    row_ids = {id(row) for table_rows in rows.values() for row in table_rows}
+    for rows_key, columns in ROW_REFERENCES.items():
+        for row in rows[rows_key]:
+            for column in columns:
+                assert row[column] == None or id(row[column]) in row_ids
+
+def test_stat_file_hash():
+    with open(os.path.join(TESTS_DIR, 'data', 'game_785756763.json')) as file:
+        stat_file = json.load(file)
+
+    # Streamed submissions hash the fields without Events, in whatever order they arrived
+    header = {key: stat_file[key] for key in reversed(list(stat_file.keys())) if key != 'Events'}
+    assert stat_file_hash(header) == stat_file_hash(stat_file)
+
+    changed = dict(stat_file)
+    changed['Date - Start'] = str(int(stat_file['Date - Start']) + 1)
+    assert stat_file_hash(changed) != stat_file_hash(stat_file)
@@ -1,8 +1,11 @@
 from flask import request, abort
 from flask import current_app as app
+from sqlalchemy import text
 from ..models import *
 from ..consts import *
 from ..util import *
+from ..character_cache import invalidate_character_cache
+from ..filter_resolver import invalidate_name_cache
 import json
 import os
 
@@ -36,6 +39,10 @@ def init_db():
 @app.route('/wipe_db/', methods=['POST'])
 def wipe_db():
     if os.getenv('ADMIN_KEY') == request.json['ADMIN_KEY']:
+        # The wOBA views (app/sql/woba_views.txt) read the stat tables, drop_all can't drop tables views depend on.
+        # They're created again by the next /gen_woba_data/
+        db.session.execute(text('DROP VIEW IF EXISTS woba_games CASCADE'))
+        db.session.commit()
         db.drop_all()
         db.create_all()
         create_character_tables()
@@ -147,6 +154,10 @@ def create_character_tables():
 
     db.session.commit()
 
+    # Cached rows and names belong to the tables that were just replaced
+    invalidate_character_cache()
+    invalidate_name_cache()
+
     return 'Characters added...\n'
 
 def create_default_tags():
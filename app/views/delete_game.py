@@ -1,6 +1,7 @@
 from flask import request, abort
 from flask import current_app as app
-from ..models import db, Game, CharacterGameSummary, CharacterPositionSummary, Event, Runner, PitchSummary, ContactSummary, FieldingSummary
+from ..models import db, Game, GameIndex, CharacterGameSummary, CharacterPositionSummary, Event, Runner, PitchSummary, ContactSummary, FieldingSummary
+from ..response_cache import bump_generations
 
 @app.route('/delete_game/', methods = ['POST'])
 def delete_game():
@@ -22,6 +23,11 @@ def delete_game():
         abort(400, 'Provide a valid game_id')
     
     try:
+        # Get the game's players and tags before the game and its game_index row are deleted
+        user_ids = [game.away_player_id, game.home_player_id]
+        game_index = GameIndex.query.filter_by(game_id=game.game_id).first()
+        tag_ids = game_index.tag_ids if game_index != None else []
+
         # Get character game summaries
         character_game_summaries = CharacterGameSummary.query.filter_by(game_id=game.game_id).all()
 
@@ -83,5 +89,8 @@ def delete_game():
         db.session.commit()
     except:
         abort(400, "Error attempting to get and delete rows")
+
+    # Drop cached stat responses for both players and the game's tags
+    bump_generations(user_ids, tag_ids)
     
     return "Game deleted"
\ No newline at end of file
@@ -0,0 +1,149 @@
+from flask import request, abort
+from flask import current_app as app
+from werkzeug.exceptions import HTTPException
+from sqlalchemy import text
+from ..models import *
+from ..consts import *
+from .populate_db import validate_stat_file, write_stat_file, find_written_game
+import threading
+import time
+
+'''
+@ Description: Returns the status of a stat file staged by /populate_db/ while INGEST_ASYNC is enabled
+@ Params:
+    - ticket_id - TicketID returned by /populate_db/
+@ Output:
+    - Submission status (Queued, Processing, Completed, Failed) with the status code and error from the write.
+      Status code 504 means every claim timed out (INGEST_MAX_ATTEMPTS) without the write finishing
+'''
+@app.route('/populate_db/submission/', methods=['GET'])
+def ingest_submission_status():
+    ticket_id = request.args.get('ticket_id')
+    if ticket_id == None or not ticket_id.isdigit():
+        return abort(400, description='Provide a numeric ticket_id')
+
+    submission = GameSubmission.query.filter_by(id=int(ticket_id)).first()
+    if submission == None:
+        return abort(404, description='No submission found for ticket_id')
+
+    return submission.to_dict()
+
+'''
+@ Description: Backpressure metrics for the ingest queue
+@ Output:
+    - queue_depth - submissions waiting for a worker
+    - processing - submissions claimed by a worker
+    - failed - submissions that could not be written
+    - abandoned - failed submissions whose worker timed out on every attempt, included in failed
+    - oldest_queued_age - seconds the oldest waiting submission has been queued
+    - workers - ingest workers per app process
+'''
+@app.route('/populate_db/queue/', methods=['GET'])
+def ingest_queue_metrics():
+    query = text(
+        'SELECT status, COUNT(*) AS count, MIN(date_created) AS oldest, '
+        '       COUNT(CASE WHEN status_code = :abandoned_code THEN 1 END) AS abandoned '
+        'FROM game_submission '
+        "WHERE status IN ('Queued', 'Processing', 'Failed') "
+        'GROUP BY status'
+    )
+    results = {row.status: row for row in db.session.execute(query, {'abandoned_code': cINGEST_ABANDONED_STATUS_CODE}).all()}
+
+    queued = results.get('Queued')
+    return {
+        'queue_depth': queued.count if queued != None else 0,
+        'processing': results['Processing'].count if 'Processing' in results else 0,
+        'failed': results['Failed'].count if 'Failed' in results else 0,
+        'abandoned': results['Failed'].abandoned if 'Failed' in results else 0,
+        'oldest_queued_age': int(time.time()) - queued.oldest if queued != None else 0,
+        'workers': app.config['INGEST_WORKERS'] if app.config['INGEST_ASYNC'] else 0
+    }
+
+# Claim the oldest queued submission (or one whose worker timed out) and write it
+# Returns False when the queue is empty
+def process_next_submission(app):
+    now = int(time.time())
+    stale = now - app.config['INGEST_CLAIM_TIMEOUT']
+
+    # A submission that timed out on its last attempt (kills or hangs its worker every time) isn't claimed again
+    abandon_query = text(
+        "UPDATE game_submission SET status = 'Failed', status_code = :status_code, date_completed = :now, "
+        "    error = 'Worker timed out on all ' || attempts || ' attempts' "
+        "WHERE status = 'Processing' AND date_started < :stale AND attempts >= :max_attempts"
+    )
+    abandoned = db.session.execute(abandon_query, {
+        'status_code': cINGEST_ABANDONED_STATUS_CODE,
+        'now': now,
+        'stale': stale,
+        'max_attempts': app.config['INGEST_MAX_ATTEMPTS']
+    })
+    db.session.commit()
+    if abandoned.rowcount > 0:
+        app.logger.warning(f'Ingest gave up on {abandoned.rowcount} submissions that timed out on every attempt')
+
+    claim_query = text(
+        "UPDATE game_submission SET status = 'Processing', date_started = :now, attempts = attempts + 1 "
+        'WHERE id = ( '
+        '    SELECT id FROM game_submission '
+        "    WHERE status = 'Queued' OR (status = 'Processing' AND date_started < :stale) "
+        '    ORDER BY id '
+        '    LIMIT 1 '
+        '    FOR UPDATE SKIP LOCKED '
+        ') '
+        'RETURNING id, payload'
+    )
+    claimed = db.session.execute(claim_query, {'now': now, 'stale': stale}).first()
+    db.session.commit()
+    if claimed == None:
+        return False
+
+    # Write the stat file with the same functions as a synchronous /populate_db/ request
+    status_code = 200
+    error = None
+    try:
+        # Already written (retried submission or a claim that timed out after committing), nothing left to do
+        if find_written_game(claimed.payload) == None:
+            home_player, away_player, tag_set = validate_stat_file(claimed.payload)
+            write_stat_file(claimed.payload, claimed.payload['Events'], home_player, away_player, tag_set)
+    except HTTPException as e:
+        db.session.rollback()
+        status_code = e.code
+        error = e.description
+    except Exception as e:
+        db.session.rollback()
+        status_code = 500
+        error = repr(e)
+        app.logger.exception(f'Ingest worker failed on submission {claimed.id}')
+
+    submission = GameSubmission.query.filter_by(id=claimed.id).first()
+    submission.status = 'Completed' if status_code == 200 else 'Failed'
+    submission.status_code = status_code
+    submission.error = error
+    submission.date_completed = int(time.time())
+    # Keep the raw stat file around only when it needs to be looked at again
+    if status_code == 200:
+        submission.payload = None
+    db.session.commit()
+    return True
+
+def ingest_worker(app):
+    while True:
+        with app.app_context():
+            try:
+                processed = process_next_submission(app)
+            except Exception:
+                app.logger.exception('Ingest worker could not claim a submission')
+                processed = False
+            finally:
+                db.session.remove()
+
+        # Drain without waiting while there is work, otherwise poll
+        if not processed:
+            time.sleep(app.config['INGEST_POLL_INTERVAL'])
+
+# Each app process runs its own pool. Workers in different processes never share a
+# submission because claims skip rows locked by another worker
+def start_ingest_workers(app):
+    for index in range(app.config['INGEST_WORKERS']):
+        worker = threading.Thread(target=ingest_worker, args=[app], name=f'ingest-worker-{index}', daemon=True)
+        worker.start()
@@ -0,0 +1,44 @@
+from flask import abort
+from flask import current_app as app
+from flask_jwt_extended import jwt_required
+from ..models import db
+from ..decorators import api_key_check
+from ..db_pool import MeteredQueuePool
+from ..response_cache import get_response_cache
+
+'''
+@ Description: Connection pool metrics for the app process that serves the request (one pool per gunicorn worker)
+@ Params:
+    - api_key or ADMIN_KEY - Admin only
+@ Output:
+    - pool_size, max_overflow - configured pool limits
+    - checked_out, checked_in, overflow - current connections
+    - checkouts, checkout_timeouts - totals since the pool was created
+    - checkout_latency_ms_sum, checkout_latency_ms_buckets - cumulative checkout wait histogram keyed by upper bound (ms)
+'''
+@app.route('/metrics/db_pool/', methods=['GET'])
+@jwt_required(optional=True)
+@api_key_check(['Admin'])
+def db_pool_metrics():
+    pool = db.engine.pool
+    if not isinstance(pool, MeteredQueuePool):
+        return abort(404, description='Pool metrics are not enabled for this engine')
+    return pool.metrics()
+
+'''
+@ Description: Response cache counts for the app process that serves the request
+@ Params:
+    - api_key or ADMIN_KEY - Admin only
+@ Output:
+    - backend, ttl - configured cache
+    - hits, misses - lookups since the process started, also split per endpoint
+    - errors - lookups, stores and invalidations that failed (served without the cache)
+'''
+@app.route('/metrics/response_cache/', methods=['GET'])
+@jwt_required(optional=True)
+@api_key_check(['Admin'])
+def response_cache_metrics():
+    cache = get_response_cache()
+    if cache == None:
+        return abort(404, description='Response cache is disabled')
+    return cache.metrics()
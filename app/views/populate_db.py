@@ -4,8 +4,18 @@ from ..models import *
 from ..consts import *
 from ..util import *
 from ..glicko2 import Player
+from ..character_cache import is_captain_eligible
+from ..star_calcs import STAR_COUNTERS, new_star_columns, append_star_columns, calc_star_counters
+from ..stat_file_rows import ROW_REFERENCES, parse_game_id, stat_file_hash, new_event_batch, game_row, character_rows, add_event_rows, apply_star_counters
+from ..stat_file_reader import StatFileReader, StatFileError
+from ..runner_state import RunnerStateBuilder
+from ..game_index import index_games
+from ..stat_rollups import rollup_games
+from ..response_cache import bump_generations
 from pprint import pprint
-from random import random
+from sqlalchemy import text, bindparam
+from sqlalchemy.dialects.postgresql import insert
+import random
 
 @app.route('/populate_db/ongoing_game/', methods=['POST', 'GET'])
 def update_ongoing_game():
@@ -96,19 +106,70 @@ def update_ongoing_game():
             games_list.append(game.to_dict())
         return {'ongoing_games': games_list}
 
-@app.route('/populate_db/', methods=['POST'])
-def populate_db2():
-    version_split = request.json['Version'].split('.')
+# Pull a block of primary keys from the table's id sequence in one round trip
+# and write them onto the row dicts so children can reference them before insert
+def reserve_row_ids(model, rows):
+    if len(rows) == 0:
+        return
+    query = text("SELECT nextval(pg_get_serial_sequence(:table_name, 'id')) FROM generate_series(1, :count)")
+    ids = db.session.execute(query, {'table_name': model.__tablename__, 'count': len(rows)}).scalars().all()
+    for row, id in zip(rows, ids):
+        row['id'] = id
+
+# Replace row dict references in the given columns with the referenced row's id
+def resolve_row_references(rows, columns):
+    for row in rows:
+        for column in columns:
+            if row[column] != None:
+                row[column] = row[column]['id']
+
+# Insert all rows for a table with a single executemany statement
+def bulk_insert(model, rows):
+    if len(rows) == 0:
+        return
+    db.session.execute(model.__table__.insert(), rows)
+
+# Reserve ids for a batch of event rows, swap row references for ids and insert parents before children
+# Runners reused from an earlier batch already carry their id
+def write_event_batch(event_batch):
+    reserve_row_ids(Runner, event_batch['runners'])
+    reserve_row_ids(FieldingSummary, event_batch['fielding_summaries'])
+    reserve_row_ids(ContactSummary, event_batch['contact_summaries'])
+    reserve_row_ids(PitchSummary, event_batch['pitch_summaries'])
+    for rows_key, columns in ROW_REFERENCES.items():
+        if rows_key in event_batch:
+            resolve_row_references(event_batch[rows_key], columns)
+
+    bulk_insert(Runner, event_batch['runners'])
+    bulk_insert(FieldingSummary, event_batch['fielding_summaries'])
+    bulk_insert(ContactSummary, event_batch['contact_summaries'])
+    bulk_insert(PitchSummary, event_batch['pitch_summaries'])
+    bulk_insert(Event, event_batch['events'])
+
+# Star counters are additive per event, so each batch is counted on its own and summed
+def add_star_counters(star_counters, star_columns, roster_slots):
+    batch_counters = calc_star_counters(
+        star_columns,
+        [summary['captain'] for summary in roster_slots],
+        [is_captain_eligible(summary['char_id']) for summary in roster_slots]
+    )
+    for counter, values in batch_counters.items():
+        for slot, value in enumerate(values):
+            star_counters[counter][slot] += value
+
+# Reject stat files that can never be written. Runs before a file is accepted and again before it is written
+def validate_stat_file(stat_file):
+    version_split = stat_file['Version'].split('.')
     if version_split[0] == '1' and version_split[1] == '9' and int(version_split[2]) < 5:
         abort(400, "Not accepting games from clients below 1.9.5")
 
     # Ignore game if it's a CPU game
-    if request.json['Home Player'] == "CPU" or request.json['Away Player'] == "CPU":
+    if stat_file['Home Player'] == "CPU" or stat_file['Away Player'] == "CPU":
         return abort(400, 'Database does not accept CPU games')
 
     # Check if rio_keys exist in the db and get associated players
-    home_player = RioUser.query.filter_by(rio_key=request.json['Home Player']).first()
-    away_player = RioUser.query.filter_by(rio_key=request.json['Away Player']).first()
+    home_player = RioUser.query.filter_by(rio_key=stat_file['Home Player']).first()
+    away_player = RioUser.query.filter_by(rio_key=stat_file['Away Player']).first()
 
     if home_player is None or away_player is None:
         return abort(410, 'Invalid Rio User')
@@ -117,16 +178,14 @@ def populate_db2():
     
 
     # Detect invalid games
-    innings_selected = request.json['Innings Selected']
-    innings_played = request.json['Innings Played']
-    score_difference = abs(request.json['Home Score'] - request.json['Away Score'])
-    is_valid = False if innings_played < innings_selected and score_difference < 10 else True
+    innings_selected = stat_file['Innings Selected']
+    innings_played = stat_file['Innings Played']
+    score_difference = abs(stat_file['Home Score'] - stat_file['Away Score'])
 
     if innings_played < innings_selected and score_difference < 10:
         return abort(412, "Invalid Game: Innings Played < Innings Selected & Score Difference < 10")
     
-    tag_set = TagSet.query.filter_by(id=request.json['TagSetID']).first()
-    tag_set_id = tag_set.id
+    tag_set = TagSet.query.filter_by(id=stat_file['TagSetID']).first()
     if tag_set == None:
         return abort(413, "Could not find TagSet")
 
@@ -139,431 +198,161 @@ def populate_db2():
     if home_comm_user == None or away_comm_user == None:
         abort(415, "One or both users are not part of the community for this TagSet.")
 
-    #TODO Look into removing this step. GameID SHOULD be guaranteed by checking in ongoing_games now
-    # Reroll game id until unique one is found
-    unique_id = False
-    game_id = int(request.json['GameID'].replace(',', ''), 16)
-    while not unique_id:
-        game = Game.query.filter_by(game_id=game_id).first()
-        if game == None:
-            unique_id = True
-        else:
-            game_id = random.getrandbits(32)
+    return home_player, away_player, tag_set
+
+@app.route('/populate_db/', methods=['POST'])
+def populate_db2():
+    # Stage the stat file for the ingest workers instead of writing it during the request
+    if app.config['INGEST_ASYNC']:
+        if find_written_game(request.json) != None:
+            return cSTAT_FILE_WRITTEN
+        validate_stat_file(request.json)
+        submission = GameSubmission(int(request.json['GameID'].replace(',', ''), 16), request.json)
+        db.session.add(submission)
+        db.session.commit()
+        return {'TicketID': submission.id, 'Status': submission.status}, 202
+
+    # Read the body incrementally. Every field before 'Events' is kept, events are written as they are decoded
+    try:
+        stat_file = dict()
+        events = list()
+        stat_file_items = StatFileReader(request.stream).items(stream_keys=['Events'])
+        for key, value in stat_file_items:
+            if key == 'Events':
+                events = value
+                # Clients send Events last. If fields are still missing, read the rest of the file first
+                if not all(field in stat_file for field in cSTAT_FILE_HEADER_FIELDS):
+                    events = list(events)
+                    continue
+                break
+            stat_file[key] = value
+
+        # Retried submission, return the original result
+        if find_written_game(stat_file) != None:
+            return cSTAT_FILE_WRITTEN
+
+        home_player, away_player, tag_set = validate_stat_file(stat_file)
+        return write_stat_file(stat_file, events, home_player, away_player, tag_set)
+    except StatFileError as e:
+        db.session.rollback()
+        return abort(400, str(e))
+
+# Write the game and all of its stat rows
+# stat_file holds the top level fields, events is any iterable over the 'Events' array
+def write_stat_file(stat_file, events, home_player, away_player, tag_set):
+    tag_set_id = tag_set.id
+
+    stat_file_game_id = parse_game_id(stat_file)
+    game = game_row(stat_file, stat_file_game_id, home_player.id, away_player.id)
+
+    # Claim the game id. A concurrent submission of the same game blocks on the insert until this one commits,
+    # then conflicts and finds the written game. A different game that drew the same GameID gets a new id
+    # Nothing is committed until every stat row has been written
+    while not insert_game(game):
+        if find_written_game(stat_file) != None:
+            db.session.rollback()
+            return cSTAT_FILE_WRITTEN
+        game['game_id'] = random.getrandbits(32)
 
     # Delete ongoing game row once game is submitted
-    OngoingGame.query.filter_by(game_id=game_id).delete()
+    OngoingGame.query.filter_by(game_id=stat_file_game_id).delete()
 
-    game = Game(
-        game_id = game_id,
-        away_player_id = away_player.id,
-        home_player_id = home_player.id,
-        date_time_start = int(request.json['Date - Start']),
-        date_time_end = int(request.json['Date - End']),
-        netplay = request.json['Netplay'],
-        stadium_id = request.json['StadiumID'],
-        away_score = request.json['Away Score'],
-        home_score = request.json['Home Score'],
-        innings_selected = request.json['Innings Selected'],
-        innings_played = request.json['Innings Played'],
-        quitter = 0 if request.json['Quitter Team'] == "" else request.json['Quitter Team'], #STRING OR INT
-        valid = is_valid,
-        average_ping = request.json['Average Ping'],
-        lag_spikes = request.json['Lag Spikes'],
-        version = request.json['Version'],
-    )
+    # ======= Character Game Summary =======
+    character_position_summaries, character_game_summaries, teams = character_rows(stat_file, game['game_id'], home_player.id, away_player.id)
+
+    # Summaries go in before their events. Plate appearances and star counters are updated once every event is read
+    reserve_row_ids(CharacterPositionSummary, character_position_summaries)
+    reserve_row_ids(CharacterGameSummary, character_game_summaries)
+    resolve_row_references(character_game_summaries, ROW_REFERENCES['character_game_summaries'])
+    bulk_insert(CharacterPositionSummary, character_position_summaries)
+    bulk_insert(CharacterGameSummary, character_game_summaries)
 
+    # Create Events, Runners, PitchSummaries, ContactSummaries, and FieldingSummaries
+    # Rows reference each other by dict until their ids are reserved. Written every cSTAT_FILE_EVENT_BATCH events
+    event_batch = new_event_batch()
+    star_columns = new_star_columns()
+    star_pitch = None
+    roster_slots = teams['Away'] + teams['Home']
+    star_counters = {counter: [0] * len(roster_slots) for counter in STAR_COUNTERS}
+
+    runner_state_builder = RunnerStateBuilder(teams)
+    for index, event_data in enumerate(events):
+        add_event_rows(event_batch, event_data, index, game['game_id'], teams, runner_state_builder)
+        star_pitch = append_star_columns(star_columns, event_data, star_pitch)
+
+        if len(event_batch['events']) >= cSTAT_FILE_EVENT_BATCH:
+            write_event_batch(event_batch)
+            add_star_counters(star_counters, star_columns, roster_slots)
+            event_batch = new_event_batch()
+            star_columns = new_star_columns()
+    write_event_batch(event_batch)
+    add_star_counters(star_counters, star_columns, roster_slots)
+
+    # ==== Star Calcs and Plate Appearances ====
+    apply_star_counters(roster_slots, star_counters)
+
+    summary_updates = list()
+    for summary in roster_slots:
+        summary_update = {column: summary[column] for column in ('plate_appearances',) + STAR_COUNTERS}
+        summary_update['summary_id'] = summary['id']
+        summary_updates.append(summary_update)
+    db.session.execute(CharacterGameSummary.__table__.update().where(CharacterGameSummary.id == bindparam('summary_id')), summary_updates)
+
+    # /detailed_stats/ rollups of the rows above
+    rollup_games([game['game_id']])
+
+    # Commits the game, every stat row above, its GameHistory and the elo update in one transaction
+    record_game_result(game['game_id'], game['home_score'], game['away_score'], home_player, away_player, tag_set_id)
+
+    return cSTAT_FILE_WRITTEN
+
+# Insert the game row unless its game_id is taken. Returns True if the row was inserted
+def insert_game(game):
+    query = insert(Game.__table__).values(**game).on_conflict_do_nothing(index_elements=['game_id']).returning(Game.game_id)
+    return db.session.execute(query).first() != None
+
+# Returns the game_id written for this stat file (which may have been rerolled) or None.
+# A retried submission costs this one indexed lookup instead of a second ingest
+def find_written_game(stat_file):
+    query = text('SELECT game_id FROM game WHERE payload_hash = :payload_hash LIMIT 1')
+    return db.session.execute(query, {'payload_hash': stat_file_hash(stat_file)}).scalar()
+
+# Create the GameHistory row for a written game, update both players' elo and commit them with the game
+def record_game_result(game_id, home_score, away_score, home_player, away_player, tag_set_id):
     # Get winner and loser rio_user
-    if (game.home_score > game.away_score):
+    if (home_score > away_score):
         winner_player = home_player
         loser_player = away_player
-        winner_score = game.home_score
-        loser_score = game.away_score
+        winner_score = home_score
+        loser_score = away_score
     else:
         winner_player = away_player
         loser_player = home_player
-        winner_score = game.away_score
-        loser_score = game.home_score
-
-    # Add game row to database
-    db.session.add(game)
-    db.session.commit()
+        winner_score = away_score
+        loser_score = home_score
 
     # Create GameHistory row
     # TODO, DO NOT CALL IF TAGSETID IS NONE - Connor
-    game_id = submit_game_history(game.game_id, tag_set_id, winner_player.username, winner_score, loser_player.username, loser_score)['GameID']
+    submit_game_history(game_id, tag_set_id, winner_player.username, winner_score, loser_player.username, loser_score)
 
     # Calc player elo
     calc_elo(tag_set_id, winner_player.id, loser_player.id)
+    db.session.commit()
 
-    # ======= Character Game Summary =======
-    teams = {
-        'Home': [None] * 9,
-        'Away': [None] * 9,
-    }
-    character_game_stats = request.json['Character Game Stats']
-    characters = [character_game_stats['Away Roster 0'], character_game_stats['Away Roster 1'], character_game_stats['Away Roster 2'], character_game_stats['Away Roster 3'], character_game_stats['Away Roster 4'], character_game_stats['Away Roster 5'], character_game_stats['Away Roster 6'], character_game_stats['Away Roster 7'], character_game_stats['Away Roster 8'], character_game_stats['Home Roster 0'], character_game_stats['Home Roster 1'], character_game_stats['Home Roster 2'], character_game_stats['Home Roster 3'], character_game_stats['Home Roster 4'], character_game_stats['Home Roster 5'], character_game_stats['Home Roster 6'], character_game_stats['Home Roster 7'], character_game_stats['Home Roster 8']]    
-    for character in characters:
-        pitches_per_position = character['Defensive Stats']['Batters Per Position'] if len(character['Defensive Stats']['Batters Per Position']) == 1 else [{}]
-        batter_outs_per_position = character['Defensive Stats']['Batter Outs Per Position'] if len(character['Defensive Stats']['Batter Outs Per Position']) == 1 else [{}]
-        outs_per_position = character['Defensive Stats']['Outs Per Position'] if len(character['Defensive Stats']['Outs Per Position']) == 1 else [{}]
-
-        character_position_summary = CharacterPositionSummary(
-            pitches_at_p = 0 if 'P' not in pitches_per_position[0] else pitches_per_position[0]['P'],
-            pitches_at_c = 0 if 'C' not in pitches_per_position[0] else pitches_per_position[0]['C'],
-            pitches_at_1b = 0 if '1B' not in pitches_per_position[0] else pitches_per_position[0]['1B'],
-            pitches_at_2b = 0 if '2B' not in pitches_per_position[0] else pitches_per_position[0]['2B'],
-            pitches_at_3b = 0 if '3B' not in pitches_per_position[0] else pitches_per_position[0]['3B'],
-            pitches_at_ss = 0 if 'SS' not in pitches_per_position[0] else pitches_per_position[0]['SS'],
-            pitches_at_lf = 0 if 'LF' not in pitches_per_position[0] else pitches_per_position[0]['LF'],
-            pitches_at_cf = 0 if 'CF' not in pitches_per_position[0] else pitches_per_position[0]['CF'],
-            pitches_at_rf = 0 if 'RF' not in pitches_per_position[0] else pitches_per_position[0]['RF'],
-            batter_outs_at_p = 0 if 'P' not in batter_outs_per_position[0] else batter_outs_per_position[0]['P'],
-            batter_outs_at_c = 0 if 'C' not in batter_outs_per_position[0] else batter_outs_per_position[0]['C'],
-            batter_outs_at_1b = 0 if '1B' not in batter_outs_per_position[0] else batter_outs_per_position[0]['1B'],
-            batter_outs_at_2b = 0 if '2B' not in batter_outs_per_position[0] else batter_outs_per_position[0]['2B'],
-            batter_outs_at_3b = 0 if '3B' not in batter_outs_per_position[0] else batter_outs_per_position[0]['3B'],
-            batter_outs_at_ss = 0 if 'SS' not in batter_outs_per_position[0] else batter_outs_per_position[0]['SS'],
-            batter_outs_at_lf = 0 if 'LF' not in batter_outs_per_position[0] else batter_outs_per_position[0]['LF'],
-            batter_outs_at_cf = 0 if 'CF' not in batter_outs_per_position[0] else batter_outs_per_position[0]['CF'],
-            batter_outs_at_rf = 0 if 'RF' not in batter_outs_per_position[0] else batter_outs_per_position[0]['RF'],
-            outs_at_p = 0 if 'P' not in outs_per_position[0] else outs_per_position[0]['P'],
-            outs_at_c = 0 if 'C' not in outs_per_position[0] else outs_per_position[0]['C'],
-            outs_at_1b = 0 if '1B' not in outs_per_position[0] else outs_per_position[0]['1B'],
-            outs_at_2b = 0 if '2B' not in outs_per_position[0] else outs_per_position[0]['2B'],
-            outs_at_3b = 0 if '3B' not in outs_per_position[0] else outs_per_position[0]['3B'],
-            outs_at_ss = 0 if 'SS' not in outs_per_position[0] else outs_per_position[0]['SS'],
-            outs_at_lf = 0 if 'LF' not in outs_per_position[0] else outs_per_position[0]['LF'],
-            outs_at_cf = 0 if 'CF' not in outs_per_position[0] else outs_per_position[0]['CF'],
-            outs_at_rf = 0 if 'RF' not in outs_per_position[0] else outs_per_position[0]['RF'],
-        )
-
-        db.session.add(character_position_summary)
-        db.session.commit()
-
-        defensive_stats = character['Defensive Stats']
-        offensive_stats = character['Offensive Stats']
-
-        character_game_summary = CharacterGameSummary(
-            game_id = game.game_id,
-            team_id = int(character['Team']),
-            char_id = character['CharID'],
-            user_id = home_player.id if character['Team'] == '0' else away_player.id,
-            character_position_summary_id = character_position_summary.id,
-            roster_loc = character['RosterID'],
-            captain = character['Captain'],
-            superstar = character['Superstar'],
-            fielding_hand = character['Fielding Hand'],
-            batting_hand = character['Batting Hand'],
-            # Defensive Stats
-            batters_faced = defensive_stats['Batters Faced'],
-            runs_allowed = defensive_stats['Runs Allowed'],
-            earned_runs = defensive_stats['Earned Runs'],
-            batters_walked = defensive_stats['Batters Walked'],
-            batters_hit = defensive_stats['Batters Hit'],
-            hits_allowed = defensive_stats['Hits Allowed'],
-            homeruns_allowed = defensive_stats['HRs Allowed'],
-            pitches_thrown = defensive_stats['Pitches Thrown'],
-            stamina = defensive_stats['Stamina'],
-            was_pitcher = defensive_stats['Was Pitcher'],
-            strikeouts_pitched = defensive_stats['Strikeouts'],
-            star_pitches_thrown = defensive_stats['Star Pitches Thrown'],
-            big_plays = defensive_stats['Big Plays'],
-            outs_pitched = defensive_stats['Outs Pitched'],
-            # Offensive Stats
-            at_bats = offensive_stats['At Bats'],
-            plate_appearances = 0,
-            hits = offensive_stats['Hits'],
-            singles = offensive_stats['Singles'],
-            doubles = offensive_stats['Doubles'],
-            triples = offensive_stats['Triples'],
-            homeruns = offensive_stats['Homeruns'],
-            successful_bunts = offensive_stats['Successful Bunts'],
-            sac_flys = offensive_stats['Sac Flys'],
-            strikeouts = offensive_stats['Strikeouts'],
-            walks_bb = offensive_stats['Walks (4 Balls)'],
-            walks_hit = offensive_stats['Walks (Hit)'],
-            rbi = offensive_stats['RBI'],
-            bases_stolen = offensive_stats['Bases Stolen'],
-            star_hits = offensive_stats['Star Hits'],
-            #Star tracking (Not in JSON. Calculated in populate_db)
-            offensive_star_swings = 0,
-            offensive_stars_used = 0,
-            offensive_stars_put_in_play = 0,
-            offensive_star_successes = 0,
-            offensive_star_chances = 0,
-            offensive_star_chances_won = 0,
-            defensive_star_pitches = 0,
-            defensive_stars_used = 0,
-            defensive_star_successes = 0,
-            defensive_star_chances = 0,
-            defensive_star_chances_won = 0
-        )
-
-        db.session.add(character_game_summary)
-        db.session.commit()
-
-        # index character_game_summarys for later use
-        if character['Team'] == '0':
-            teams['Home'][character['RosterID']] = character_game_summary
-        else:
-            teams['Away'][character['RosterID']] = character_game_summary
-
-    # Create Events, Runners, PitchSummaries, ContactSummaries, and FieldingSummaries
-    # contains json data for comparing events
-    previous_runners_json = {
-        'Runner Batter': None,
-        'Runner 1B': None,
-        'Runner 2B': None,
-        'Runner 3B': None
-    }
-    # contains model instances for use if current event data equal previous event data
-    previous_runners = {
-        'Runner Batter': None,
-        'Runner 1B': None,
-        'Runner 2B': None,
-        'Runner 3B': None
-    }
-    events = request.json['Events']
-    for index, event_data in enumerate(events):
-        # ======= Create Event rows ======
-        event = Event(
-            game_id = game.game_id,
-            pitcher_id = teams['Home'][event_data['Pitcher Roster Loc']].id if event_data['Half Inning'] == 0 else teams['Away'][event_data['Pitcher Roster Loc']].id,
-            batter_id = teams['Home'][event_data['Batter Roster Loc']].id if event_data['Half Inning'] == 1 else teams['Away'][event_data['Batter Roster Loc']].id,
-            catcher_id = teams['Home'][event_data['Catcher Roster Loc']].id if event_data['Half Inning'] == 0 else teams['Away'][event_data['Catcher Roster Loc']].id,
-            event_num = index,
-            away_score = event_data['Away Score'],
-            home_score = event_data['Home Score'],
-            inning = event_data['Inning'],
-            half_inning = event_data['Half Inning'],
-            chem_links_ob = event_data['Chemistry Links on Base'],
-            star_chance = event_data['Star Chance'],
-            away_stars = event_data['Away Stars'],
-            home_stars = event_data['Home Stars'],
-            pitcher_stamina = event_data['Pitcher Stamina'],
-            outs = event_data['Outs'],
-            balls = event_data['Balls'],
-            strikes = event_data['Strikes'],
-            result_num_of_outs = event_data['Num Outs During Play'],
-            result_rbi = event_data['RBI'],
-            result_of_ab = event_data['Result of AB'],
-        )
-
-        # ======= Create Runner rows for batters ======
-        # Loop through the four possible json event runner keys, check if their values are equal to the values from the previous event (this means they are the same character), and then use previous runner row or create a new one accordingly.
-        for key in previous_runners:
-            if key in event_data:
-                if previous_runners_json[key] and previous_runners_json[key] == event_data[key]:
-                    if key == 'Runner Batter':
-                        event.runner_on_0 = previous_runners[key].id
-                    elif key == 'Runner 1B':
-                        event.runner_on_1 = previous_runners[key].id
-                    elif key == 'Runner 2B':
-                        event.runner_on_2 = previous_runners[key].id
-                    elif key == 'Runner 3B':
-                        event.runner_on_3 = previous_runners[key].id
-                else:
-                    runner = Runner(
-                        runner_character_game_summary_id = teams['Away'][event_data[key]['Runner Roster Loc']].id if event_data['Half Inning'] == 0 else teams['Home'][event_data[key]['Runner Roster Loc']].id,
-                        initial_base = event_data[key]['Runner Initial Base'],
-                        result_base = event_data[key]['Runner Result Base'],
-                        out_type = event_data[key]['Out Type'],
-                        out_location = event_data[key]['Out Location'],
-                        steal = event_data[key]['Steal'],                   
-                    )
-
-                    db.session.add(runner)
-                    db.session.commit()
-
-                    if key == 'Runner Batter':
-                        event.runner_on_0 = runner.id
-                        # Increment batter plate appearances on new appearance
-                        if event_data['Half Inning'] == 0:
-                            batter_character_game_summary = teams['Away'][event_data[key]['Runner Roster Loc']]
-                        else:
-                            batter_character_game_summary = teams['Home'][event_data[key]['Runner Roster Loc']]
-                        batter_character_game_summary.plate_appearances += 1
-                    elif key == 'Runner 1B':
-                        event.runner_on_1 = runner.id
-                    elif key == 'Runner 2B':
-                        event.runner_on_2 = runner.id
-                    elif key == 'Runner 3B':
-                        event.runner_on_3 = runner.id
-
-                    previous_runners[key] = runner
-                    previous_runners_json[key] = event_data[key]
-            else:
-                previous_runners[key] = None
-                previous_runners_json[key] = None
-
-            
-        # ==== Pitch Summary ====
-        if 'Pitch' in event_data:
-            pitch_summary = PitchSummary(
-                pitch_type = event_data['Pitch']['Pitch Type'],
-                charge_pitch_type = event_data['Pitch']['Charge Type'],
-                star_pitch = event_data['Pitch']['Star Pitch'],
-                pitch_speed = event_data['Pitch']['Pitch Speed'],
-                ball_position_strikezone = event_data['Pitch']['Ball Position - Strikezone'],
-                bat_x_contact_pos = event_data['Pitch']['Bat Contact Pos - X'],
-                bat_z_contact_pos = event_data['Pitch']['Bat Contact Pos - Z'],
-                in_strikezone = event_data['Pitch']['In Strikezone'],
-                type_of_swing = event_data['Pitch']['Type of Swing'],
-                d_ball = event_data['Pitch']['DB'],
-            )
-
-            db.session.add(pitch_summary)
-            db.session.commit()
-
-            # if the batter made contact with the pitch
-            if 'Contact' in event_data['Pitch']:
-                #  ==== Contact Summary ====
-                contact_summary = ContactSummary(
-                    type_of_contact = event_data['Pitch']['Contact']['Type of Contact'],
-                    charge_power_up = event_data['Pitch']['Contact']['Charge Power Up'],
-                    charge_power_down = event_data['Pitch']['Contact']['Charge Power Down'],
-                    star_swing_five_star = event_data['Pitch']['Contact']['Star Swing Five-Star'],
-                    input_direction = event_data['Pitch']['Contact']['Input Direction - Push/Pull'],
-                    input_direction_stick = event_data['Pitch']['Contact']['Input Direction - Stick'],
-                    frame_of_swing_upon_contact = event_data['Pitch']['Contact']['Frame of Swing Upon Contact'],
-                    ball_power = int(event_data['Pitch']['Contact']['Ball Power'].replace(',', '')),
-                    ball_horiz_angle = int(event_data['Pitch']['Contact']['Vert Angle'].replace(',', '')),
-                    ball_vert_angle = int(event_data['Pitch']['Contact']['Horiz Angle'].replace(',', '')),
-                    contact_absolute = event_data['Pitch']['Contact']['Contact Absolute'],
-                    contact_quality = event_data['Pitch']['Contact']['Contact Quality'],
-                    rng1 = int(event_data['Pitch']['Contact']['RNG1'].replace(',', '')),
-                    rng2 = int(event_data['Pitch']['Contact']['RNG2'].replace(',', '')),
-                    rng3 = int(event_data['Pitch']['Contact']['RNG3'].replace(',', '')),
-                    ball_x_velocity = event_data['Pitch']['Contact']['Ball Velocity - X'],
-                    ball_y_velocity = event_data['Pitch']['Contact']['Ball Velocity - Y'],
-                    ball_z_velocity = event_data['Pitch']['Contact']['Ball Velocity - Z'],
-                    ball_x_contact_pos = event_data['Pitch']['Contact']['Ball Contact Pos - X'],
-                    ball_z_contact_pos = event_data['Pitch']['Contact']['Ball Contact Pos - Z'],
-                    ball_x_landing_pos = event_data['Pitch']['Contact']['Ball Landing Position - X'],
-                    ball_y_landing_pos = event_data['Pitch']['Contact']['Ball Landing Position - Y'],
-                    ball_z_landing_pos = event_data['Pitch']['Contact']['Ball Landing Position - Z'],
-                    ball_max_height = event_data['Pitch']['Contact']['Ball Max Height'],
-                    ball_hang_time = int(event_data['Pitch']['Contact']['Ball Hang Time'].replace(',', '')),                    
-                    primary_result = event_data['Pitch']['Contact']['Contact Result - Primary'],
-                    secondary_result = event_data['Pitch']['Contact']['Contact Result - Secondary']
-                )
-
-                db.session.add(contact_summary)
-                db.session.commit()
-                pitch_summary.contact_summary_id = contact_summary.id
-
-                # ==== Fielding Summary ====
-                if 'First Fielder' in event_data['Pitch']['Contact']:
-                    fielder_data = event_data['Pitch']['Contact']['First Fielder']
-
-                    fielder_character_game_summary_id = int()
-                    if event_data['Half Inning'] == 0:
-                        fielder_character_game_summary_id = teams['Home'][fielder_data['Fielder Roster Location']].id
-                    else:
-                        fielder_character_game_summary_id = teams['Away'][fielder_data['Fielder Roster Location']].id
-
-                    fielding_summary = FieldingSummary(
-                        fielder_character_game_summary_id = fielder_character_game_summary_id,
-                        position = fielder_data['Fielder Position'],
-                        action = fielder_data['Fielder Action'],
-                        jump = fielder_data['Fielder Jump'],
-                        bobble = fielder_data['Fielder Bobble'],
-                        swap = False if fielder_data['Fielder Swap'] == 0 else True,
-                        manual_select = fielder_data['Fielder Manual Selected'],
-                        fielder_x_pos = fielder_data['Fielder Position - X'],
-                        fielder_y_pos = fielder_data['Fielder Position - Y'],
-                        fielder_z_pos = fielder_data['Fielder Position - Z']
-                    )
-
-                    db.session.add(fielding_summary)
-                    db.session.commit()
-                    contact_summary.fielding_summary_id = fielding_summary.id
-                    db.session.add(contact_summary)
-            
-            db.session.add(pitch_summary)
-            event.pitch_summary_id = pitch_summary.id
-        db.session.add(event)
-        db.session.commit()
-
-
-        # == Star Calcs Offensse ==
-        # Batter summary object
-        batter_summary = teams['Away'][event_data['Batter Roster Loc']] if event_data['Half Inning'] == 0 else teams['Home'][event_data['Batter Roster Loc']]
-
-        #Bools to make this all more readable
-        batter_captainable_char = (Character.query.filter_by(char_id = batter_summary.char_id, captain=1).first() != None)
-        star_swing = (pitch_summary.type_of_swing == 3) # ToDo replace with decode const. 3==star swing
-        made_contact = (pitch_summary.contact_summary_id != None)
-
-        #Contact was made and was caught or landed
-        star_put_in_play = (made_contact and ((pitch_summary.contact_summary.primary_result == 1) or (pitch_summary.contact_summary.primary_result == 2))) # ToDo replace with decode const. 2 == Fair, 1 == out
-        star_landed = (made_contact and (pitch_summary.contact_summary.primary_result == 2)) # ToDo replace with decode const. 2 == Fair, 1 == out
-        
-
-        #Info to tell if batter won star chance
-        batter_safe = event.runner_0.out_type == 0
-        outs_during_play = 0
-        for runner in [event.runner_0, event.runner_1, event.runner_2, event.runner_3]:
-            if runner == None:
-                continue
-            if runner.out_type > 0:
-                outs_during_play += 1
-        final_pitch_of_atbat = event.result_of_ab > 0
-
-        if (star_swing):
-            batter_summary.offensive_star_swings += 1
-            # Misses, non-captain contact, and captain star cost each cost 1 star.
-            # Contact with a non-captain character costs 2 stars
-            if (made_contact and (batter_captainable_char and batter_summary.captain == False)):
-                batter_summary.offensive_stars_used += 2
-            else:
-                batter_summary.offensive_stars_used += 1
-
-            if (star_put_in_play):
-                batter_summary.offensive_stars_put_in_play += 1
-        
-            if (star_landed):
-                batter_summary.offensive_star_successes += 1
-
-        # == Star Calcs Defense ==
-        pitcher_summary = teams['Away'][event_data['Pitcher Roster Loc']] if event_data['Half Inning'] == 1 else teams['Home'][event_data['Pitcher Roster Loc']]
-
-        pitcher_captainable_char = (Character.query.filter_by(char_id = pitcher_summary.char_id, captain=1).first() != None)
-
-        if (pitch_summary.star_pitch):
-            pitcher_summary.defensive_star_pitches += 1
-            if (pitch_summary.pitch_result >= 3 and pitch_summary.pitch_result >= 5):
-                pitcher_summary.defensive_star_successes += 1
-
-            if (pitcher_captainable_char and pitcher_summary.captain == False):
-                pitcher_summary.defensive_stars_used += 2
-            else:
-                pitcher_summary.defensive_stars_used += 1
-        
-        #Only increment star chances when the ab is over
-        if (final_pitch_of_atbat):
-            if (event.star_chance):
-                batter_summary.offensive_star_chances += 1
-                pitcher_summary.defensive_star_chances += 1
-                #Batter wins star chance if the batter is safe and the inning doesn't end
-                if (batter_safe and ((event.outs + outs_during_play) < 3) ):
-                    batter_summary.offensive_star_chances_won += 1
-                else:
-                    pitcher_summary.defensive_star_chances_won += 1
-
-        for idx, team in teams.items():
-            for character_summary in team:
-                db.session.add(character_summary)
-        db.session.commit()
-
-    return 'Completed...'
+    # Drop cached stat responses for both players and the TagSet's tags
+    tag_set = TagSet.query.filter_by(id=tag_set_id).first()
+    bump_generations([winner_player.id, loser_player.id], [tag.id for tag in tag_set.tags])
 
 
 @app.route('/submit_game/', methods=['POST'])
 def submit_game_history(in_game_id=None, in_tag_set_id=None,
                         in_winner_username=None, in_winner_score=None, 
                         in_loser_username=None, in_loser_score=None):
-    game_id = in_game_id if ('GameID' not in request.json) else int(request.json['GameID'].replace(',', ''), 16)
+    # Internal callers pass the id of the game they just wrote, which may differ from the stat file's GameID
+    if in_game_id != None:
+        game_id = in_game_id
+    else:
+        game_id = int(request.json['GameID'].replace(',', ''), 16) if 'GameID' in request.json else None
     winner_username = in_winner_username if (in_winner_username != None) else request.json['Winner Username']
     winner_score = in_winner_score if (in_winner_score != None) else request.json['Winner Score']
     loser_username = in_loser_username if (in_loser_username != None) else request.json['Loser Username']
@@ -619,6 +408,7 @@ def submit_game_history(in_game_id=None, in_tag_set_id=None,
     loser_elo = None
 
     #Get ELOs
+    lock_ladder(tag_set_id)
     winner_ladder = Ladder.query.filter_by(community_user_id=winner_comm_user.id, tag_set_id=tag_set_id).first()
     loser_ladder = Ladder.query.filter_by(community_user_id=loser_comm_user.id, tag_set_id=tag_set_id).first()
 
@@ -627,12 +417,12 @@ def submit_game_history(in_game_id=None, in_tag_set_id=None,
         new_glicko_player = Player()
         winner_ladder = Ladder(tag_set_id, winner_comm_user.id, new_glicko_player.rating , new_glicko_player.rd, new_glicko_player.vol)
         db.session.add(winner_ladder)
-        db.session.commit()
+        db.session.flush()
     if loser_ladder == None:
         new_glicko_player = Player()
         loser_ladder = Ladder(tag_set_id, loser_comm_user.id, new_glicko_player.rating , new_glicko_player.rd, new_glicko_player.vol)
         db.session.add(loser_ladder)
-        db.session.commit()
+        db.session.flush()
 
     winner_elo = winner_ladder.rating
     loser_elo = loser_ladder.rating
@@ -678,8 +468,20 @@ def submit_game_history(in_game_id=None, in_tag_set_id=None,
                                    winner_elo, loser_elo, 
                                    winner_accept, loser_accept, admin_accept)
     db.session.add(new_game_history)
+    # Index the game with its TagSet's tags in the same transaction
+    if (new_game_history.game_id != None):
+        db.session.flush()
+        index_games([new_game_history.game_id])
+
+    # Internal callers (in_tag_set_id) commit once the rest of their write is done
+    if in_tag_set_id != None:
+        db.session.flush()
+        return {'GameID': new_game_history.game_id}
     db.session.commit()
 
+    # Drop cached stat responses for both players and the TagSet's tags
+    bump_generations([winner_user.id, loser_user.id], [tag.id for tag in tag_set.tags])
+
     if (new_game_history.game_id == None):
         return {'GameHistoryID': new_game_history.id}
     else:
@@ -760,10 +562,13 @@ def update_game_status():
             winner_rio_user_id = CommunityUser.query.filter_by(id=game_history.winner_comm_user_id).first().user_id
             loser_rio_user_id = CommunityUser.query.filter_by(id=game_history.loser_comm_user_id).first().user_id
             calc_elo(game_history.tag_set_id, winner_rio_user_id, loser_rio_user_id)
+            db.session.commit()
     
     return 'Success', 200
 
 def calc_elo(tag_set_id, winner_user_id, loser_user_id):
+    lock_ladder(tag_set_id)
+
     winner_ladder = db.session.query(
             Ladder
         ).join(
@@ -801,10 +606,16 @@ def calc_elo(tag_set_id, winner_user_id, loser_user_id):
     loser_ladder.rd = loser_player.rd
     loser_ladder.vol = loser_player.vol
 
-    db.session.commit()
+    # Committed by the caller with the game or GameHistory change that triggered the update
+    db.session.flush()
 
     return
 
+# Serialize ladder reads and writes per TagSet so concurrent submissions (ingest workers, app processes)
+# see the ratings written by the previous game. Released when the current transaction commits
+def lock_ladder(tag_set_id):
+    db.session.execute(text('SELECT pg_advisory_xact_lock(:tag_set_id)'), {'tag_set_id': tag_set_id})
+
 @app.route('/recalc_elo/', methods=['POST'])
 def recalc_elo(in_tag_set_id=None):
     tag_set_id = in_tag_set_id if in_tag_set_id != None else request.json['TagSetID']
@@ -854,3 +665,4 @@ def recalc_elo(in_tag_set_id=None):
             winner_rio_user_id = CommunityUser.query.filter_by(id=game.winner_comm_user_id).first().user_id
             loser_rio_user_id = CommunityUser.query.filter_by(id=game.loser_comm_user_id).first().user_id
             calc_elo(tag_set_id, winner_rio_user_id, loser_rio_user_id)
+            db.session.commit()
@@ -1,16 +1,18 @@
 from flask import request, abort, jsonify
 from flask import current_app as app
 from sqlalchemy import text
-from ..models import db
+from sqlalchemy.exc import SQLAlchemyError
+from ..models import db, JobRun
 from pathlib import Path
+import time
 
 cPath_to_sql_dir = 'app/sql'
-cFile_for_woba = ["wOBA_Stars_On.txt", "wOBA_Stars_Off.txt", 
-                  "Runs_per_PA_Stars_On.txt", "Runs_per_PA_Stars_Off.txt",
-                  "wOBA_Scale_Stars_On.txt", "wOBA_Scale_Stars_Off.txt",
-                  "wOBA_Stars_On.txt", "wOBA_Stars_Off.txt"]
+cFile_for_woba = ["woba_views.txt"]
 cFile_for_test = ["table_test.txt"]
 
+# Materialized views created by cFile_for_woba, in refresh order (each view reads the ones before it)
+cWOBA_VIEWS = ["woba_linear_weights", "woba_scale_stats", "woba_stats", "runs_per_pa_stats"]
+
 def run_sql_files(in_file_list):
     cwd = Path.cwd()
     sql_path = Path.resolve(cwd/cPath_to_sql_dir)
@@ -18,16 +20,63 @@ def run_sql_files(in_file_list):
     for file_name in in_file_list:
         sql_file = open(f'{sql_path}/{file_name}', "r")
         sql = sql_file.read()
-        db.engine.execute(text(sql))
+        with db.engine.begin() as connection:
+            connection.execute(text(sql))
         print('Executed sql file:', file_name)
     return
 
+# Refresh one materialized view and record it in job_run. Readers keep seeing the previous rows until the refresh commits
+def refresh_materialized_view(job, view):
+    job_run = JobRun(job, view)
+    start = time.perf_counter()
+    try:
+        populated = db.session.execute(text('SELECT ispopulated FROM pg_matviews WHERE matviewname = :view'), {'view': view}).scalar()
+        # CONCURRENTLY can't fill a view created WITH NO DATA, the first refresh takes the exclusive lock instead
+        concurrently = 'CONCURRENTLY ' if populated else ''
+        db.session.execute(text(f'REFRESH MATERIALIZED VIEW {concurrently}{view}'))
+        job_run.row_count = db.session.execute(text(f'SELECT COUNT(*) FROM {view}')).scalar()
+        db.session.commit()
+        job_run.status = 'Success'
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        job_run.status = 'Failed'
+        job_run.error = str(e.orig if getattr(e, 'orig', None) != None else e)
+
+    job_run.duration_ms = int((time.perf_counter() - start) * 1000)
+    job_run.date_completed = int( time.time() )
+    db.session.add(job_run)
+    db.session.commit()
+    return job_run
+
+# Create the wOBA views if they don't exist and refresh them. Stops at the first view that fails,
+# the views after it keep their previous rows
+def refresh_woba_views(job='gen_woba_data'):
+    run_sql_files(cFile_for_woba)
+
+    job_runs = list()
+    for view in cWOBA_VIEWS:
+        job_run = refresh_materialized_view(job, view)
+        job_runs.append(job_run)
+        print(f'Refreshed {view}: {job_run.status}, {job_run.row_count} rows in {job_run.duration_ms}ms')
+        if job_run.status != 'Success':
+            break
+    return job_runs
+
+'''
+@ Description: Refresh the wOBA, wOBA scale and runs per PA materialized views, each view is logged in job_run
+@ Params:
+    - None
+@ Output:
+    - Status, row count and duration of each view refreshed. 500 if a view failed to refresh
+'''
 @app.route('/gen_woba_data/', methods=['POST'])
 def gen_woba_data():
-    run_sql_files(cFile_for_woba)
-    return jsonify({'Success':200})
+    job_runs = refresh_woba_views()
+    if job_runs[-1].status != 'Success':
+        return abort(500, description=f'Failed to refresh {job_runs[-1].target}: {job_runs[-1].error}')
+    return jsonify({'Success': 200, 'Views': [job_run.to_dict() for job_run in job_runs]})
 
 def gen_woba_data_routine(app):
     with app.app_context():
-        run_sql_files(cFile_for_woba)
+        refresh_woba_views()
         return
@@ -1,60 +1,114 @@
-from flask import request, jsonify, abort
+from flask import request, jsonify, abort, Response, stream_with_context
 from flask import current_app as app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..models import db, RioUser, Character, Game, ChemistryTable, Tag, Event
+from sqlalchemy import select, func, case, and_, or_, not_, any_, bindparam, tuple_, text, literal, literal_column, union_all
+from sqlalchemy.orm import aliased
+from sqlalchemy.dialects.postgresql import ARRAY
+from ..models import db, RioUser, Game, GameIndex, ChemistryTable, Tag, Event, PitchSummary, ContactSummary, FieldingSummary, StarChanceRollup, EventFact
 from ..consts import *
 from ..util import *
-import pprint
+from ..character_cache import get_character, get_character_dicts
+from ..filter_resolver import resolve_filter_args
+from ..response_cache import cached_response
+from ..stat_rollups import BATTING_CONTACT_COLUMNS, STAR_CHANCE_ROLLUP_COLUMNS
+from ..detailed_stats import add_detailed_stats_rows
+from ..npz import NpzColumns
 import time
 import datetime
-import itertools
+import base64
+import json
+import math
+from concurrent.futures import ThreadPoolExecutor
 
 @app.route('/characters/', methods = ['GET'])
 def get_characters():
-    characters = []
-    
     character_names = request.args.getlist('name')
-    if character_names:
-        try:
-            character_names_lowercase = tuple([name.lower() for name in character_names])
-            character_rows = db.session.query(Character).filter(Character.name_lowercase.in_(character_names_lowercase)).all()
-        except:
-            abort(400, 'Invalid Character name')
-    else:
-        character_rows = Character.query.all()
-
-    for character in character_rows:
-        characters.append(character.to_dict())
+    characters = get_character_dicts(character_names)
 
     return {
         'characters': characters
         }
 
+# Captain names for /games/ come from the character cache instead of joining the character table
+def captain_name(char_id):
+    character = get_character(char_id)
+    return character['name'] if character != None else None
+
+# Bound array parameter for a list of ids
+def id_array(name, ids, id_type=db.Integer):
+    return bindparam(name, list(ids), type_=ARRAY(id_type))
+
+# Bound "= ANY(:name)" array operand for a list of ids
+def any_ids(name, ids, id_type=db.Integer):
+    return any_(id_array(name, ids, id_type))
+
+# Keyset pagination cursors hold the sort key of the last row of a page as url-safe base64 json
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor, length):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except:
+        values = None
+    if not isinstance(values, list) or len(values) != length or not all(type(value) == int for value in values):
+        return abort(400, description='Invalid cursor')
+    return values
+
+# Newline delimited JSON, one record per line, sent as the records are produced
+def ndjson_response(records):
+    return Response(stream_with_context(json.dumps(record) + '\n' for record in records), mimetype='application/x-ndjson')
+
+# Run a select with a server side cursor and yield its rows in lists of cSTREAM_YIELD_PER
+def stream_partitions(query, params=None):
+    results = db.session.execute(query, params).yield_per(cSTREAM_YIELD_PER)
+    for partition in results.partitions():
+        yield partition
+
+# A select's rows as a NumPy .npz download, one typed array per selected column, filled as rows come off the cursor
+def npz_response(query, filename):
+    columns = NpzColumns([(column.name, column.type) for column in query.selected_columns])
+    for partition in stream_partitions(query.execution_options(stream_results=True)):
+        columns.append(partition)
+    return Response(columns.to_bytes(), mimetype='application/octet-stream', headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+def game_to_dict(game):
+    return {
+        'Id': game.game_id,
+        'date_time_start': game.date_time_start,
+        'date_time_end': game.date_time_end,
+        'Away User': game.away_player,
+        'Away Captain': captain_name(game.away_captain_id),
+        'Away Score': game.away_score,
+        'Home User': game.home_player,
+        'Home Captain': captain_name(game.home_captain_id),
+        'Home Score': game.home_score,
+        'Innings Played': game.innings_played,
+        'Innings Selected': game.innings_selected,
+        'Tags': game.tags
+    }
+
+def stream_games(query):
+    for partition in stream_partitions(query.execution_options(stream_results=True)):
+        for game in partition:
+            yield game_to_dict(game)
+
 # Helpers for detailed stats
-def build_where_statement(game_ids, char_ids, user_ids):
-    game_id_string, game_empty = format_tuple_for_SQL(game_ids)
-    char_string, char_empty = format_tuple_for_SQL(char_ids)
-    user_id_string, user_empty = format_tuple_for_SQL(user_ids)
-
-    #If at least one group is populated produce the WHERE statement
-    where_statement = ''
-    if not (game_empty and user_empty and char_empty):
-        where_statement = 'WHERE '
-        other_conditions = False
-        if (not game_empty):
-            other_conditions = True
-            where_statement += f"character_game_summary.game_id IN {game_id_string} \n"
-        if (not user_empty):
-            if (other_conditions):
-                where_statement += 'AND '
-            other_conditions = True
-            where_statement += f"character_game_summary.user_id IN {user_id_string} \n"
-        if (not char_empty):
-            if (other_conditions):
-                where_statement += 'AND '
-            other_conditions = True
-            where_statement += f"character_game_summary.char_id IN {char_string} \n"
-    return where_statement
+# Conditions on `table` for the detailed stats queries: its games (game_id_filter) and the username and char_id params
+def detailed_stats_filters(table, user_ids, char_ids):
+    conditions = [game_id_filter(literal_column(f'{table}.game_id', db.BigInteger))]
+    if len(user_ids) != 0:
+        conditions.append(literal_column(f'{table}.user_id') == any_ids('stat_user_ids', user_ids))
+    if len(char_ids) != 0:
+        conditions.append(literal_column(f'{table}.char_id') == any_ids('stat_char_ids', char_ids))
+    return conditions
+
+# Select of the `columns` SQL from the `from_clause` SQL where every condition holds, grouped by the `groups` SQL if any
+def detailed_stats_query(columns, from_clause, conditions, groups):
+    query = select(text(columns)).select_from(text(from_clause)).where(*conditions)
+    if groups != '':
+        query = query.group_by(text(groups))
+    return query
 
 def sanitize_int_list(int_list, error_msg, upper_bound, lower_bound = 0):
     if int_list == None or len(int_list) == 0:
@@ -84,79 +138,74 @@ def sanitize_int_list(int_list, error_msg, upper_bound, lower_bound = 0):
     - vs_captain - captain name who MUST appear in game along with captain
     - exclude_captian -  captain name to EXLCUDE from results
     - limit_games - Int of number of games || False to return all
+    - cursor - next_cursor of the previous page, returns the games played before it
+    - format - json (default) or ndjson to stream one game per line
 
 @ Output:
     - List of games and highlevel info based on flags
+    - next_cursor - Cursor for the next page, None on the last page (json format only)
 
 @ URL example: http://127.0.0.1:5000/games/?limit=5&username=demOuser4&username=demouser1&username=demouser5
 '''
 @app.route('/games/', methods = ['GET'])
+@cached_response
 def endpoint_games(called_internally=False):
-    # === validate passed parameters ===
-    try:
-        # Check if tags are valid and get a list of corresponding ids
-        tags = request.args.getlist('tag')
-        tags_lowercase = tuple([lower_and_remove_nonalphanumeric(tag) for tag in tags])
-        tag_rows = db.session.query(Tag).filter(Tag.name_lowercase.in_(tags_lowercase)).all()
-        tag_ids = tuple([str(tag.id) for tag in tag_rows])
-        if len(tag_ids) != len(tags):
-            abort(400)
+    query, limit = build_games_query([
+        GameIndex.game_id,
+        GameIndex.date_time_start,
+        GameIndex.date_time_end,
+        Game.away_score,
+        Game.home_score,
+        Game.innings_played,
+        Game.innings_selected,
+        GameIndex.away_username.label('away_player'),
+        GameIndex.home_username.label('home_player'),
+        GameIndex.away_captain_id,
+        GameIndex.home_captain_id,
+        # Tag names are collected per game row in the same statement
+        func.array(
+            select(Tag.name).where(Tag.id == any_(GameIndex.tag_ids)).order_by(Tag.id).scalar_subquery()
+        ).label('tags')
+    ], called_internally)
+    query = query.join(Game, GameIndex.game_id == Game.game_id)
 
-        # Check if exclude_tags are valid and get a list of corresponding ids
-        exclude_tags = request.args.getlist('exclude_tag')
-        exclude_tags_lowercase = tuple([lower_and_remove_nonalphanumeric(exclude_tag) for exclude_tag in exclude_tags])
-        exclude_tag_rows = db.session.query(Tag).filter(Tag.name_lowercase.in_(exclude_tags_lowercase)).all()
-        exclude_tag_ids = tuple([str(exclude_tag.id) for exclude_tag in exclude_tag_rows])
-        if len(exclude_tag_ids) != len(exclude_tags):
-            abort(400)
+    if called_internally:
+        results = db.session.execute(query).all()
+        return { "game_ids": [game.game_id for game in results] }
+
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(stream_games(query))
+
+    results = db.session.execute(query).all()
+    games = [game_to_dict(game) for game in results]
+
+    next_cursor = None
+    if limit != None and len(results) == limit and limit > 0:
+        next_cursor = encode_cursor([results[-1].date_time_start, results[-1].game_id])
 
-        #Get user ids from list of users
-        usernames = request.args.getlist('username')
-        usernames_lowercase = tuple([lower_and_remove_nonalphanumeric(username) for username in usernames])
-        #List returns a list of user_ids, each in a tuple. Convert to list and return to tuple for SQL query
-        list_of_user_id_tuples = db.session.query(RioUser.id).filter(RioUser.username_lowercase.in_(usernames_lowercase)).all()
-        # using list comprehension
-        list_of_user_id = list(itertools.chain(*list_of_user_id_tuples))
-        tuple_user_ids = tuple(list_of_user_id)
-        if len(usernames) != len(list_of_user_id_tuples):
+    return {'games': games, 'next_cursor': next_cursor}
+
+# Select of `columns` from game_index filtered by the /games/ params. Other endpoints use
+# build_games_query([GameIndex.game_id], True) as a subquery so their game filter runs in the same statement
+# Returns (query, limit)
+def build_games_query(columns, called_internally=False):
+    # === validate passed parameters ===
+    try:
+        # Resolve every user, tag and captain name filter in one lookup
+        filter_ids = resolve_filter_args(request.args)
+
+        # Every tag and username must exist
+        tag_ids = tuple(filter_ids['tag'])
+        exclude_tag_ids = tuple(filter_ids['exclude_tag'])
+        tuple_user_ids = tuple(filter_ids['username'])
+        if len(tag_ids) != len(request.args.getlist('tag')) or len(exclude_tag_ids) != len(request.args.getlist('exclude_tag')) or len(tuple_user_ids) != len(request.args.getlist('username')):
             abort(400)
 
-        #Get user ids from list of users
-        vs_usernames = request.args.getlist('vs_username')
-        vs_usernames_lowercase = tuple([lower_and_remove_nonalphanumeric(username) for username in vs_usernames])
-        #List returns a list of user_ids, each in a tuple. Convert to list and return to tuple for SQL query
-        list_of_vs_user_id_tuples = db.session.query(RioUser.id).filter(RioUser.username_lowercase.in_(vs_usernames_lowercase)).all()
-        # using list comprehension
-        list_of_vs_user_id = list(itertools.chain(*list_of_vs_user_id_tuples))
-        tuple_vs_user_ids = tuple(list_of_vs_user_id)
-
-        #Get user ids from list of users
-        exclude_usernames = request.args.getlist('exclude_username')
-        exclude_usernames_lowercase = tuple([lower_and_remove_nonalphanumeric(username) for username in exclude_usernames])
-        #List returns a list of user_ids, each in a tuple. Convert to list and return to tuple for SQL query
-        list_of_exclude_user_id_tuples = db.session.query(RioUser.id).filter(RioUser.username_lowercase.in_(exclude_usernames_lowercase)).all()
-        # using list comprehension
-        list_of_exclude_user_id = list(itertools.chain(*list_of_exclude_user_id_tuples))
-        tuple_exclude_user_ids = tuple(list_of_exclude_user_id)
-
-        #Get captain ids from Captain
-        captains = request.args.getlist('captain')
-        captains_lowercase = tuple([captain.lower() for captain in captains])
-        list_of_captain_id_tuples = db.session.query(Character.char_id).filter(Character.name_lowercase.in_(captains_lowercase)).all()
-        list_of_captain_ids = list(itertools.chain(*list_of_captain_id_tuples))
-        tuple_captain_ids = tuple(list_of_captain_ids)
-
-        vs_captains = request.args.getlist('vs_captain')
-        vs_captains_lowercase = tuple([vs_captain.lower() for vs_captain in vs_captains])
-        list_of_vs_captain_id_tuples = db.session.query(Character.char_id).filter(Character.name_lowercase.in_(vs_captains_lowercase)).all()
-        list_of_vs_captain_ids = list(itertools.chain(*list_of_vs_captain_id_tuples))
-        tuple_vs_captain_ids = tuple(list_of_vs_captain_ids)
-        
-        exclude_captains = request.args.getlist('exclude_captain')
-        exclude_captains_lowercase = tuple([exclude_captain.lower() for exclude_captain in exclude_captains])
-        list_of_exclude_captain_id_tuples = db.session.query(Character.char_id).filter(Character.name_lowercase.in_(exclude_captains_lowercase)).all()
-        list_of_exclude_captain_ids =list(itertools.chain(*list_of_exclude_captain_id_tuples))
-        tuple_exclude_captain_ids = tuple(list_of_exclude_captain_ids)
+        tuple_vs_user_ids = tuple(filter_ids['vs_username'])
+        tuple_exclude_user_ids = tuple(filter_ids['exclude_username'])
+        tuple_captain_ids = tuple(filter_ids['captain'])
+        tuple_vs_captain_ids = tuple(filter_ids['vs_captain'])
+        tuple_exclude_captain_ids = tuple(filter_ids['exclude_captain'])
 
         limit = int()
         try:
@@ -173,9 +222,6 @@ def endpoint_games(called_internally=False):
        return abort(400, 'Invalid Username, Captain, or Tag')
 
 
-    # Build WHERE statement
-    where_statement = 'WHERE '
-
     #Get and validate start_time and end_time parameters from URL
     start_time_unix = 1
     if (request.args.get('start_time') != None):
@@ -193,157 +239,49 @@ def endpoint_games(called_internally=False):
         except:
             return abort(408, 'Invalid end time format')
 
-    # Add start and end_time parameters to WHERE statement
-    where_statement += f"game.date_time_start > {start_time_unix} \n"
-    if (end_time_unix != 0):
-        where_statement += f"AND game.date_time_end < {end_time_unix} \n"
-
-
-    # === Set dynamic query values ===
-    count_matching_tags = f"SUM(CASE WHEN game_tag.tag_id IN ({', '.join(tag_ids)}) THEN 1 ELSE 0 END) AS having_tag_count \n" if len(tag_ids) > 0 else ""
-    count_matching_exclude_tags = f"SUM(CASE WHEN game_tag.tag_id IN ({', '.join(exclude_tag_ids)}) THEN 1 ELSE 0 END) AS exclude_tag_count \n" if len(exclude_tag_ids) > 0 else ""
-    having_matching_tags =  f'having_tag_count = {len(tag_ids)} ' if count_matching_tags != "" else ""
-    having_exclude_tags = f'exclude_tag_count = 0' if count_matching_exclude_tags != "" else ""
-    
-    with_tags = str()
-    where_tags = str()
-    if count_matching_tags != "" or count_matching_exclude_tags != "":
-        with_tags = (
-            'WITH game_id_and_tag_counts AS ( \n'
-            '   SELECT \n' 
-            '       game_id, \n'
-                    f'{count_matching_tags}'
-                    f'{", " if count_matching_tags != "" and count_matching_exclude_tags != "" else ""}'
-                    f'{count_matching_exclude_tags}'
-            '   FROM game_tag \n'
-            '   GROUP BY game_id \n'
-            ')  \n'
-        )
-        where_tags = (
-            'AND game.game_id IN ( \n'
-            '  SELECT game_id  \n'
-            '  FROM game_id_and_tag_counts \n'
-            '  WHERE ' 
-            f'{having_matching_tags}'
-            f'{" AND " if count_matching_tags != "" and count_matching_exclude_tags != "" else ""}'
-            f'{having_exclude_tags}'
-            '\n)\n '
-        )
-
-        where_statement += where_tags
-
-    #Build User strings
-    user_id_string, user_empty = format_tuple_for_SQL(tuple_user_ids)
-    vs_user_id_string, vs_user_empty = format_tuple_for_SQL(tuple_vs_user_ids)
-    exclude_user_id_string, exclude_user_empty = format_tuple_for_SQL(tuple_exclude_user_ids)
-
-    if (not user_empty):
-        where_statement += f"AND (game.away_player_id IN {user_id_string} OR game.home_player_id IN {user_id_string}) \n"
-    if (not vs_user_empty):
-        where_statement += f"AND (game.away_player_id IN {vs_user_id_string} OR game.home_player_id IN {vs_user_id_string}) \n"
-    if (not exclude_user_empty):
-        where_statement += f"AND game.away_player_id NOT IN {exclude_user_id_string} AND game.home_player_id NOT IN {exclude_user_id_string} \n"
-
-    #Build captain strings
-    captain_id_string, captain_empty = format_tuple_for_SQL(tuple_captain_ids)
-    vs_captain_id_string, vs_captain_empty = format_tuple_for_SQL(tuple_vs_captain_ids)
-    exclude_captain_id_string, exclude_captain_empty = format_tuple_for_SQL(tuple_exclude_captain_ids)
-
-    if (not captain_empty):
-        where_statement += f"AND (away_captain.char_id IN {captain_id_string} OR home_captain.char_id IN {captain_id_string}) \n"
-    if (not vs_captain_empty):
-        where_statement += f"AND (away_captain.char_id IN {vs_captain_id_string} OR home_captain.char_id IN {vs_captain_id_string}) \n"
-    if (not exclude_captain_empty):
-        where_statement += f"AND away_captain.char_id NOT IN {exclude_captain_id_string} AND home_captain.char_id NOT IN {exclude_captain_id_string} \n"
-
-    # === Construct query === 
-    query = (
-        f'{with_tags}'
-        'SELECT game.game_id, \n'
-        '   game.date_time_start AS date_time_start, \n'
-        '   game.date_time_end AS date_time_end, \n'
-        '   game.away_score AS away_score, \n'
-        '   game.home_score AS home_score, \n'
-        '   game.innings_played AS innings_played, \n'
-        '   game.innings_selected AS innings_selected, \n'
-        '   away_player.username AS away_player, \n'
-        '   home_player.username AS home_player, \n'
-        '   away_captain.name AS away_captain, \n'
-        '   home_captain.name AS home_captain \n'
-        'FROM game \n'
-        'LEFT JOIN rio_user AS away_player ON game.away_player_id = away_player.id \n'
-        'LEFT JOIN rio_user AS home_player ON game.home_player_id = home_player.id \n'
-        'LEFT JOIN character_game_summary AS away_captain_cgs \n'
-        '   ON game.game_id = away_captain_cgs.game_id \n'
-        '   AND away_captain_cgs.user_id = away_player.id \n'
-        '   AND away_captain_cgs.captain = True \n'
-        'LEFT JOIN character_game_summary AS home_captain_cgs \n'
-        '	ON game.game_id = home_captain_cgs.game_id \n'
-        '   AND home_captain_cgs.user_id = home_player.id \n'
-        '   AND home_captain_cgs.captain = True \n'
-        'LEFT JOIN character AS away_captain ON away_captain_cgs.char_id = away_captain.char_id \n'
-        'LEFT JOIN character AS home_captain ON home_captain_cgs.char_id = home_captain.char_id \n'
-        f'{where_statement} '
-        'ORDER BY game.date_time_start DESC \n'
-        f"{('LIMIT ' + str(limit)) if limit != None else ''}"
+    # === Construct query ===
+    # Filters read game_index (one row per game with its players, captains and tag ids).
+    # Filter values are bound as parameters (lists as arrays) so the SQL only changes with which
+    # filters are present and SQLAlchemy reuses the compiled statement for every request of the same shape
+    query = select(*columns).select_from(GameIndex).where(
+        GameIndex.date_time_start > bindparam('start_time', start_time_unix)
     )
 
-    print(query)
-
-    results = db.session.execute(query).all()
-    
-    games = []
-    game_ids = []
-    if called_internally:
-        for game in results:
-            game_ids.append(game.game_id)
-        return { "game_ids": game_ids }
-    else:
-        for game in results:
-            game_ids.append(game.game_id)
-
-            games.append({
-                'Id': game.game_id,
-                'date_time_start': game.date_time_start,
-                'date_time_end': game.date_time_end,
-                'Away User': game.away_player,
-                'Away Captain': game.away_captain,
-                'Away Score': game.away_score,
-                'Home User': game.home_player,
-                'Home Captain': game.home_captain,
-                'Home Score': game.home_score,
-                'Innings Played': game.innings_played,
-                'Innings Selected': game.innings_selected,
-                'Tags': []
-            })
-
-        # If there are games with matching tags, get all additional tags they have
-        if game_ids:
-            where_game_id = str()
-            if len(game_ids) == 1:
-                where_game_id = f'WHERE game_tag.game_id = {game_ids[0]} '
-            else:
-                where_game_id = f'WHERE game_tag.game_id IN {tuple(game_ids)} '
-
-            tags_query = (
-                'SELECT '
-                'game_tag.game_id as game_id, '
-                'game_tag.tag_id as tag_id, '
-                'tag.name as name '
-                'FROM game_tag '
-                'LEFT JOIN tag ON game_tag.tag_id = tag.id '
-                f'{where_game_id}'
-                'GROUP BY game_id, tag_id, name'
-            )
-
-            tag_results = db.session.execute(tags_query).all()
-            for tag in tag_results:
-                for game in games:
-                    if game['Id'] == tag.game_id:
-                        game['Tags'].append(tag.name)
-
-        return {'games': games}
-
+    if (end_time_unix != 0):
+        query = query.where(GameIndex.date_time_end < bindparam('end_time', end_time_unix))
+
+    # Games must have every tag and none of the excluded tags. Tag filters never match untagged games
+    if len(tag_ids) > 0:
+        query = query.where(GameIndex.tag_ids.contains(id_array('tag_ids', tag_ids)))
+    if len(exclude_tag_ids) > 0:
+        query = query.where(func.cardinality(GameIndex.tag_ids) > 0, not_(GameIndex.tag_ids.overlap(id_array('exclude_tag_ids', exclude_tag_ids))))
+
+    if len(tuple_user_ids) > 0:
+        query = query.where(or_(GameIndex.away_player_id == any_ids('user_ids', tuple_user_ids), GameIndex.home_player_id == any_ids('user_ids', tuple_user_ids)))
+    if len(tuple_vs_user_ids) > 0:
+        query = query.where(or_(GameIndex.away_player_id == any_ids('vs_user_ids', tuple_vs_user_ids), GameIndex.home_player_id == any_ids('vs_user_ids', tuple_vs_user_ids)))
+    if len(tuple_exclude_user_ids) > 0:
+        query = query.where(not_(GameIndex.away_player_id == any_ids('exclude_user_ids', tuple_exclude_user_ids)), not_(GameIndex.home_player_id == any_ids('exclude_user_ids', tuple_exclude_user_ids)))
+
+    if len(tuple_captain_ids) > 0:
+        query = query.where(or_(GameIndex.away_captain_id == any_ids('captain_ids', tuple_captain_ids), GameIndex.home_captain_id == any_ids('captain_ids', tuple_captain_ids)))
+    if len(tuple_vs_captain_ids) > 0:
+        query = query.where(or_(GameIndex.away_captain_id == any_ids('vs_captain_ids', tuple_vs_captain_ids), GameIndex.home_captain_id == any_ids('vs_captain_ids', tuple_vs_captain_ids)))
+    if len(tuple_exclude_captain_ids) > 0:
+        query = query.where(not_(GameIndex.away_captain_id == any_ids('exclude_captain_ids', tuple_exclude_captain_ids)), not_(GameIndex.home_captain_id == any_ids('exclude_captain_ids', tuple_exclude_captain_ids)))
+
+    # Pages are keyed on (date_time_start, game_id) so a page costs the same however deep it is
+    if not called_internally and request.args.get('cursor') != None:
+        cursor_start, cursor_game_id = decode_cursor(request.args.get('cursor'), 2)
+        query = query.where(tuple_(GameIndex.date_time_start, GameIndex.game_id) < tuple_(bindparam('cursor_start', cursor_start), bindparam('cursor_game_id', cursor_game_id)))
+
+    # Order only matters to internal callers when it picks which games fall inside the limit
+    if not called_internally or limit != None:
+        query = query.order_by(GameIndex.date_time_start.desc(), GameIndex.game_id.desc())
+    if limit != None:
+        query = query.limit(bindparam('limit_games', limit))
+
+    return query, limit
 
 
 # == Functions to return coordinates for graphing ==
@@ -373,240 +311,172 @@ def endpoint_games(called_internally=False):
     - users_as_pitcher [0-1],   bool if you want to only get the events for the given users when they are the pitcher
     - final_result     [0-16],  value for the final result of the event
     - limit_events            int or False, value to limit the events
+    - cursor                  page through events in event id order. Empty for the first page, then the previous next_cursor
+    - format                  json (default) or ndjson to stream one {game_id, event_num, event_id} per line
+@Output:
+    - {game_id: {event_num: event_id}}
+    - When paging with cursor: {'events': {game_id: {event_num: event_id}}, 'next_cursor': cursor for the next page or None}
 '''
 @app.route('/events/', methods = ['GET'])
+@cached_response
 def endpoint_event(called_internally=False):
-    # === Construct query === 
-    #Sanitize games params 
+    query, limit = build_events_query([EventFact.game_id, EventFact.event_num, EventFact.event_id], called_internally)
+
+    # Keyset pagination on event.id
+    paged = not called_internally and request.args.get('cursor') != None
+    if paged:
+        if request.args.get('cursor') != '':
+            cursor_event_id = decode_cursor(request.args.get('cursor'), 1)[0]
+            query = query.where(EventFact.event_id > bindparam('cursor_event_id', cursor_event_id))
+        query = query.order_by(EventFact.event_id)
+
+    if not called_internally and request.args.get('format') == 'ndjson':
+        streamed_events = (
+            {'game_id': entry.game_id, 'event_num': entry.event_num, 'event_id': entry.event_id}
+            for partition in stream_partitions(query.execution_options(stream_results=True))
+            for entry in partition
+        )
+        return ndjson_response(streamed_events)
+
+    result = db.session.execute(query).all()
+
+    if called_internally:
+        events = []
+        for entry in result:
+            events.append(entry.event_id )
+        events = { 'Events': events }
+    else:
+        events = {}
+        for entry in result:
+            if entry.game_id not in events:
+                events[entry.game_id] = {}
+            events[entry.game_id][entry.event_num] = entry.event_id
+        if paged:
+            next_cursor = encode_cursor([result[-1].event_id]) if limit != None and len(result) == limit and limit > 0 else None
+            events = {'events': events, 'next_cursor': next_cursor}
+        
+    return events
+
+# Aliases of the summary tables joined to event_fact for their stats
+pitch = aliased(PitchSummary, name='pitch')
+contact = aliased(ContactSummary, name='contact')
+fielding = aliased(FieldingSummary, name='fielding')
+
+# Condition on a game_id column for the games param, or the /games/ params as a subquery
+def game_id_filter(game_id_column):
     try:
-        list_of_game_ids = list() # Holds IDs for all the games we want data from
         if (len(request.args.getlist('games')) != 0):
             list_of_game_ids = [int(game_id) for game_id in request.args.getlist('games')]
             list_of_game_id_tuples = db.session.query(Game.game_id).filter(Game.game_id.in_(tuple(list_of_game_ids))).all()
             if (len(list_of_game_id_tuples) != len(list_of_game_ids)):
                 return abort(408, description='Provided GameIDs not found')
-
+            return game_id_column == any_ids('game_ids', list_of_game_ids, db.BigInteger)
         else:
-            games = endpoint_games(True)   # List of dicts of games we want data from and info about those games
-            print(games)
-            for game_id in games['game_ids']:
-                list_of_game_ids.append(game_id)
+            return game_id_column.in_(build_games_query([GameIndex.game_id], True)[0])
     except:
         return abort(408, description='Invalid GameID')
 
-    
+# Params of build_events_query that filter on an event_fact column with a list of ints:
+# (param, column, upper bound of the values, error for values out of range, value that also matches NULL in the column)
+EVENT_COLUMN_FILTERS = [
+    ('pitcher_char', EventFact.pitcher_char_id, 55, "Pitcher Char ID not in range", None),
+    ('batter_char', EventFact.batter_char_id, 55, "Batter Char ID not in range", None),
+    ('contact', EventFact.type_of_contact, 6, "Contact Type not in range", 5), #NULL for misses
+    ('swing', EventFact.type_of_swing, 5, "Swing Type not in range", None),
+    ('chem_link', EventFact.chem_links_ob, 4, "Chem Links not in range", None),
+    ('batter_hand', EventFact.batter_hand, 2, "Batter hand not in range", None),
+    ('pitcher_hand', EventFact.pitcher_hand, 2, "Batter hand not in range", None),
+    ('fielder_char', EventFact.fielder_char_id, 55, "Fielder Char ID not in range", None), #NULL for HRs and misses
+    ('fielder_pos', EventFact.fielder_position, 9, "Fielder position not in range", None),
+    ('innings', EventFact.inning, 50, "Innings not in range", None),
+    ('half_inning', EventFact.half_inning, 2, "Half Inning not in range", None),
+    ('balls', EventFact.balls, 4, "Balls not in range", None),
+    ('strikes', EventFact.strikes, 3, "Strikes not in range", None),
+    ('outs', EventFact.outs, 3, "Outs not in range", None),
+    ('final_result', EventFact.result_of_ab, 17, "Final result not in range", None),
+]
+
+# Params of build_events_query that filter on more than the game: the column filters plus the ones it handles itself
+EVENT_FILTER_ARGS = [param for param, column, upper_bound, error_msg, null_value in EVENT_COLUMN_FILTERS] + [
+    'users_as_batter', 'users_as_pitcher', 'pitch', 'star_chance', 'limit_events']
+
+# Select of `columns` from event_fact filtered by the /events/ params. event_fact has the pitch, contact, fielding,
+# batter, pitcher and fielder columns the filters use, so no other table is joined. Games are filtered by the games
+# param or by the /games/ params as a subquery, so no game ids pass through python.
+# Other endpoints use build_events_query([EventFact.event_id], True) as a subquery
+# Returns (query, limit)
+def build_events_query(columns, called_internally=False):
+    game_filter = game_id_filter(EventFact.game_id)
+
     list_of_batter_user_ids = []
     list_of_pitcher_user_ids = []
-    if ( request.args.getlist('username') != None or request.args.getlist('vs_username') != None ):
-        #Get user ids from list of users
-        vs_usernames = request.args.getlist('vs_username')
-        vs_usernames_lowercase = tuple([lower_and_remove_nonalphanumeric(username) for username in vs_usernames])
-        #List returns a list of user_ids, each in a tuple. Convert to list and return to tuple for SQL query
-        list_of_vs_user_id_tuples = db.session.query(RioUser.id).filter(RioUser.username_lowercase.in_(vs_usernames_lowercase)).all()
-        # using list comprehension
-        list_of_vs_user_id = list(itertools.chain(*list_of_vs_user_id_tuples))
-        if (request.args.get('users_as_batter') == "1"):
-            list_of_batter_user_ids += list_of_vs_user_id
-        if (request.args.get('users_as_pitcher') == "1"):
-            list_of_pitcher_user_ids += list_of_vs_user_id
-
-        #Get user ids from list of users
-        usernames = request.args.getlist('username')
-        usernames_lowercase = tuple([lower_and_remove_nonalphanumeric(username) for username in usernames])
-        #List returns a list of user_ids, each in a tuple. Convert to list and return to tuple for SQL query
-        list_of_user_id_tuples = db.session.query(RioUser.id).filter(RioUser.username_lowercase.in_(usernames_lowercase)).all()
-        # using list comprehension
-        list_of_user_id = list(itertools.chain(*list_of_user_id_tuples))
-        if (request.args.get('users_as_batter') == "1"):
-            list_of_batter_user_ids += list_of_user_id
-        if (request.args.get('users_as_pitcher') == "1"):
-            list_of_pitcher_user_ids += list_of_user_id
-
-    # Pitcher Char Id
-    list_of_pitcher_char_ids, error = sanitize_int_list(request.args.getlist('pitcher_char'), "Pitcher Char ID not in range", 55)
-    if list_of_pitcher_char_ids == None:
-        return abort(400, description = error)
-
-    # Batter Char Id
-    list_of_batter_char_ids, error = sanitize_int_list(request.args.getlist('batter_char'), "Batter Char ID not in range", 55)
-    if list_of_batter_char_ids == None:
-        return abort(400, description = error)
-
-    #Contact Type
-    list_of_contact, error = sanitize_int_list(request.args.getlist('contact'), "Contact Type not in range", 6)
-    if list_of_contact == None:
-        return abort(400, description = error)
-    
-    #Swing Type
-    list_of_swings, error = sanitize_int_list(request.args.getlist('swing'), "Swing Type not in range", 5)
-    if list_of_swings == None:
-        return abort(400, description = error)
+    filter_ids = resolve_filter_args(request.args)
+    list_of_user_id = filter_ids['vs_username'] + filter_ids['username']
+    if (request.args.get('users_as_batter') == "1"):
+        list_of_batter_user_ids += list_of_user_id
+    if (request.args.get('users_as_pitcher') == "1"):
+        list_of_pitcher_user_ids += list_of_user_id
 
     #Pitch Type - 0,1,2,3,4 (curve, slider, perfect charge, changeup, star swing)
+    #(list_of_pitches, pitch.type_of_swing, None) This one needs a DB rework. Manually add later
     list_of_pitches, error = sanitize_int_list(request.args.getlist('pitch'), "Pitch Type not in range", 5)
     if list_of_pitches == None:
         return abort(400, description = error)
 
-    #Chem Links
-    list_of_chem, error = sanitize_int_list(request.args.getlist('chem_link'), "Chem Links not in range", 4)
-    if list_of_chem == None:
-        return abort(400, description = error)
-
-    #Batter Handedness
-    list_of_bh, error = sanitize_int_list(request.args.getlist('batter_hand'), "Batter hand not in range", 2)
-    if list_of_bh == None:
-        return abort(400, description = error)
-
-    #Pitcher Handedness
-    list_of_ph, error = sanitize_int_list(request.args.getlist('pitcher_hand'), "Batter hand not in range", 2)
-    if list_of_ph == None:
-        return abort(400, description = error)
-
-    #Fielder Id
-    list_of_fielder_char_ids, error = sanitize_int_list(request.args.getlist('fielder_char'), "Fielder Char ID not in range", 55)
-    if list_of_fielder_char_ids == None:
-        return abort(400, description = error)
-
-    #Fielder Pos
-    list_of_fielder_pos, error = sanitize_int_list(request.args.getlist('fielder_pos'), "Fielder position not in range", 9)
-    if list_of_fielder_pos == None:
-        return abort(400, description = error)
-
-    #Inning list
-    list_of_innings, error = sanitize_int_list(request.args.getlist('innings'), "Innings not in range", 50)
-    if list_of_innings == None:
-        return abort(400, description = error)
-
-    #Half Inning list
-    list_of_half_inning, error = sanitize_int_list(request.args.getlist('half_inning'), "Half Inning not in range", 2)
-    if list_of_half_inning == None:
-        return abort(400, description = error)
-
-    #Strike list
-    list_of_balls, error = sanitize_int_list(request.args.getlist('balls'), "Balls not in range", 4)
-    if list_of_balls == None:
-        return abort(400, description = error)
-
-    #Strike list
-    list_of_strikes, error = sanitize_int_list(request.args.getlist('strikes'), "Strikes not in range", 3)
-    if list_of_strikes == None:
-        return abort(400, description = error)
-
-    #Outs list
-    list_of_outs, error = sanitize_int_list(request.args.getlist('outs'), "Outs not in range", 3)
-    if list_of_outs == None:
-        return abort(400, description = error)
-    
-    #Final result
-    list_of_results, error = sanitize_int_list(request.args.getlist('final_result'), "Final result not in range", 17)
-    if list_of_results == None:
-        return abort(400, description = error)
+    #list of args, the column to select from, null value
+    where_list = []
+    for param, column, upper_bound, error_msg, null_value in EVENT_COLUMN_FILTERS:
+        values, error = sanitize_int_list(request.args.getlist(param), error_msg, upper_bound)
+        if values == None:
+            return abort(400, description = error)
+        where_list.append((values, column, null_value))
 
     star_chance_flag = [1] if (request.args.get('star_chance') == '1') else []
-
-    #list of args, the attribute to select from, null value
-    where_list = [
-        (list_of_game_ids, 'event.game_id', None),
-        (list_of_pitcher_char_ids, 'pitcher.char_id', None),
-        (list_of_batter_char_ids, 'batter.char_id', None),
-        (list_of_contact, 'contact.type_of_contact', 5),
-        (list_of_swings, 'pitch.type_of_swing', None),
-       #(list_of_pitches, 'pitch.type_of_swing', None) #This one needs a DB rework. Manually add later
-        (list_of_chem, 'event.chem_links_ob', None),
-        (list_of_bh, 'batter.batting_hand', None),
-        (list_of_ph, 'pitcher.fielding_hand', None),
-        (list_of_fielder_char_ids, 'fielder.char_id', None),
-        (list_of_fielder_pos, 'fielder.position', None),
-        (list_of_innings, 'event.inning', None),
-        (list_of_half_inning, 'event.half_inning', None),
-        (list_of_balls, 'event.balls', None),
-        (list_of_strikes, 'event.strikes', None),
-        (list_of_outs, 'event.outs', None),
-        (star_chance_flag, 'event.star_chance', None),
-        (star_chance_flag, 'event.star_chance', None),
-        (list_of_batter_user_ids, 'batter.user_id', None),
-        (list_of_pitcher_user_ids, 'pitcher.user_id', None),
-        (list_of_results, 'event.result_of_ab', None)
+    where_list += [
+        (star_chance_flag, EventFact.star_chance, None),
+        (list_of_batter_user_ids, EventFact.batter_user_id, None),
+        (list_of_pitcher_user_ids, EventFact.pitcher_user_id, None)
     ]
 
+    # Events without a pitch aren't returned
+    query = (
+        select(*columns)
+        .select_from(EventFact)
+        .where(game_filter, EventFact.pitch_summary_id != None)
+    )
+
     #Go through all of the lists from the args
-    #If they are empty, skip entire list, do not add to the statement
-    #If not empty, use the SQL provided in tuple[1] to write a where statement and append it
-    #Grab NULL values for column if tuple[3] is provided and also present in the list
-    def build_where_statement(where_list):
-        where_statement = 'WHERE ('
-        and_needed = False
-        for item in where_list:
-            formatted_tuple, empty = format_list_for_SQL(item[0])
-            if empty:
-                continue
-            if and_needed:
-                where_statement += 'AND '
-            #Check if there are values that will represent null (contact=5 is not a real value, but its used to represent 'no contact' AKA null in the table)
-            null_statement = ''
-            if ((item[2] != None) and (item[2] in item[0])):
-                null_statement = f' OR {item[1]} IS NULL'
-            where_statement += f'({item[1]} IN {formatted_tuple}{null_statement})\n'
-            and_needed = True
-        where_statement += ')'
-        #If we have at least a single where statement, return it
-        if and_needed:
-            return where_statement
-        return ''
-
-    where_statement = build_where_statement(where_list)
-
-    columns_statement = 'event.game_id AS game_id, \n event.event_num AS event_num, \n' if not called_internally else ''
-
-    limit_statement = ''
+    #If they are empty, skip entire list
+    #If not empty, bind the list as an array and match the column against it
+    #Grab NULL values for column if tuple[2] is provided and also present in the list
+    #(contact=5 is not a real value, but its used to represent 'no contact' AKA null in the table)
+    for index, (values, column, null_value) in enumerate(where_list):
+        if len(values) == 0:
+            continue
+        condition = column == any_ids(f'event_filter_{index}', values)
+        if null_value != None and null_value in values:
+            condition = or_(condition, column.is_(None))
+        query = query.where(condition)
+
+    limit = None
     default_limit = 1000
     max_limit     = 150000
     if (request.args.get('limit_events') != None):
         try:
             limit = int(request.args.get('limit_events')) if int(request.args.get('limit_events')) <= max_limit else max_limit
-            limit_statement = f' LIMIT {limit}'
         except:
             if request.args.get('limit_events') in ["false", "False", "F", "f"]:
-                limit_statement = f' LIMIT {max_limit}'
+                limit = max_limit
             elif request.args.get('limit_events') in ["true", "True", "T", "t"]:
-                limit_statement = f' LIMIT {default_limit}'
+                limit = default_limit
             else:
                 return abort(400, description = "Invalid event_limit")
     else:
-        limit_statement = '' if called_internally else f' LIMIT {default_limit}'
-
-    query = (
-        'SELECT \n'
-        f'{columns_statement}'
-        'event.id AS event_id \n'
-        'FROM event \n'
-        'JOIN pitch_summary AS pitch ON event.pitch_summary_id = pitch.id \n'
-        'LEFT JOIN contact_summary AS contact ON pitch.contact_summary_id = contact.id \n'       #Contact gets a left joiin for misses
-        'LEFT JOIN fielding_summary AS fielding ON contact.fielding_summary_id = fielding.id \n' #Fielding gets a left joiin for HRs and misses
-        'JOIN character_game_summary AS batter ON event.batter_id = batter.id \n'
-        'JOIN character_game_summary AS pitcher ON event.pitcher_id = pitcher.id \n'
-        'LEFT JOIN character_game_summary AS fielder ON fielding.fielder_character_game_summary_id = fielder.id \n'
-       f'{where_statement}'
-       f'{limit_statement}'
-    )
-
-    print(query)
-
-    result = db.session.execute(query).all()
+        limit = None if called_internally else default_limit
+    if limit != None:
+        query = query.limit(bindparam('limit_events', limit))
 
-    if called_internally:
-        events = []
-        for entry in result:
-            events.append(entry.event_id )
-        events = { 'Events': events }
-    else:
-        events = {}
-        for entry in result:
-            if entry.game_id not in events:
-                events[entry.game_id] = {}
-            events[entry.game_id][entry.event_num] = entry.event_id
-        
-    return events
+    return query, limit
 
 
 # @app.route('/plate_data/', methods = ['GET'])
@@ -669,88 +539,96 @@ def endpoint_event(called_internally=False):
 #         'Data': data
 #     }
 
-@app.route('/landing_data/', methods = ['GET'])
-def endpoint_landing_data():
-    #Sanitize games params 
+# Condition on event_fact.event_id for endpoints that take events. Uses the events param when given, otherwise
+# the /events/ params (which include the /games/ params) as a subquery so the endpoint runs a single statement
+def event_id_filter():
     try:
-        list_of_event_ids = list() # Holds IDs for all the events we want data from
         if (len(request.args.getlist('events')) != 0):
-            list_of_event_ids = [int(game_id) for game_id in request.args.getlist('events')]
+            list_of_event_ids = [int(event_id) for event_id in request.args.getlist('events')]
             list_of_event_id_tuples = db.session.query(Event.id).filter(Event.id.in_(tuple(list_of_event_ids))).all()
             if (len(list_of_event_id_tuples) != len(list_of_event_ids)):
                 return abort(408, description='Provided Events not found')
-
+            return EventFact.event_id == any_ids('event_ids', list_of_event_ids)
         else:
-            list_of_event_ids = endpoint_event(True)['Events']   # List of dicts of games we want data from and info about those games
+            # The subquery uses the same table as the outer query, so it must not correlate to it
+            return EventFact.event_id.in_(build_events_query([EventFact.event_id], True)[0].correlate(None))
     except:
         return abort(408, description='Invalid GameID')
 
-    event_id_string, event_empty = format_list_for_SQL(list_of_event_ids)
-
-    if event_empty:
-        return {}
+'''
+@Endpoint: Landing_data
+@Description: Return contact, landing and fielder data of every contact event
+@Params:
+    - Game params:           Params for /games/ (tags/users/date/etc)
+    - Event params:          Params for /events/, or events to list the events directly
+    - format:                json (default) or npz for a NumPy .npz archive with one typed array per column.
+                             Columns with NULLs get a <column>_null array marking them
+'''
+@app.route('/landing_data/', methods = ['GET'])
+@cached_response
+def endpoint_landing_data():
+    pitcher_user = aliased(RioUser, name='pitcher_user')
+    batter_user = aliased(RioUser, name='batter_user')
 
     query = (
-        'SELECT \n'
-        'event.game_id AS game_id, \n'
-        'event.event_num AS event_num, \n'
-        'event.result_of_ab AS final_result, \n'
-        'event.chem_links_ob AS chem_links_ob, \n'
-        'batter.char_id AS batter_char_id, \n'
-        'pitcher.char_id AS pitcher_char_id, \n'
-        'fielder.char_id AS fielder_char_id, \n'
-        'pitcher_user.username AS pitcher_username, \n'
-        'batter_user.username AS batter_username, \n'
-        'batter.batting_hand, \n'
-        'pitcher.fielding_hand, \n'
-        'contact.ball_power AS ball_power '
-        'contact.ball_horiz_angle AS ball_horiz_angle '
-        'contact.ball_vert_angle AS ball_vert_angle '
-        'contact.contact_absolute AS contact_absolute '
-        'contact.contact_quality AS contact_quality '
-        'contact.rng1 AS rng1 '
-        'contact.rng2 AS rng2 '
-        'contact.rng3 AS rng3 '
-        'contact.ball_x_velocity AS ball_x_velocity '
-        'contact.ball_y_velocity AS ball_y_velocity '
-        'contact.ball_z_velocity AS ball_z_velocity '
-        'contact.ball_x_contact_pos AS ball_x_contact_pos '
-        'contact.ball_y_contact_pos AS ball_y_contact_pos '
-        'contact.ball_z_contact_pos AS ball_z_contact_pos '
-        'contact.bat_x_contact_pos AS bat_x_contact_pos '
-        'contact.bat_y_contact_pos AS bat_y_contact_pos '
-        'contact.bat_z_contact_pos AS bat_z_contact_pos '
-        'contact.ball_x_landing_pos AS ball_x_landing_pos '
-        'contact.ball_y_landing_pos AS ball_y_landing_pos '
-        'contact.ball_z_landing_pos AS ball_z_landing_pos '
-        'contact.ball_max_height AS ball_max_height, \n'
-        'contact.ball_hang_time AS ball_hang_time, \n'
-        'contact.input_direction_stick AS stick_input, \n'
-        'contact.charge_power_up AS charge_power_up, \n'
-        'contact.charge_power_down AS charge_power_down, \n'
-        'contact.frame_of_swing_upon_contact AS frame_of_swing, \n'
-        'pitch.type_of_swing, \n'
-        'contact.type_of_contact, \n'
-        #Add decoded action
-        'fielding.position AS fielder_position, \n'
-        'fielding.fielder_x_pos AS fielder_x_pos, \n'
-        'fielding.fielder_y_pos AS fielder_y_pos, \n'
-        'fielding.fielder_z_pos AS fielder_z_pos, \n'
-        'fielding.jump AS fielder_jump, \n'
-        'fielding.manual_select AS manual_select_state \n'
-        'FROM event \n'
-        'JOIN pitch_summary AS pitch ON event.pitch_summary_id = pitch.id \n'
-        'JOIN contact_summary AS contact ON pitch.contact_summary_id = contact.id \n'
-        'LEFT JOIN fielding_summary AS fielding ON contact.fielding_summary_id = fielding.id \n'
-        'JOIN character_game_summary AS batter ON event.batter_id = batter.id \n'
-        'JOIN character_game_summary AS pitcher ON event.pitcher_id = pitcher.id \n'
-        'LEFT JOIN character_game_summary AS fielder ON fielding.fielder_character_game_summary_id = fielder.id \n'
-        'JOIN rio_user AS pitcher_user ON pitcher.user_id = pitcher_user.id \n'
-        'JOIN rio_user AS batter_user ON batter.user_id = batter_user.id \n'
-       f'WHERE event.id IN {event_id_string}'
+        select(
+            EventFact.game_id.label('game_id'),
+            EventFact.event_num.label('event_num'),
+            EventFact.result_of_ab.label('final_result'),
+            EventFact.chem_links_ob.label('chem_links_ob'),
+            EventFact.batter_char_id.label('batter_char_id'),
+            EventFact.pitcher_char_id.label('pitcher_char_id'),
+            EventFact.fielder_char_id.label('fielder_char_id'),
+            pitcher_user.username.label('pitcher_username'),
+            batter_user.username.label('batter_username'),
+            EventFact.batter_hand.label('batting_hand'),
+            EventFact.pitcher_hand.label('fielding_hand'),
+            contact.ball_power.label('ball_power'),
+            contact.ball_horiz_angle.label('ball_horiz_angle'),
+            contact.ball_vert_angle.label('ball_vert_angle'),
+            contact.contact_absolute.label('contact_absolute'),
+            contact.contact_quality.label('contact_quality'),
+            contact.rng1.label('rng1'),
+            contact.rng2.label('rng2'),
+            contact.rng3.label('rng3'),
+            contact.ball_x_velocity.label('ball_x_velocity'),
+            contact.ball_y_velocity.label('ball_y_velocity'),
+            contact.ball_z_velocity.label('ball_z_velocity'),
+            contact.ball_x_contact_pos.label('ball_x_contact_pos'),
+            contact.ball_z_contact_pos.label('ball_z_contact_pos'),
+            # Bat position at contact is stored with the pitch
+            pitch.bat_x_contact_pos.label('bat_x_contact_pos'),
+            pitch.bat_z_contact_pos.label('bat_z_contact_pos'),
+            contact.ball_x_landing_pos.label('ball_x_landing_pos'),
+            contact.ball_y_landing_pos.label('ball_y_landing_pos'),
+            contact.ball_z_landing_pos.label('ball_z_landing_pos'),
+            contact.ball_max_height.label('ball_max_height'),
+            contact.ball_hang_time.label('ball_hang_time'),
+            contact.input_direction_stick.label('stick_input'),
+            contact.charge_power_up.label('charge_power_up'),
+            contact.charge_power_down.label('charge_power_down'),
+            contact.frame_of_swing_upon_contact.label('frame_of_swing'),
+            EventFact.type_of_swing.label('type_of_swing'),
+            EventFact.type_of_contact.label('type_of_contact'),
+            #Add decoded action
+            EventFact.fielder_position.label('fielder_position'),
+            fielding.fielder_x_pos.label('fielder_x_pos'),
+            fielding.fielder_y_pos.label('fielder_y_pos'),
+            fielding.fielder_z_pos.label('fielder_z_pos'),
+            fielding.jump.label('fielder_jump'),
+            fielding.manual_select.label('manual_select_state')
+        )
+        .select_from(EventFact)
+        .join(contact, EventFact.contact_summary_id == contact.id)
+        .join(pitch, EventFact.pitch_summary_id == pitch.id)
+        .outerjoin(fielding, EventFact.fielding_summary_id == fielding.id)
+        .join(pitcher_user, EventFact.pitcher_user_id == pitcher_user.id)
+        .join(batter_user, EventFact.batter_user_id == batter_user.id)
+        .where(event_id_filter())
     )
 
-    print(query)
+    if request.args.get('format') == 'npz':
+        return npz_response(query, 'landing_data.npz')
 
     result = db.session.execute(query).all()
 
@@ -761,66 +639,143 @@ def endpoint_landing_data():
         'Data': data
     }
 
+# x and z columns binned by /position_histograms/
+POSITION_HISTOGRAM_COLUMNS = {
+    'landing': (contact.ball_x_landing_pos, contact.ball_z_landing_pos),
+    'contact': (contact.ball_x_contact_pos, contact.ball_z_contact_pos),
+    'fielder': (fielding.fielder_x_pos, fielding.fielder_z_pos),
+}
+
+# Default grid of a histogram, with any grid params given in the request applied
+def histogram_grid(position):
+    grid = dict(cPOSITION_HISTOGRAM_GRIDS[position])
+    try:
+        for key in ['x_min', 'x_max', 'z_min', 'z_max']:
+            if request.args.get(key) != None:
+                grid[key] = float(request.args.get(key))
+        for key in ['x_bins', 'z_bins']:
+            if request.args.get(key) != None:
+                grid[key] = int(request.args.get(key))
+    except ValueError:
+        return abort(400, description='Invalid grid')
+
+    for axis in ['x', 'z']:
+        if not (math.isfinite(grid[f'{axis}_min']) and math.isfinite(grid[f'{axis}_max']) and grid[f'{axis}_min'] < grid[f'{axis}_max']):
+            return abort(400, description=f'{axis}_min must be below {axis}_max')
+        if grid[f'{axis}_bins'] not in range(1, cPOSITION_HISTOGRAM_MAX_BINS + 1):
+            return abort(400, description=f'{axis}_bins must be between 1 and {cPOSITION_HISTOGRAM_MAX_BINS}')
+    return grid
+
+'''
+@Endpoint: Position_histograms
+@Description: Return 2D histograms of ball landing, ball contact and fielder positions of contact events,
+              binned by the database so only the bin counts are sent
+@Params:
+    - Game params:           Params for /games/ (tags/users/date/etc)
+    - Event params:          Params for /events/, or events to list the events directly
+    - positions:             landing, contact and/or fielder. Default is all three
+    - x_min, x_max, x_bins:  Grid on the x axis, applied to every histogram. Defaults per position are in cPOSITION_HISTOGRAM_GRIDS
+    - z_min, z_max, z_bins:  Grid on the z axis
+@Output:
+    - Histograms: {position: {grid, 'bins': [[x_bin, z_bin, count], ...], 'outside': count}}
+      Bins are 0 indexed and only bins with positions are listed. Positions off the grid are counted in outside
+'''
+@app.route('/position_histograms/', methods = ['GET'])
+@cached_response
+def endpoint_position_histograms():
+    positions = list(dict.fromkeys(request.args.getlist('positions'))) or list(POSITION_HISTOGRAM_COLUMNS)
+    if any(position not in POSITION_HISTOGRAM_COLUMNS for position in positions):
+        return abort(400, description=f'positions must be one of {", ".join(POSITION_HISTOGRAM_COLUMNS)}')
+    grids = {position: histogram_grid(position) for position in positions}
+
+    event_filter = event_id_filter()
+    queries = []
+    for position in positions:
+        x_column, z_column = POSITION_HISTOGRAM_COLUMNS[position]
+        grid = grids[position]
+        # width_bucket puts values below the grid in bucket 0 and above it in bucket bins + 1
+        x_bin = func.width_bucket(x_column, bindparam(f'{position}_x_min', grid['x_min']), bindparam(f'{position}_x_max', grid['x_max']), bindparam(f'{position}_x_bins', grid['x_bins']))
+        z_bin = func.width_bucket(z_column, bindparam(f'{position}_z_min', grid['z_min']), bindparam(f'{position}_z_max', grid['z_max']), bindparam(f'{position}_z_bins', grid['z_bins']))
+        query = (
+            select(literal(position).label('position'), x_bin.label('x_bin'), z_bin.label('z_bin'), func.count().label('count'))
+            .select_from(EventFact)
+            .join(contact, EventFact.contact_summary_id == contact.id)
+        )
+        if position == 'fielder':
+            query = query.join(fielding, EventFact.fielding_summary_id == fielding.id)
+        queries.append(query.where(event_filter, x_column != None, z_column != None).group_by(x_bin, z_bin))
+
+    query = queries[0] if len(queries) == 1 else union_all(*queries)
+    result = db.session.execute(query).all()
+
+    histograms = {position: dict(grids[position], bins=[], outside=0) for position in positions}
+    for entry in sorted(result):
+        histogram = histograms[entry.position]
+        if entry.x_bin in range(1, histogram['x_bins'] + 1) and entry.z_bin in range(1, histogram['z_bins'] + 1):
+            histogram['bins'].append([entry.x_bin - 1, entry.z_bin - 1, entry.count])
+        else:
+            histogram['outside'] += entry.count
+
+    return {
+        'Histograms': histograms
+    }
+
 
 # == Functions to return coordinates for graphing ==
 '''
 @Endpoint: Star_chances
-@Description: Return number of star chances per game or per inning
+@Description: Return number of star chances, in total, per game and/or per inning
 @Params:
     - Game params:           Params for /games/ (tags/users/date/etc)
     - Event params:
-    - by_inning:      [bool] Show breakdown by inning instead of by game
+    - by_game:        [bool] Break down by game
+    - by_inning:      [bool] Break down by inning and half inning
 '''
 @app.route('/star_chances/', methods = ['GET'])
+@cached_response
 def endpoint_star_chances():
-    #Sanitize games params 
-    try:
-        list_of_event_ids = list() # Holds IDs for all the events we want data from
-        if (len(request.args.getlist('events')) != 0):
-            list_of_event_ids = [int(game_id) for game_id in request.args.getlist('events')]
-            list_of_event_id_tuples = db.session.query(Event.id).filter(Event.id.in_(tuple(list_of_event_ids))).all()
-            if (len(list_of_event_id_tuples) != len(list_of_event_ids)):
-                return abort(408, description='Provided Events not found')
-
-        else:
-            list_of_event_ids = endpoint_event(True)['Events']   # List of dicts of games we want data from and info about those games
-    except:
-        return abort(408, description='Invalid GameID')
+    by_game = request.args.get('by_game') in ["true", "True", "T", "t"]
+    by_inning = request.args.get('by_inning') in ["true", "True", "T", "t"]
+
+    # Without event level filters the counts are sums of the per half inning rollups of the selected games
+    use_rollup = (app.config['STAR_CHANCE_ROLLUPS'] and len(request.args.getlist('events')) == 0
+                  and not any(arg in request.args for arg in EVENT_FILTER_ARGS))
+    if use_rollup:
+        columns = [func.coalesce(func.sum(getattr(StarChanceRollup, column)), 0).label(column) for column in STAR_CHANCE_ROLLUP_COLUMNS]
+        columns.append(func.count(StarChanceRollup.game_id.distinct()).label('games'))
+        game_column, inning_column, half_inning_column = StarChanceRollup.game_id, StarChanceRollup.inning, StarChanceRollup.half_inning
+    else:
+        columns = [
+            func.count(case((and_(EventFact.bases_empty, EventFact.event_num != 0,
+                                  or_(EventFact.away_stars < 5, EventFact.home_stars < 5)), 1))).label('eligible_event'),
+            func.count(case((and_(EventFact.star_chance == 1, EventFact.result_of_ab > 0), 1))).label('star_chances'),
+            func.count(case((EventFact.result_of_ab > 0, 1))).label('total_events'),
+            func.count(case((and_(EventFact.star_chance == 1, EventFact.result_of_ab >= 1, EventFact.result_of_ab <= 6), 1))).label('pitcher_win'),
+            func.count(case((and_(EventFact.star_chance == 1, EventFact.result_of_ab >= 7), 1))).label('batter_win'),
+            func.count(EventFact.game_id.distinct()).label('games')
+        ]
+        game_column, inning_column, half_inning_column = EventFact.game_id, EventFact.inning, EventFact.half_inning
+
+    group_by = []
+    if by_game:
+        group_by.append(game_column.label('game_id'))
+    if by_inning:
+        group_by += [inning_column.label('inning'), half_inning_column.label('half_inning')]
+
+    query = select(*(group_by + columns))
+    if use_rollup:
+        query = query.where(game_id_filter(StarChanceRollup.game_id))
+    else:
+        query = query.where(event_id_filter(), EventFact.result_of_ab != 0)
+    if len(group_by) > 0:
+        query = query.group_by(*group_by).order_by(*group_by)
 
-    event_id_string, event_empty = format_list_for_SQL(list_of_event_ids)
+    result = db.session.execute(query).all()
 
-    if event_empty:
+    # No matching events. Without groups the aggregates still return one row (games = 0)
+    if len(result) == 0 or result[0].games == 0:
         return {}
 
-    select_statement = ''
-    group_by_statement = ''
-    if request.args.get('by_inning') in ["true", "True", "T", "t"]:
-        select_statement = (
-            'event.inning AS inning, \n'
-            'event.half_inning AS half_inning, \n'
-        )
-        group_by_statement = 'GROUP BY event.inning, event.half_inning'
-
-    query = (
-        'SELECT \n'
-       f'{select_statement}' 
-        'COUNT(CASE WHEN (event.runner_on_1 IS NULL AND event.runner_on_2 IS NULL \n'
-        '                 AND event.runner_on_3 IS NULL AND event.event_num != 0'
-        '                 AND (event.away_stars < 5 OR event.home_stars < 5)) THEN 1 ELSE NULL END) AS eligible_event, \n'
-        'COUNT(CASE WHEN (event.star_chance = 1 AND event.result_of_ab > 0) THEN 1 ELSE NULL END) AS star_chances, \n'
-        'COUNT(CASE WHEN (event.result_of_ab > 0) THEN 1 ELSE NULL END) AS total_events, \n'
-        'COUNT(CASE WHEN (event.star_chance = 1 AND event.result_of_ab >= 1 AND event.result_of_ab <= 6 AND event.result_of_ab != 0) THEN 1 ELSE NULL END) AS pitcher_win, \n'
-        'COUNT(CASE WHEN (event.star_chance = 1 AND event.result_of_ab >= 7) THEN 1 ELSE NULL END) AS batter_win, \n'
-        'COUNT ( DISTINCT event.game_id ) AS games \n'
-        'FROM event \n'
-       f'WHERE event.id IN {event_id_string} and event.result_of_ab != 0 \n'
-       f'{group_by_statement}'
-    )
-
-    print(query)
-
-    result = db.session.execute(query).all()
-
     data = []
     for entry in result:
         data.append(entry._asdict())
@@ -894,30 +849,15 @@ def endpoint_star_chances():
     - exclude_misc:      [bool],       Do not return stats from the misc section
     - exclude_fielding:  [bool],       Do not return stats from the fielding section
 @ Output:
-    - Output is variable based on the "by_XXX" flags. Helper function update_detailed_stats_dict builds and updates
-      the large return dict at each step
+    - Output is variable based on the "by_XXX" flags. Helper function add_detailed_stats_rows merges the rows of
+      each query into the large return dict
 
 @ URL example: http://127.0.0.1:5000/detailed_stats/?username=demouser1&character=1&by_swing=1
 '''
 @app.route('/detailed_stats/', methods = ['GET'])
+@cached_response
 def endpoint_detailed_stats():
 
-    #Sanitize games params 
-    try:
-        list_of_game_ids = list() # Holds IDs for all the games we want data from
-        if (len(request.args.getlist('games')) != 0):
-            list_of_game_ids = [int(game_id) for game_id in request.args.getlist('games')]
-            list_of_game_id_tuples = db.session.query(Game.game_id).filter(Game.game_id.in_(tuple(list_of_game_ids))).all()
-            if (len(list_of_game_id_tuples) != len(list_of_game_ids)):
-                return abort(408, description='Provided GameIDs not found')
-
-        else:
-            games = endpoint_games(True)   # List of dicts of games we want data from and info about those games
-            for game_id in games['game_ids']:
-                list_of_game_ids.append(game_id)
-    except:
-        return abort(408, description='Invalid GameID')
-
     # Sanitize character params
     try:
         list_of_char_ids = request.args.getlist('char_id')
@@ -930,7 +870,6 @@ def endpoint_detailed_stats():
     except:
         return abort(400, description="Invalid Char Id")
 
-    tuple_of_game_ids = tuple(list_of_game_ids)
     tuple_char_ids = tuple(list_of_char_ids)
     group_by_user = (request.args.get('by_user') == '1')
     group_by_swing = (request.args.get('by_swing') == '1')
@@ -944,13 +883,7 @@ def endpoint_detailed_stats():
     exclude_fielding_stats = (request.args.get('exclude_fielding') == '1')
 
     usernames = request.args.getlist('username')
-    usernames_lowercase = tuple([lower_and_remove_nonalphanumeric(username) for username in usernames])
-    #List returns a list of user_ids, each in a tuple. Convert to list and return to tuple for SQL query
-    list_of_user_id_tuples = db.session.query(RioUser.id).filter(RioUser.username_lowercase.in_(usernames_lowercase)).all()
-    # using list comprehension
-    list_of_user_id = list(itertools.chain(*list_of_user_id_tuples))
-
-    tuple_user_ids = tuple(list_of_user_id)
+    tuple_user_ids = tuple(resolve_filter_args(request.args)['username'])
 
     #If we didn't find every user provided in the DB, abort
     if (len(tuple_user_ids) != len(usernames)):
@@ -962,77 +895,98 @@ def endpoint_detailed_stats():
         return abort(408, description='Invalid provided characters')
 
     
+    # Games are filtered by the games param or by the /games/ params as a subquery, so no game ids pass through python
+    summary_filters = detailed_stats_filters('character_game_summary', tuple_user_ids, tuple_char_ids)
+
     # Individual functions create queries to get their respective stats
-    return_dict = {}
+    queries = []
     if (not exclude_batting_stats):
-        batting_stats = query_detailed_batting_stats(return_dict, tuple_of_game_ids, tuple_user_ids, tuple_char_ids, group_by_user, group_by_char, group_by_swing, exclude_nonfair)
+        batting_filters = detailed_stats_filters('batting_rollup', tuple_user_ids, tuple_char_ids)
+        queries += query_detailed_batting_stats(batting_filters, summary_filters, group_by_user, group_by_char, group_by_swing, exclude_nonfair)
     if (not exclude_pitching_stats):
-        pitching_stats = query_detailed_pitching_stats(return_dict, tuple_of_game_ids, tuple_user_ids, tuple_char_ids, group_by_user, group_by_char)
+        queries += query_detailed_pitching_stats(summary_filters, group_by_user, group_by_char)
     if (not exclude_misc_stats):
-        misc_stats = query_detailed_misc_stats(return_dict, tuple_of_game_ids, tuple_user_ids, tuple_char_ids, group_by_user, group_by_char)
+        queries += query_detailed_misc_stats(summary_filters, group_by_user, group_by_char)
     if (not exclude_fielding_stats):
-        fielding_stats = query_detailed_fielding_stats(return_dict, tuple_of_game_ids, tuple_user_ids, tuple_char_ids, group_by_user, group_by_char)
+        queries += query_detailed_fielding_stats(summary_filters, group_by_user, group_by_char)
+
+    # The queries don't depend on each other, results are merged in query order so the output doesn't depend on which finishes first
+    results = execute_detailed_stats_queries([query for query, type_of_result, by_swing in queries])
+
+    return_dict = {}
+    for (query, type_of_result, by_swing), (keys, rows) in zip(queries, results):
+        add_detailed_stats_rows(return_dict, type_of_result, keys, rows, group_by_user, group_by_char, by_swing)
 
     return {
         'Stats': return_dict
     }
 
-def query_detailed_batting_stats(stat_dict, game_ids, user_ids, char_ids, group_by_user=False, group_by_char=False, group_by_swing=False, exclude_nonfair=False):
+# Run the detailed stats queries and return their (column names, rows) in query order.
+# With DETAILED_STATS_FANOUT above 1 up to that many queries run at once, each on its own pooled connection.
+# Otherwise they run one after another on the request's session
+def execute_detailed_stats_queries(queries):
+    fanout = min(app.config['DETAILED_STATS_FANOUT'], len(queries))
+    if fanout <= 1:
+        return [result_columns(db.session.execute(query)) for query in queries]
 
-    where_statement = build_where_statement(game_ids, char_ids, user_ids)
+    # Worker threads have no app context, they use the engine directly
+    engine = db.engine
+    def execute(query):
+        with engine.connect() as connection:
+            return result_columns(connection.execute(query))
 
-    by_user = 'character_game_summary.user_id, rio_user.username' if group_by_user else ''
-    select_user = 'character_game_summary.user_id, \n rio_user.username AS username, \n' if group_by_user else ''
+    with ThreadPoolExecutor(max_workers=fanout) as executor:
+        return list(executor.map(execute, queries))
 
-    by_char = 'character_game_summary.char_id, character.name' if group_by_char else ''
-    select_char = 'character_game_summary.char_id AS char_id, \n character.name AS char_name, \n' if group_by_char else ''
+def result_columns(result):
+    return list(result.keys()), result.all()
+
+def query_detailed_batting_stats(batting_filters, summary_filters, group_by_user=False, group_by_char=False, group_by_swing=False, exclude_nonfair=False):
 
-    by_swing = 'pitch_summary.type_of_swing' if group_by_swing else ''
-    select_swing = 'pitch_summary.type_of_swing AS type_of_swing, \n' if group_by_swing else ''
+    # Contact stats are summed from batting_rollup, which has one row per character per game per swing type and foul/not foul
+    by_user = 'batting_rollup.user_id, rio_user.username' if group_by_user else ''
+    select_user = 'batting_rollup.user_id, \n rio_user.username AS username, \n' if group_by_user else ''
 
-    # Build groupby statement by joining all the groups together. Empty statement if all groups are empty
+    by_char = 'batting_rollup.char_id, character.name' if group_by_char else ''
+    select_char = 'batting_rollup.char_id AS char_id, \n character.name AS char_name, \n' if group_by_char else ''
+
+    by_swing = 'batting_rollup.type_of_swing' if group_by_swing else ''
+    select_swing = 'batting_rollup.type_of_swing AS type_of_swing, \n' if group_by_swing else ''
+
+    # Excluding nonfair hits treats foul contact as no contact, the at bat itself still counts
+    contact_columns = ''
+    for column in BATTING_CONTACT_COLUMNS:
+        value = f'CASE WHEN batting_rollup.foul THEN 0 ELSE batting_rollup.{column} END' if exclude_nonfair else f'batting_rollup.{column}'
+        contact_columns += f'COALESCE(SUM({value}), 0) AS {column}, \n'
+
+    # Join all the groups together for the GROUP BY. No GROUP BY if all groups are empty
     groups = ','.join(filter(None,[by_user, by_char, by_swing]))
-    group_by_statement = f"GROUP BY {groups} " if groups != '' else ''
-    contact_batting_query = (
-        
-        'SELECT \n'
+    contact_batting_query = detailed_stats_query(
         f"{select_user}"
         f"{select_char}"
         f"{select_swing}"
-        'COUNT(CASE WHEN (contact_summary.primary_result = 0) THEN 1 ELSE NULL END) AS outs, \n'
-        'COUNT(CASE WHEN contact_summary.primary_result = 1 THEN 1 ELSE NULL END) AS foul_hits, \n'
-        'COUNT(CASE WHEN (contact_summary.primary_result = 2 OR contact_summary.primary_result = 3) THEN 1 ELSE NULL END) AS fair_hits, \n'
-        'COUNT(CASE WHEN (contact_summary.type_of_contact = 0 OR contact_summary.type_of_contact = 4) THEN 1 ELSE NULL END) AS sour_hits, '
-        'COUNT(CASE WHEN (contact_summary.type_of_contact = 1 OR contact_summary.type_of_contact = 3) THEN 1 ELSE NULL END) AS nice_hits, '
-        'COUNT(CASE WHEN contact_summary.type_of_contact = 2 THEN 1 ELSE NULL END) AS perfect_hits, '
-        'COUNT(CASE WHEN contact_summary.secondary_result = 7 THEN 1 ELSE NULL END) AS singles, \n'
-        'COUNT(CASE WHEN contact_summary.secondary_result = 8 THEN 1 ELSE NULL END) AS doubles, \n'
-        'COUNT(CASE WHEN contact_summary.secondary_result = 9 THEN 1 ELSE NULL END) AS triples, \n'
-        'COUNT(CASE WHEN contact_summary.secondary_result = 10 THEN 1 ELSE NULL END) AS homeruns, \n'
-        'COUNT(CASE WHEN contact_summary.secondary_result = 14 THEN 1 ELSE NULL END) AS sacflys, \n'
-        'COUNT(CASE WHEN event.result_of_ab = 1 THEN 1 ELSE NULL END) AS strikeouts, \n'
-        'COUNT(CASE WHEN event.result_of_ab != 0 THEN 1 ELSE NULL END) AS plate_appearances, \n'
-        'SUM(event.result_rbi) AS rbi '
-        'FROM character_game_summary \n'
-        'JOIN character ON character_game_summary.char_id = character.char_id \n'
-        'JOIN event ON character_game_summary.id = event.batter_id \n'
-        'JOIN pitch_summary ON pitch_summary.id = event.pitch_summary_id \n'
-        'LEFT JOIN contact_summary ON pitch_summary.contact_summary_id = contact_summary.id \n'
-       f"   {'AND contact_summary.primary_result != 1' if exclude_nonfair else ''} \n"
-        'JOIN rio_user ON character_game_summary.user_id = rio_user.id \n'
-       f"{where_statement}"
-       f"{group_by_statement}"
+        f"{contact_columns}"
+        'COALESCE(SUM(batting_rollup.strikeouts), 0) AS strikeouts, \n'
+        'COALESCE(SUM(batting_rollup.plate_appearances), 0) AS plate_appearances, \n'
+        'SUM(batting_rollup.rbi) AS rbi \n',
+        'batting_rollup \n'
+        'JOIN character ON batting_rollup.char_id = character.char_id \n'
+        'JOIN rio_user ON batting_rollup.user_id = rio_user.id \n',
+        batting_filters,
+        groups
     )
 
-    print(contact_batting_query)
+    by_user = 'character_game_summary.user_id, rio_user.username' if group_by_user else ''
+    select_user = 'character_game_summary.user_id, \n rio_user.username AS username, \n' if group_by_user else ''
+
+    by_char = 'character_game_summary.char_id, character.name' if group_by_char else ''
+    select_char = 'character_game_summary.char_id AS char_id, \n character.name AS char_name, \n' if group_by_char else ''
 
     #Redo groups, removing swing type
     groups = ','.join(filter(None,[by_user, by_char]))
-    group_by_statement = f"GROUP BY {groups} " if groups != '' else ''
-    non_contact_batting_query = ( 
-        'SELECT \n'
-       f"{select_user}"
-       f"{select_char}"
+    non_contact_batting_query = detailed_stats_query(
+        f"{select_user}"
+        f"{select_char}"
         'SUM(character_game_summary.walks_bb) AS summary_walks_bb, \n'
         'SUM(character_game_summary.walks_hit) AS summary_walks_hbp, \n'
         'SUM(character_game_summary.strikeouts) AS summary_strikeouts, \n'
@@ -1043,27 +997,19 @@ def query_detailed_batting_stats(stat_dict, game_ids, user_ids, char_ids, group_
         'SUM(character_game_summary.sac_flys) AS summary_sac_flys, \n'
         'SUM(character_game_summary.rbi) AS summary_rbi, \n'
         'SUM(character_game_summary.at_bats) AS summary_at_bats, \n'
-        'SUM(character_game_summary.hits) AS summary_hits \n'
-        'FROM character_game_summary \n'
+        'SUM(character_game_summary.hits) AS summary_hits \n',
+        'character_game_summary \n'
         'JOIN character ON character_game_summary.char_id = character.char_id \n'
-        'JOIN rio_user ON character_game_summary.user_id = rio_user.id \n'
-       f"{where_statement}"
-       f"{group_by_statement}"
+        'JOIN rio_user ON character_game_summary.user_id = rio_user.id \n',
+        summary_filters,
+        groups
     )
-    contact_batting_results = db.session.execute(contact_batting_query).all()
-    non_contact_batting_results = db.session.execute(non_contact_batting_query).all()
-
-    batting_stats = {}
-    for result_row in contact_batting_results:
-        update_detailed_stats_dict(stat_dict, 'Batting', result_row, group_by_user, group_by_char, group_by_swing)
-    for result_row in non_contact_batting_results:
-        update_detailed_stats_dict(stat_dict, 'Batting', result_row, group_by_user, group_by_char)
-
-    return batting_stats
-
-def query_detailed_pitching_stats(stat_dict, game_ids, user_ids, char_ids, group_by_user=False, group_by_char=False):
+    return [
+        (contact_batting_query, 'Batting', group_by_swing),
+        (non_contact_batting_query, 'Batting', False)
+    ]
 
-    where_statement = build_where_statement(game_ids, char_ids, user_ids)
+def query_detailed_pitching_stats(filters, group_by_user=False, group_by_char=False):
 
     by_user = 'character_game_summary.user_id, rio_user.username' if group_by_user else ''
     select_user = 'character_game_summary.user_id, \n rio_user.username AS username, \n' if group_by_user else ''
@@ -1071,11 +1017,9 @@ def query_detailed_pitching_stats(stat_dict, game_ids, user_ids, char_ids, group
     by_char = 'character_game_summary.char_id, character.name' if group_by_char else ''
     select_char = 'character_game_summary.char_id AS char_id, \n character.name AS char_name, \n' if group_by_char else ''
 
-    # Build groupby statement by joining all the groups together. Empty statement if all groups are empty
+    # Join all the groups together for the GROUP BY. No GROUP BY if all groups are empty
     groups = ','.join(filter(None,[by_user, by_char]))
-    group_by_statement = f"GROUP BY {groups} " if groups != '' else ''
-    pitching_summary_query = (
-        'SELECT '
+    pitching_summary_query = detailed_stats_query(
         f"{select_user}"
         f"{select_char}"
         'SUM(character_game_summary.batters_faced) AS batters_faced, \n'
@@ -1086,87 +1030,55 @@ def query_detailed_pitching_stats(stat_dict, game_ids, user_ids, char_ids, group
         'SUM(character_game_summary.outs_pitched) AS outs_pitched, \n'
         'SUM(character_game_summary.batters_walked) AS walks_bb, \n'
         'SUM(character_game_summary.batters_hit) AS walks_hbp, \n'
-        'SUM(character_game_summary.pitches_thrown) AS total_pitches \n'
-        'FROM character_game_summary \n'
-        'JOIN character ON character_game_summary.char_id = character.char_id \n'
-        'JOIN rio_user ON rio_user.id = character_game_summary.user_id \n'
-       f"{where_statement}"
-       f"{group_by_statement}"
-    )
-
-    pitch_breakdown_query = (
-        'SELECT '
-        f"{select_user}"
-        f"{select_char}"
-        'COUNT(CASE WHEN (pitch_summary.in_strikezone = false AND type_of_swing = 0) THEN 1 ELSE NULL END) AS balls, \n'
-        'COUNT(CASE WHEN ('
-            '(pitch_summary.in_strikezone = true AND pitch_summary.contact_summary_id = NULL) OR'
-            '(pitch_summary.in_strikezone = false AND type_of_swing > 0)'
-            ') THEN 1 ELSE NULL END) AS strikes \n'
-        'FROM character_game_summary \n'
+        'SUM(character_game_summary.pitches_thrown) AS total_pitches, \n'
+        'SUM(character_game_rollup.balls) AS balls, \n'
+        'SUM(character_game_rollup.strikes) AS strikes \n',
+        'character_game_summary \n'
         'JOIN character ON character_game_summary.char_id = character.char_id \n'
-        'JOIN event ON character_game_summary.id = event.pitcher_id \n'
-        'JOIN pitch_summary ON pitch_summary.id = event.pitch_summary_id \n'
-        'JOIN contact_summary ON contact_summary.id = pitch_summary.contact_summary_id \n'
         'JOIN rio_user ON rio_user.id = character_game_summary.user_id \n'
-       f"{where_statement}"
-       f"{group_by_statement}"
+        'LEFT JOIN character_game_rollup ON character_game_rollup.character_game_summary_id = character_game_summary.id \n',
+        filters,
+        groups
     )
 
-    pitching_summary_results = db.session.execute(pitching_summary_query).all()
-    pitch_breakdown_results = db.session.execute(pitch_breakdown_query).all()
-    for result_row in pitching_summary_results:
-        update_detailed_stats_dict(stat_dict, 'Pitching', result_row, group_by_user, group_by_char)
-    for result_row in pitch_breakdown_results:
-        update_detailed_stats_dict(stat_dict, 'Pitching', result_row, group_by_user, group_by_char)
-    return
-
-def query_detailed_misc_stats(stat_dict, game_ids, user_ids, char_ids, group_by_user=False, group_by_char=False):
-    where_statement = build_where_statement(game_ids, char_ids, user_ids)
+    return [(pitching_summary_query, 'Pitching', False)]
 
+def query_detailed_misc_stats(filters, group_by_user=False, group_by_char=False):
     by_user = 'character_game_summary.user_id, rio_user.username' if group_by_user else ''
     select_user = 'character_game_summary.user_id, \n rio_user.username AS username, \n' if group_by_user else ''
 
     by_char = 'character_game_summary.char_id, character.name' if group_by_char else ''
     select_char = 'character_game_summary.char_id AS char_id, \n character.name AS char_name, \n' if group_by_char else ''
 
-    # Build groupby statement by joining all the groups together. Empty statement if all groups are empty
+    # Join all the groups together for the GROUP BY. No GROUP BY if all groups are empty
     groups = ','.join(filter(None,[by_user, by_char]))
-    group_by_statement = f"GROUP BY {groups} " if groups != '' else ''
 
-    query = (
-        'SELECT '
-       f"{select_user}"
-       f"{select_char}"
-       f"COUNT(*){'/9' if group_by_char != True else ''} AS game_appearances, \n "
-       f"SUM(CASE WHEN game.away_score > game.home_score AND game.away_player_id = rio_user.id THEN 1 ELSE 0 END){'/9' if group_by_char != True else ''} AS away_wins, \n"
-       f"SUM(CASE WHEN game.away_score < game.home_score AND game.away_player_id = rio_user.id THEN 1 ELSE 0 END){'/9' if group_by_char != True else ''} AS away_loses, \n"
-       f"SUM(CASE WHEN game.home_score > game.away_score AND game.home_player_id = rio_user.id THEN 1 ELSE 0 END){'/9' if group_by_char != True else ''} AS home_wins, \n"
-       f"SUM(CASE WHEN game.home_score < game.away_score AND game.home_player_id = rio_user.id THEN 1 ELSE 0 END){'/9' if group_by_char != True else ''} AS home_loses, \n"      
+    query = detailed_stats_query(
+        f"{select_user}"
+        f"{select_char}"
+        f"COUNT(*){'/9' if group_by_char != True else ''} AS game_appearances, \n "
+        f"SUM(CASE WHEN game.away_score > game.home_score AND game.away_player_id = rio_user.id THEN 1 ELSE 0 END){'/9' if group_by_char != True else ''} AS away_wins, \n"
+        f"SUM(CASE WHEN game.away_score < game.home_score AND game.away_player_id = rio_user.id THEN 1 ELSE 0 END){'/9' if group_by_char != True else ''} AS away_loses, \n"
+        f"SUM(CASE WHEN game.home_score > game.away_score AND game.home_player_id = rio_user.id THEN 1 ELSE 0 END){'/9' if group_by_char != True else ''} AS home_wins, \n"
+        f"SUM(CASE WHEN game.home_score < game.away_score AND game.home_player_id = rio_user.id THEN 1 ELSE 0 END){'/9' if group_by_char != True else ''} AS home_loses, \n"      
         'SUM(character_game_summary.defensive_star_successes) AS defensive_star_successes, \n'
         'SUM(character_game_summary.defensive_star_chances) AS defensive_star_chances, \n'
         'SUM(character_game_summary.defensive_star_chances_won) AS defensive_star_chances_won, \n'
         'SUM(character_game_summary.offensive_stars_put_in_play) AS offensive_stars_put_in_play, \n'
         'SUM(character_game_summary.offensive_star_successes) AS offensive_star_successes, \n'
         'SUM(character_game_summary.offensive_star_chances) AS offensive_star_chances, \n'
-        'SUM(character_game_summary.offensive_star_chances_won) AS offensive_star_chances_won \n'
-        'FROM character_game_summary \n'
+        'SUM(character_game_summary.offensive_star_chances_won) AS offensive_star_chances_won \n',
+        'character_game_summary \n'
         'JOIN game ON character_game_summary.game_id = game.game_id \n'
         'JOIN character ON character_game_summary.char_id = character.char_id \n'
-        'JOIN rio_user ON rio_user.id = character_game_summary.user_id \n'
-       f"{where_statement}"
-       f"{group_by_statement}"
+        'JOIN rio_user ON rio_user.id = character_game_summary.user_id \n',
+        filters,
+        groups
     )
 
-    results = db.session.execute(query).all()
-    for result_row in results:
-        update_detailed_stats_dict(stat_dict, 'Misc', result_row, group_by_user, group_by_char)
-
-    return
-
-def query_detailed_fielding_stats(stat_dict, game_ids, user_ids, char_ids, group_by_user=False, group_by_char=False):
+    return [(query, 'Misc', False)]
 
-    where_statement = build_where_statement(game_ids, char_ids, user_ids)
+def query_detailed_fielding_stats(filters, group_by_user=False, group_by_char=False):
 
     by_user = 'character_game_summary.user_id, rio_user.username' if group_by_user else ''
     select_user = 'character_game_summary.user_id, \n rio_user.username AS username, \n' if group_by_user else ''
@@ -1174,11 +1086,9 @@ def query_detailed_fielding_stats(stat_dict, game_ids, user_ids, char_ids, group
     by_char = 'character_game_summary.char_id, character.name' if group_by_char else ''
     select_char = 'character_game_summary.char_id AS char_id, \n character.name AS char_name, \n' if group_by_char else ''
 
-    # Build groupby statement by joining all the groups together. Empty statement if all groups are empty
+    # Join all the groups together for the GROUP BY. No GROUP BY if all groups are empty
     groups = ','.join(filter(None,[by_user, by_char]))
-    group_by_statement = f"GROUP BY {groups} " if groups != '' else ''
-    position_query = (
-        'SELECT '
+    position_query = detailed_stats_query(
         f"{select_user}"
         f"{select_char}"
         'SUM(pitches_at_p) AS pitches_per_p, \n'
@@ -1198,160 +1108,20 @@ def query_detailed_fielding_stats(stat_dict, game_ids, user_ids, char_ids, group
         'SUM(outs_at_ss) AS outs_per_ss, \n'
         'SUM(outs_at_lf) AS outs_per_lf, \n'
         'SUM(outs_at_cf) AS outs_per_cf, \n'
-        'SUM(outs_at_rf) AS outs_per_rf \n'
+        'SUM(outs_at_rf) AS outs_per_rf, \n'
+        'SUM(character_game_rollup.jump_catches) AS jump_catches, \n'
+        'SUM(character_game_rollup.diving_catches) AS diving_catches, \n'
+        'SUM(character_game_rollup.wall_jumps) AS wall_jumps, \n'
+        'SUM(character_game_rollup.swap_successes) AS swap_successes, \n'
+        'SUM(character_game_rollup.bobbles) AS bobbles \n',
         #SUM( Insert other stats once questions addressed
-        'FROM character_game_summary \n'
+        'character_game_summary \n'
         'JOIN character ON character_game_summary.char_id = character.char_id \n'
         'JOIN character_position_summary ON character_position_summary.id = character_game_summary.character_position_summary_id \n'
         'JOIN rio_user ON rio_user.id = character_game_summary.user_id \n'
-       f"{where_statement}"
-       f"{group_by_statement}"
-    )
-
-    fielding_query = (
-        'SELECT '
-        f"{select_user}"
-        f"{select_char}"
-        'COUNT(CASE WHEN fielding_summary.action = 1 THEN 1 ELSE NULL END) AS jump_catches, \n'
-        'COUNT(CASE WHEN fielding_summary.action = 2 THEN 1 ELSE NULL END) AS diving_catches, \n'
-        'COUNT(CASE WHEN fielding_summary.action = 3 THEN 1 ELSE NULL END) AS wall_jumps, \n'
-        'SUM(CASE WHEN fielding_summary.swap = True THEN 1 ELSE 0 END) AS swap_successes, \n'
-        'COUNT(CASE WHEN fielding_summary.bobble != 0 THEN 1 ELSE NULL END) AS bobbles \n'
-        #SUM( Insert other stats once questions addressed
-        'FROM character_game_summary \n'
-        'JOIN character ON character_game_summary.char_id = character.char_id \n'
-        'JOIN fielding_summary ON fielding_summary.fielder_character_game_summary_id = character_game_summary.id \n'
-        'JOIN rio_user ON rio_user.id = character_game_summary.user_id \n'
-       f"{where_statement}"
-       f"{group_by_statement}"
+        'LEFT JOIN character_game_rollup ON character_game_rollup.character_game_summary_id = character_game_summary.id \n',
+        filters,
+        groups
     )
 
-    position_results = db.session.execute(position_query).all()
-    fielding_results = db.session.execute(fielding_query).all()
-    for result_row in position_results:
-        update_detailed_stats_dict(stat_dict, 'Fielding', result_row, group_by_user, group_by_char)
-    for result_row in fielding_results:
-        update_detailed_stats_dict(stat_dict, 'Fielding', result_row, group_by_user, group_by_char)
-    return
-
-def update_detailed_stats_dict(in_stat_dict, type_of_result, result_row, group_by_user=False, group_by_char=False, group_by_swing=False):
-    
-    #Transform SQLAlchemy result_row into a dict and remove extra fields
-    data_dict = result_row._asdict()
-    if ('username' in data_dict): data_dict.pop('username')
-    if ('user_id' in data_dict): data_dict.pop('user_id')
-    if ('char_name' in data_dict): data_dict.pop('char_name')
-    if ('char_id' in data_dict): data_dict.pop('char_id')
-    if ('type_of_swing' in data_dict): data_dict.pop('type_of_swing')
-
-    if group_by_user:
-        if result_row.username not in in_stat_dict:
-            in_stat_dict[result_row.username] = {}
-
-        USER_DICT = in_stat_dict[result_row.username]
-    
-        #User=1, Char=1, Swing=X
-        if group_by_char:
-            if result_row.char_name not in USER_DICT:
-                USER_DICT[result_row.char_name] = {}
-
-            CHAR_DICT = USER_DICT[result_row.char_name]
-
-            #Look at result type
-            if (type_of_result == 'Batting'):
-
-                if type_of_result not in CHAR_DICT:
-                    CHAR_DICT[type_of_result] = {}
-
-                #User=1, Char=1, Swing=1
-                if group_by_swing:
-                    BATTING_DICT = CHAR_DICT[type_of_result]
-
-                    if cTYPE_OF_SWING[result_row.type_of_swing] not in BATTING_DICT:
-                        BATTING_DICT[cTYPE_OF_SWING[result_row.type_of_swing]] = {}
-                    elif cTYPE_OF_SWING[result_row.type_of_swing] in BATTING_DICT:
-                        print('ERROR: FOUND PREVIOUS SWING TYPE')
-                        
-                    BATTING_DICT[cTYPE_OF_SWING[result_row.type_of_swing]].update(data_dict)
-                
-                #User=1, Char=1, Swing=0
-                else:
-                    CHAR_DICT[type_of_result].update(data_dict)
-            
-            elif (type_of_result == 'Pitching' or type_of_result == 'Fielding' or type_of_result == 'Misc'):
-                if type_of_result not in CHAR_DICT:
-                    CHAR_DICT[type_of_result] = {}
-                CHAR_DICT[type_of_result].update(data_dict)
-
-        #User=1, Char=0, Swing=1
-        elif group_by_swing and type_of_result == 'Batting':
-            if type_of_result not in USER_DICT:
-                USER_DICT[type_of_result] = {}
-            
-            if cTYPE_OF_SWING[result_row.type_of_swing] not in USER_DICT[type_of_result]:
-                USER_DICT[type_of_result][cTYPE_OF_SWING[result_row.type_of_swing]] = {}
-            elif USER_DICT[cTYPE_OF_SWING[result_row.type_of_swing]]:
-                print('ERROR: FOUND PREVIOUS SWING TYPE')
-                pprint(result_row._asdict())
-                
-            USER_DICT[type_of_result][cTYPE_OF_SWING[result_row.type_of_swing]].update(data_dict)
-
-        #User=1, Char=0, Swing=0 if batting
-        else:
-            if type_of_result not in USER_DICT:
-                USER_DICT[type_of_result] = {}
-
-            USER_DICT[type_of_result].update(data_dict)
-
-    #User=0, Char=1, Swing=X
-    elif group_by_char:
-        if result_row.char_name not in in_stat_dict:
-            in_stat_dict[result_row.char_name] = {}
-
-        CHAR_DICT = in_stat_dict[result_row.char_name]
-
-        #Look at result type
-        if (type_of_result == 'Batting'):
-
-            #Build batting
-            if type_of_result not in CHAR_DICT:
-                CHAR_DICT[type_of_result] = {}
-
-            #User=0, Char=1, Swing=1
-            if group_by_swing:
-                BATTING_DICT = CHAR_DICT[type_of_result]
-
-                if cTYPE_OF_SWING[result_row.type_of_swing] not in BATTING_DICT:
-                    BATTING_DICT[cTYPE_OF_SWING[result_row.type_of_swing]] = {}
-                elif cTYPE_OF_SWING[result_row.type_of_swing] in BATTING_DICT:
-                    print('ERROR: FOUND PREVIOUS SWING TYPE')
-                    
-                BATTING_DICT[cTYPE_OF_SWING[result_row.type_of_swing]].update(data_dict)
-            
-            #User=0, Char=1, Swing=0
-            else:
-                CHAR_DICT[type_of_result].update(data_dict)
-
-        elif (type_of_result == 'Pitching' or type_of_result == 'Fielding' or type_of_result == 'Misc'):
-            if type_of_result not in CHAR_DICT:
-                CHAR_DICT[type_of_result] = {}
-            CHAR_DICT[type_of_result].update(data_dict)
-    
-    #User=0, Char=0, Swing=1
-    elif group_by_swing and type_of_result == 'Batting':
-        #Build batting
-        if type_of_result not in in_stat_dict:
-            in_stat_dict[type_of_result] = {}
-
-        if cTYPE_OF_SWING[result_row.type_of_swing] not in in_stat_dict[type_of_result]:
-            in_stat_dict[type_of_result][cTYPE_OF_SWING[result_row.type_of_swing]] = {}
-        elif cTYPE_OF_SWING[result_row.type_of_swing] in in_stat_dict[type_of_result]:
-            print('ERROR: FOUND PREVIOUS SWING TYPE')
-            
-        in_stat_dict[type_of_result][cTYPE_OF_SWING[result_row.type_of_swing]].update(data_dict)
-
-    #User=0, Char=0, Swing=0
-    else:
-        if type_of_result not in in_stat_dict:
-            in_stat_dict[type_of_result] = {}
-        in_stat_dict[type_of_result].update(data_dict)
+    return [(position_query, 'Fielding', False)]
@@ -2,6 +2,7 @@ from flask import request, jsonify, abort
 from flask import current_app as app
 from ...models import db, RioUser, Game
 from ...util import calculate_era
+from ...response_cache import cached_response
 
 '''
 @ Description: Returns box score data
@@ -17,6 +18,7 @@ from ...util import calculate_era
 '''
 # === Box Score ===
 @app.route('/box_score/', methods = ['GET'])
+@cached_response
 def box_score():
     #Not ready for production
     if (app.config['rio_env'] == "production"):
@@ -2,6 +2,7 @@ from flask import request, abort
 from flask import current_app as app
 from ...models import db, RioUser
 from ...util import *
+from ...response_cache import cached_response
 
 # API Request URL example: /profile/stats/?recent=10&username=demouser1
 '''
@@ -19,6 +20,7 @@ from ...util import *
     @ URL example: http://127.0.0.1:5000/profile/stats/?recent=5&username=demOuser4
 '''
 @app.route('/user_summary/', methods = ['GET'])
+@cached_response
 def user_stats():
     # # Get User row
     username = request.args.get('username')
@@ -0,0 +1,437 @@
+import argparse
+import glob
+import json
+import time
+from urllib.parse import urlencode
+from sqlalchemy import text
+from sqlalchemy.engine.result import IteratorResult, SimpleResultMetaData
+
+from app import init_app, db
+from app.models import *
+from app.consts import cTYPE_OF_SWING
+from app.detailed_stats import add_detailed_stats_rows
+
+# Benchmarks run in-process against the database configured in the environment (POSTGRES_*).
+# They write rows, so point them at a scratch database.
+#
+#   python benchmark-script.py populate_db --files "json/games/*.json" --repeat 5
+#   python benchmark-script.py games --requests 200
+#   python benchmark-script.py games_scaling --sizes 50 100 200 400 800
+#   python benchmark-script.py detailed_stats_dict --users 200
+#   python benchmark-script.py event_fact --requests 20
+
+BENCHMARK_USERS = ['BenchAway', 'BenchHome']
+BENCHMARK_TAG_SET = 'Benchmark'
+
+# Create (or reuse) two verified users in the official community and a TagSet to submit under
+def create_benchmark_fixtures():
+    community = Community.query.filter_by(name='ProjectRio').first()
+    if community == None:
+        raise SystemExit('Official community not found, run /wipe_db/ or /init_db/ first')
+
+    rio_keys = list()
+    for username in BENCHMARK_USERS:
+        user = RioUser.query.filter_by(username=username).first()
+        if user == None:
+            user = RioUser(in_username=username, in_email=f'{username.lower()}@benchmark.local', in_password='benchmark')
+            user.verified = True
+            db.session.add(user)
+            db.session.commit()
+        if CommunityUser.query.filter_by(user_id=user.id, community_id=community.id).first() == None:
+            db.session.add(CommunityUser(user.id, community.id, False, False, True))
+            db.session.commit()
+        rio_keys.append(user.rio_key)
+
+    tag_set = TagSet.query.filter_by(name=BENCHMARK_TAG_SET).first()
+    if tag_set == None:
+        tag_set = TagSet(community.id, BENCHMARK_TAG_SET, 'Season', 0, 2**31-1)
+        db.session.add(tag_set)
+        db.session.commit()
+
+    return rio_keys[0], rio_keys[1], tag_set.id
+
+# Load a stat file and point it at the benchmark users. Older files label rosters 'Team 0/1 Roster N'
+def load_stat_file(path, away_rio_key, home_rio_key, tag_set_id):
+    with open(path, 'r') as f:
+        game_data = json.load(f)
+
+    character_game_stats = dict()
+    for key, value in game_data['Character Game Stats'].items():
+        key = key.replace('Team 0 Roster', 'Away Roster').replace('Team 1 Roster', 'Home Roster')
+        character_game_stats[key] = value
+    game_data['Character Game Stats'] = character_game_stats
+    game_data['Away Player'] = away_rio_key
+    game_data['Home Player'] = home_rio_key
+    game_data['TagSetID'] = tag_set_id
+    return game_data
+
+def benchmark_populate_db(app, args):
+    paths = sorted(glob.glob(args.files))
+    if len(paths) == 0:
+        raise SystemExit(f'No stat files match {args.files}')
+
+    with app.app_context():
+        away_rio_key, home_rio_key, tag_set_id = create_benchmark_fixtures()
+        stat_files = [load_stat_file(path, away_rio_key, home_rio_key, tag_set_id) for path in paths]
+        next_game_id = (db.session.execute('SELECT MAX(game_id) FROM game').scalar() or 0) + 1
+
+    client = app.test_client()
+    completed = 0
+    failures = dict()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        for path, game_data in zip(paths, stat_files):
+            # Fresh GameID per submission so every replay is a new game
+            game_data['GameID'] = format(next_game_id, 'x')
+            next_game_id += 1
+
+            try:
+                response = client.post('/populate_db/', json=game_data)
+            except Exception as e:
+                # DEBUG propagates errors out of the test client, count them like any other rejected game
+                failures[path] = repr(e)
+                continue
+            if response.status_code == 200:
+                completed += 1
+            else:
+                failures[path] = response.status_code
+    elapsed = time.perf_counter() - start
+
+    print(f'Replayed {len(paths)} stat files x {args.repeat}')
+    print(f'Completed: {completed}  Failed: {len(paths) * args.repeat - completed}')
+    for path, reason in failures.items():
+        print(f'  {path}: {reason}')
+    print(f'Elapsed: {elapsed:.2f}s  Throughput: {completed / elapsed:.2f} games/sec')
+
+# Value at the given percentile (0-100) of a list of timings, nearest rank
+def percentile(timings, pct):
+    ordered = sorted(timings)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+# Time each query string against an endpoint and report p50/p99 latency in ms
+def time_endpoint(client, endpoint, filter_sets, requests):
+    print(f'{"filters":<60} {"p50 ms":>8} {"p99 ms":>8} {"rows":>6}')
+    for filters in filter_sets:
+        url = f'{endpoint}?{urlencode(filters, doseq=True)}'
+        timings = list()
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = client.get(url)
+            timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200:
+            print(f'{url:<60} status {response.status_code}')
+            continue
+        rows = len(next(iter(response.json.values())))
+        print(f'{urlencode(filters, doseq=True) or "(none)":<60} {percentile(timings, 50):>8.2f} {percentile(timings, 99):>8.2f} {rows:>6}')
+
+def benchmark_games(app, args):
+    with app.app_context():
+        create_benchmark_fixtures()
+        tag = Tag.query.first()
+        captain = db.session.execute(
+            'SELECT character.name FROM character_game_summary '
+            'JOIN character ON character_game_summary.char_id = character.char_id '
+            'WHERE character_game_summary.captain = True GROUP BY character.name ORDER BY COUNT(*) DESC LIMIT 1'
+        ).scalar()
+
+    away, home = BENCHMARK_USERS
+    filter_sets = [
+        {},
+        {'limit_games': 'false'},
+        {'username': away},
+        {'username': away, 'vs_username': home},
+        {'exclude_username': home},
+    ]
+    if captain != None:
+        filter_sets += [
+            {'captain': captain},
+            {'username': away, 'exclude_captain': captain},
+        ]
+    if tag != None:
+        filter_sets += [
+            {'tag': tag.name},
+            {'exclude_tag': tag.name, 'limit_games': 'false'},
+            {'tag': tag.name, 'username': away, 'captain': captain or []},
+        ]
+
+    time_endpoint(app.test_client(), '/games/', filter_sets, args.requests)
+
+# /games/ latency should grow linearly with the games returned. Times each page size and compares
+# the cost per game of the largest page against the smallest
+def benchmark_games_scaling(app, args):
+    with app.app_context():
+        game_count = db.session.execute('SELECT COUNT(*) FROM game_index').scalar()
+    sizes = [size for size in sorted(args.sizes) if size <= game_count]
+    if len(sizes) < 2:
+        raise SystemExit(f'Only {game_count} indexed games, need at least {sorted(args.sizes)[1]} (run populate_db or bulk-load first)')
+
+    client = app.test_client()
+    per_game = dict()
+    print(f'{"games":>8} {"p50 ms":>10} {"ms/game":>10}')
+    for size in sizes:
+        timings = list()
+        for _ in range(args.requests):
+            start = time.perf_counter()
+            response = client.get(f'/games/?limit_games={size}')
+            timings.append((time.perf_counter() - start) * 1000)
+        if response.status_code != 200 or len(response.json['games']) != size:
+            raise SystemExit(f'/games/?limit_games={size} returned {response.status_code}')
+        per_game[size] = percentile(timings, 50) / size
+        print(f'{size:>8} {percentile(timings, 50):>10.2f} {per_game[size]:>10.4f}')
+
+    # Fixed per-request overhead makes small pages cost more per game, so growth is judged by the largest pages
+    ratio = per_game[sizes[-1]] / per_game[sizes[-2]]
+    print(f'ms/game ratio of the two largest pages: {ratio:.2f} ({"linear" if ratio < args.max_ratio else "SUPERLINEAR"})')
+    if ratio >= args.max_ratio:
+        raise SystemExit(1)
+
+# The per row builder /detailed_stats/ used before add_detailed_stats_rows, kept as the baseline
+def legacy_update_detailed_stats_dict(in_stat_dict, type_of_result, result_row, group_by_user=False, group_by_char=False, group_by_swing=False):
+    
+    #Transform SQLAlchemy result_row into a dict and remove extra fields
+    data_dict = result_row._asdict()
+    if ('username' in data_dict): data_dict.pop('username')
+    if ('user_id' in data_dict): data_dict.pop('user_id')
+    if ('char_name' in data_dict): data_dict.pop('char_name')
+    if ('char_id' in data_dict): data_dict.pop('char_id')
+    if ('type_of_swing' in data_dict): data_dict.pop('type_of_swing')
+
+    if group_by_user:
+        if result_row.username not in in_stat_dict:
+            in_stat_dict[result_row.username] = {}
+
+        USER_DICT = in_stat_dict[result_row.username]
+    
+        #User=1, Char=1, Swing=X
+        if group_by_char:
+            if result_row.char_name not in USER_DICT:
+                USER_DICT[result_row.char_name] = {}
+
+            CHAR_DICT = USER_DICT[result_row.char_name]
+
+            #Look at result type
+            if (type_of_result == 'Batting'):
+
+                if type_of_result not in CHAR_DICT:
+                    CHAR_DICT[type_of_result] = {}
+
+                #User=1, Char=1, Swing=1
+                if group_by_swing:
+                    BATTING_DICT = CHAR_DICT[type_of_result]
+
+                    if cTYPE_OF_SWING[result_row.type_of_swing] not in BATTING_DICT:
+                        BATTING_DICT[cTYPE_OF_SWING[result_row.type_of_swing]] = {}
+                    elif cTYPE_OF_SWING[result_row.type_of_swing] in BATTING_DICT:
+                        print('ERROR: FOUND PREVIOUS SWING TYPE')
+                        
+                    BATTING_DICT[cTYPE_OF_SWING[result_row.type_of_swing]].update(data_dict)
+                
+                #User=1, Char=1, Swing=0
+                else:
+                    CHAR_DICT[type_of_result].update(data_dict)
+            
+            elif (type_of_result == 'Pitching' or type_of_result == 'Fielding' or type_of_result == 'Misc'):
+                if type_of_result not in CHAR_DICT:
+                    CHAR_DICT[type_of_result] = {}
+                CHAR_DICT[type_of_result].update(data_dict)
+
+        #User=1, Char=0, Swing=1
+        elif group_by_swing and type_of_result == 'Batting':
+            if type_of_result not in USER_DICT:
+                USER_DICT[type_of_result] = {}
+            
+            if cTYPE_OF_SWING[result_row.type_of_swing] not in USER_DICT[type_of_result]:
+                USER_DICT[type_of_result][cTYPE_OF_SWING[result_row.type_of_swing]] = {}
+            elif USER_DICT[cTYPE_OF_SWING[result_row.type_of_swing]]:
+                print('ERROR: FOUND PREVIOUS SWING TYPE')
+                print(result_row._asdict())
+                
+            USER_DICT[type_of_result][cTYPE_OF_SWING[result_row.type_of_swing]].update(data_dict)
+
+        #User=1, Char=0, Swing=0 if batting
+        else:
+            if type_of_result not in USER_DICT:
+                USER_DICT[type_of_result] = {}
+
+            USER_DICT[type_of_result].update(data_dict)
+
+    #User=0, Char=1, Swing=X
+    elif group_by_char:
+        if result_row.char_name not in in_stat_dict:
+            in_stat_dict[result_row.char_name] = {}
+
+        CHAR_DICT = in_stat_dict[result_row.char_name]
+
+        #Look at result type
+        if (type_of_result == 'Batting'):
+
+            #Build batting
+            if type_of_result not in CHAR_DICT:
+                CHAR_DICT[type_of_result] = {}
+
+            #User=0, Char=1, Swing=1
+            if group_by_swing:
+                BATTING_DICT = CHAR_DICT[type_of_result]
+
+                if cTYPE_OF_SWING[result_row.type_of_swing] not in BATTING_DICT:
+                    BATTING_DICT[cTYPE_OF_SWING[result_row.type_of_swing]] = {}
+                elif cTYPE_OF_SWING[result_row.type_of_swing] in BATTING_DICT:
+                    print('ERROR: FOUND PREVIOUS SWING TYPE')
+                    
+                BATTING_DICT[cTYPE_OF_SWING[result_row.type_of_swing]].update(data_dict)
+            
+            #User=0, Char=1, Swing=0
+            else:
+                CHAR_DICT[type_of_result].update(data_dict)
+
+        elif (type_of_result == 'Pitching' or type_of_result == 'Fielding' or type_of_result == 'Misc'):
+            if type_of_result not in CHAR_DICT:
+                CHAR_DICT[type_of_result] = {}
+            CHAR_DICT[type_of_result].update(data_dict)
+    
+    #User=0, Char=0, Swing=1
+    elif group_by_swing and type_of_result == 'Batting':
+        #Build batting
+        if type_of_result not in in_stat_dict:
+            in_stat_dict[type_of_result] = {}
+
+        if cTYPE_OF_SWING[result_row.type_of_swing] not in in_stat_dict[type_of_result]:
+            in_stat_dict[type_of_result][cTYPE_OF_SWING[result_row.type_of_swing]] = {}
+        elif cTYPE_OF_SWING[result_row.type_of_swing] in in_stat_dict[type_of_result]:
+            print('ERROR: FOUND PREVIOUS SWING TYPE')
+            
+        in_stat_dict[type_of_result][cTYPE_OF_SWING[result_row.type_of_swing]].update(data_dict)
+
+    #User=0, Char=0, Swing=0
+    else:
+        if type_of_result not in in_stat_dict:
+            in_stat_dict[type_of_result] = {}
+        in_stat_dict[type_of_result].update(data_dict)
+
+# Synthetic /detailed_stats/ rows as SQLAlchemy Rows: every user and character (and swing type for batting) once
+def detailed_stats_rows(users, group_by_user, group_by_char, group_by_swing):
+    stat_columns = ['outs', 'foul_hits', 'fair_hits', 'sour_hits', 'nice_hits', 'perfect_hits', 'singles', 'doubles',
+                    'triples', 'homeruns', 'sacflys', 'strikeouts', 'plate_appearances', 'rbi']
+    keys = (['user_id', 'username'] if group_by_user else []) + (['char_id', 'char_name'] if group_by_char else []) \
+        + (['type_of_swing'] if group_by_swing else []) + stat_columns
+    rows = list()
+    for user_id in range(users if group_by_user else 1):
+        for char_id in range(55 if group_by_char else 1):
+            for type_of_swing in (list(cTYPE_OF_SWING) if group_by_swing else [0]):
+                path = ([user_id, f'User{user_id}'] if group_by_user else []) + ([char_id, f'Char{char_id}'] if group_by_char else []) \
+                    + ([type_of_swing] if group_by_swing else [])
+                rows.append(tuple(path + [user_id + char_id + type_of_swing + column for column in range(len(stat_columns))]))
+    return keys, IteratorResult(SimpleResultMetaData(keys), iter(rows)).all()
+
+# Time building the /detailed_stats/ response from query rows with add_detailed_stats_rows against the old per row function
+def benchmark_detailed_stats_dict(app, args):
+    print(f'{"by_user/char/swing":<20} {"rows":>8} {"legacy ms":>10} {"builder ms":>11} {"speedup":>8}')
+    for group_by_user, group_by_char, group_by_swing in [(True, True, True), (True, True, False), (True, False, True), (False, True, True), (False, False, False)]:
+        keys, rows = detailed_stats_rows(args.users, group_by_user, group_by_char, group_by_swing)
+
+        legacy_timings = list()
+        builder_timings = list()
+        for _ in range(args.repeat):
+            legacy_dict = dict()
+            start = time.perf_counter()
+            for row in rows:
+                legacy_update_detailed_stats_dict(legacy_dict, 'Batting', row, group_by_user, group_by_char, group_by_swing)
+            legacy_timings.append((time.perf_counter() - start) * 1000)
+
+            builder_dict = dict()
+            start = time.perf_counter()
+            add_detailed_stats_rows(builder_dict, 'Batting', keys, rows, group_by_user, group_by_char, group_by_swing)
+            builder_timings.append((time.perf_counter() - start) * 1000)
+
+        if builder_dict != legacy_dict:
+            raise SystemExit(f'Output differs for by_user={group_by_user} by_char={group_by_char} by_swing={group_by_swing}')
+        legacy_ms = percentile(legacy_timings, 50)
+        builder_ms = percentile(builder_timings, 50)
+        flags = '/'.join(str(int(flag)) for flag in (group_by_user, group_by_char, group_by_swing))
+        print(f'{flags:<20} {len(rows):>8} {legacy_ms:>10.2f} {builder_ms:>11.2f} {legacy_ms / builder_ms:>7.1f}x')
+
+# Event filters as the joins event_fact replaced and as event_fact lookups. (name, joined condition, event_fact condition)
+EVENT_FACT_FILTERS = [
+    ('no filter', 'TRUE', 'TRUE'),
+    ('batter char', 'batter.char_id = :char_id', 'event_fact.batter_char_id = :char_id'),
+    ('pitcher user + contact', 'pitcher.user_id = :user_id AND contact.type_of_contact = ANY(:contact)',
+        'event_fact.pitcher_user_id = :user_id AND event_fact.type_of_contact = ANY(:contact)'),
+    ('fielder char + position', 'fielder.char_id = :char_id AND fielding.position = :position',
+        'event_fact.fielder_char_id = :char_id AND event_fact.fielder_position = :position'),
+    ('count + batter user', 'event.balls = 1 AND event.strikes = 2 AND batter.user_id = :user_id',
+        'event_fact.balls = 1 AND event_fact.strikes = 2 AND event_fact.batter_user_id = :user_id'),
+]
+
+EVENT_JOINS = (
+    'FROM event \n'
+    'JOIN pitch_summary AS pitch ON pitch.id = event.pitch_summary_id \n'
+    'LEFT JOIN contact_summary AS contact ON contact.id = pitch.contact_summary_id \n'
+    'LEFT JOIN fielding_summary AS fielding ON fielding.id = contact.fielding_summary_id \n'
+    'JOIN character_game_summary AS batter ON batter.id = event.batter_id \n'
+    'JOIN character_game_summary AS pitcher ON pitcher.id = event.pitcher_id \n'
+    'LEFT JOIN character_game_summary AS fielder ON fielder.id = fielding.fielder_character_game_summary_id \n'
+)
+
+# Time the /events/ filters against the joined summary tables and against event_fact, and check both find the same events
+def benchmark_event_fact(app, args):
+    with app.app_context():
+        params = db.session.execute(
+            'SELECT \n'
+            '   (SELECT batter_char_id FROM event_fact GROUP BY batter_char_id ORDER BY COUNT(*) DESC LIMIT 1) AS char_id, \n'
+            '   (SELECT pitcher_user_id FROM event_fact GROUP BY pitcher_user_id ORDER BY COUNT(*) DESC LIMIT 1) AS user_id, \n'
+            '   (SELECT fielder_position FROM event_fact WHERE fielder_position IS NOT NULL GROUP BY fielder_position ORDER BY COUNT(*) DESC LIMIT 1) AS position'
+        ).one()._asdict()
+        if params['char_id'] == None:
+            raise SystemExit('event_fact is empty (run populate_db, bulk-load or rollup-games first)')
+        params['contact'] = [1, 2, 3]
+
+        print(f'{"filter":<28} {"events":>8} {"joined ms":>10} {"event_fact ms":>14} {"speedup":>8}')
+        for name, joined_condition, fact_condition in EVENT_FACT_FILTERS:
+            queries = [
+                text(f'SELECT event.id {EVENT_JOINS}WHERE {joined_condition} ORDER BY event.id'),
+                text(f'SELECT event_fact.event_id FROM event_fact WHERE event_fact.pitch_summary_id IS NOT NULL AND {fact_condition} ORDER BY event_fact.event_id'),
+            ]
+            timings = [list(), list()]
+            results = [None, None]
+            for _ in range(args.requests):
+                for index, query in enumerate(queries):
+                    start = time.perf_counter()
+                    results[index] = db.session.execute(query, params).scalars().all()
+                    timings[index].append((time.perf_counter() - start) * 1000)
+            if results[0] != results[1]:
+                raise SystemExit(f'{name}: event_fact found {len(results[1])} events, the joins {len(results[0])}')
+            joined_ms = percentile(timings[0], 50)
+            fact_ms = percentile(timings[1], 50)
+            print(f'{name:<28} {len(results[0]):>8} {joined_ms:>10.2f} {fact_ms:>14.2f} {joined_ms / fact_ms:>7.1f}x')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rio Web benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    populate_db_parser = subparsers.add_parser('populate_db', help='Replay stat files through /populate_db/ and report games/sec')
+    populate_db_parser.add_argument('--files', default='json/games/*.json', help='Glob of stat files to replay')
+    populate_db_parser.add_argument('--repeat', type=int, default=1, help='Number of times to replay each file')
+    populate_db_parser.set_defaults(run=benchmark_populate_db)
+
+    games_parser = subparsers.add_parser('games', help='Report p50/p99 latency of /games/ for a set of filters')
+    games_parser.add_argument('--requests', type=int, default=100, help='Requests per filter set')
+    games_parser.set_defaults(run=benchmark_games)
+
+    games_scaling_parser = subparsers.add_parser('games_scaling', help='Check /games/ latency grows linearly with the number of games returned')
+    games_scaling_parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200, 400, 800, 1600], help='limit_games values to time')
+    games_scaling_parser.add_argument('--requests', type=int, default=20, help='Requests per size')
+    games_scaling_parser.add_argument('--max-ratio', type=float, default=1.5, help='Fail if ms/game grows by this factor between the two largest sizes')
+    games_scaling_parser.set_defaults(run=benchmark_games_scaling)
+
+    detailed_stats_dict_parser = subparsers.add_parser('detailed_stats_dict', help='Compare building the /detailed_stats/ response with the old per row function')
+    detailed_stats_dict_parser.add_argument('--users', type=int, default=200, help='Users in the by_user results')
+    detailed_stats_dict_parser.add_argument('--repeat', type=int, default=10, help='Builds per grouping')
+    detailed_stats_dict_parser.set_defaults(run=benchmark_detailed_stats_dict)
+
+    event_fact_parser = subparsers.add_parser('event_fact', help='Compare the /events/ filters on the joined summary tables against event_fact')
+    event_fact_parser.add_argument('--requests', type=int, default=20, help='Runs per filter')
+    event_fact_parser.set_defaults(run=benchmark_event_fact)
+
+    args = parser.parse_args()
+    args.run(init_app(), args)
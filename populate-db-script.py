@@ -1,7 +1,8 @@
-import os
-import subprocess
-import random
+import argparse
+import glob
 import json
+import os
+import tempfile
 print('\n')
 print(
   f'             @@@@@@@@@@@@@@@@\n'        
@@ -22,87 +23,124 @@ print(
 print('               Batters up!')
 print('\n')
 
+# Loads a directory of stat files straight into the database set up by the POSTGRES_* env vars.
+# Worker processes read, validate and transform the files in parallel and the writers COPY each batch in.
+# Stat files are validated like /populate_db/ requests: the current stat file format, with the rio keys of
+# verified users in the community of an existing TagSet (ex. a dump of a production instance).
+#
+# A fresh dev database can be filled with --sample-data instead, which registers the json/sample-users.json users
+# and a Sample TagSet and loads the stat files in app/tests/data (json/games predates the stat file format) as
+# games between them.
+#
+#   python3 populate-db-script.py --sample-data
+#   python3 populate-db-script.py --setup --games ./stat_files/
+parser = argparse.ArgumentParser(description='Backfill stat files into the Rio database')
+parser.add_argument('--games', default=None, help='Directory of stat file .json files in the current stat file format')
+parser.add_argument('--sample-data', action='store_true', help='Run --setup, register the sample users and load app/tests/data (or --games) as their games')
+parser.add_argument('--sample-games', type=int, default=20, help='Games --sample-data builds from each stat file')
+parser.add_argument('--workers', type=int, default=2, help='Processes preparing stat files (0 prepares them in this process)')
+parser.add_argument('--writers', type=int, default=1, help='Connections writing prepared batches')
+parser.add_argument('--batch-size', type=int, default=None, help='Stat files written per transaction')
+parser.add_argument('--skip-history', action='store_true', help='Only write stat rows, no GameHistory or elo updates')
+parser.add_argument('--setup', action='store_true', help='Create the Character tables, user groups and official communities first')
+args = parser.parse_args()
+if args.games == None and not args.sample_data:
+    parser.error('provide --games or --sample-data')
 
-# Create Character table
-print('Creating Character Table:')
-subprocess.run(["curl", "-i", 
-    "--header", "Content-Type: application/json",
-    "--request", "POST", 
-    "http://127.0.0.1:5000/create_character_table/"
-    ])
+SAMPLE_USERS = './json/sample-users.json'
+SAMPLE_GAMES = './app/tests/data/'
+SAMPLE_TAG_SET = 'Sample'
 
+from app import init_app, db
+from app.models import Character, Community, CommunityUser, RioUser, TagSet
+from app.consts import cBULK_LOAD_BATCH
 
-print('\n')
+# Register (or reuse) the sample users as verified members of the official community, and a TagSet for their games.
+# Returns their rio keys and the TagSet id
+def create_sample_users():
+    community = Community.query.filter_by(name='ProjectRio').first()
+    with open(SAMPLE_USERS, 'r') as f:
+        sample_users = json.load(f)['Users']
 
-# Create Default Tags
-print('Creating Tags:')
-subprocess.run(["curl", "-i", 
-    "--header", "Content-Type: application/json",
-    "--request", "POST", 
-    "http://127.0.0.1:5000/create_tag_table/"
-    ])
+    rio_keys = list()
+    for sample_user in sample_users:
+        user = RioUser.query.filter_by(username=sample_user['Username']).first()
+        if user == None:
+            user = RioUser(sample_user['Username'], sample_user['Email'].lower(), sample_user['Password'])
+            user.verified = True
+            db.session.add(user)
+            db.session.commit()
+        if CommunityUser.query.filter_by(user_id=user.id, community_id=community.id).first() == None:
+            db.session.add(CommunityUser(user.id, community.id, False, False, True))
+            db.session.commit()
+        rio_keys.append(user.rio_key)
 
-print('\n')
+    tag_set = TagSet.query.filter_by(name=SAMPLE_TAG_SET).first()
+    if tag_set == None:
+        tag_set = TagSet(community.id, SAMPLE_TAG_SET, 'Season', 0, 2**31-1)
+        db.session.add(tag_set)
+        db.session.commit()
 
-# create 6 demo users
-f = open("./json/sample-users.json")
-users = json.load(f)
-print("Creating Users: ")
-for user in users["Users"]:
-    user_json = json.dumps(user)
-    print(user_json)
-
-    # Errors are suppressed because we are using fake email addresses, which return 502s and clog up the console.
-    # View statuses on the Localhost pipenv terminal.
-    subprocess.run(["curl", "-i", 
-    "--header", "Content-Type: application/json",
-    "--request", "POST", 
-    "--data", user_json, 
-    "http://127.0.0.1:5000/register/"
-    ],
-    stdout=subprocess.DEVNULL,
-    stderr=subprocess.STDOUT
-    )
-  
-print('\n')
-  
-print('Uploading Game data:')
-for file_path in os.listdir("./json/games/"):
-    if file_path != '.DS_Store':
-        editted_file = False
-        with open("./json/games/" + file_path, 'r') as f:
+    return rio_keys, tag_set.id
+
+# Write copies of each sample stat file to out_dir, one day apart, as games between rotating pairs of sample users.
+# GameIDs follow the file's so running it again skips the games already loaded.
+# Older files label rosters 'Team 0/1 Roster N'
+def write_sample_games(paths, copies, rio_keys, tag_set_id, out_dir):
+    for path in paths:
+        with open(path, 'r') as f:
             game_data = json.load(f)
 
-            # Check if JSON file has replaced player names, if not, replace them.
-            demo_players = random.sample(users["Users"], 2)
-            away_player = game_data['Away Player'] 
-            home_player = game_data['Home Player']
-
-            if game_data['Away Player'][0:8] != 'DemoUser':
-                game_data['Away Player'] = demo_players[0]['Username']
-                away_player = demo_players[0]['Username']
-                editted_file = True
-
-            if game_data['Home Player'][0:8] != 'DemoUser':
-                game_data['Home Player'] = demo_players[1]['Username']
-                home_player = demo_players[1]['Username']
-                eddited_file = True
-
-        if editted_file == True:
-            with open("./json/games/" + file_path, 'w') as f:
-                f.write(json.dumps(game_data, indent=4))
-
-        print(file_path + ': ' + game_data["GameID"] + ' Players: ' + away_player + ' vs ' + home_player)
-
-        # send POST request with editted game data
-        # Output suppressed to clearly see which users were selected. 
-        # View statuses on the Localhost pipenv terminal.
-        proc = subprocess.run(["curl", "-i",
-        "--header", "Content-type: application/json",
-        "--request", "POST",
-        "--data", f'@./json/games/{file_path}',
-        "http://127.0.0.1:5000/populate_db/"
-        ],
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.STDOUT
-        )  
\ No newline at end of file
+        character_game_stats = dict()
+        for key, value in game_data['Character Game Stats'].items():
+            key = key.replace('Team 0 Roster', 'Away Roster').replace('Team 1 Roster', 'Home Roster')
+            character_game_stats[key] = value
+        game_data['Character Game Stats'] = character_game_stats
+        game_data['TagSetID'] = tag_set_id
+
+        game_id = int(game_data['GameID'].replace(',', ''), 16)
+        date_start = int(game_data['Date - Start'])
+        date_end = int(game_data['Date - End'])
+        name = os.path.splitext(os.path.basename(path))[0]
+        for index in range(copies):
+            game_data['GameID'] = format(game_id + index, 'x')
+            game_data['Date - Start'] = str(date_start + index * 86400)
+            game_data['Date - End'] = str(date_end + index * 86400)
+            game_data['Away Player'] = rio_keys[index % len(rio_keys)]
+            game_data['Home Player'] = rio_keys[(index + 1) % len(rio_keys)]
+            with open(os.path.join(out_dir, f'{name}_{index:04}.json'), 'w') as f:
+                json.dump(game_data, f)
+
+app = init_app()
+# Imported by init_app, which registers its CLI command on the app
+from app.bulk_load import run_backfill, format_backfill_report
+with app.app_context():
+    if (args.setup or args.sample_data) and Character.query.first() == None:
+        from app.views.db_setup import create_character_tables, create_default_groups, create_official_infrastructure
+        print('Creating Character Tables, Groups and Official Communities')
+        create_character_tables()
+        create_default_groups()
+        create_official_infrastructure()
+        print('\n')
+
+    paths = sorted(glob.glob(os.path.join(args.games if args.games != None else SAMPLE_GAMES, '*.json')))
+
+    sample_dir = None
+    if args.sample_data:
+        print('Registering sample users')
+        rio_keys, tag_set_id = create_sample_users()
+        sample_dir = tempfile.TemporaryDirectory()
+        write_sample_games(paths, args.sample_games, rio_keys, tag_set_id, sample_dir.name)
+        paths = sorted(glob.glob(os.path.join(sample_dir.name, '*.json')))
+        print('\n')
+
+    print(f'Uploading Game data: {len(paths)} stat files, {args.workers} workers, {args.writers} writers')
+
+    def progress(report):
+        print(f'{len(report["games"])} games loaded, {len(report["failures"])} failures')
+
+    batch_size = args.batch_size if args.batch_size != None else cBULK_LOAD_BATCH
+    report = run_backfill(app, paths, args.workers, args.writers, batch_size, args.skip_history, progress)
+    print(format_backfill_report(report))
+    if sample_dir != None:
+        sample_dir.cleanup()
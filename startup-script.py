@@ -36,7 +36,7 @@ if exists('./app/db.sqlite3'):
     #remove old database instance
     subprocess.run(['rm', './app/db.sqlite3'])
     print('db.sqlite3 instance deleted...')
-    print('Run python3 populate-db-script.py in a separate window to populate a new instance.')
+    print('Run python3 populate-db-script.py --sample-data in a separate window to populate a new instance.')
 
 
 print('Starting server...')
@@ -1,6 +1,6 @@
 from app import init_app
 
-app = init_app()
+app = init_app(run_ingest_workers=True)
 
 if __name__ == '__main__':
     app.run()
\ No newline at end of file